@@ -11,6 +11,12 @@ from hylaa.util import Freezable
 class HylaaSettings(Freezable):
     'Settings for the computation'
 
+    # waiting list orders (see engine.WaitingList). Deaggregated states are always popped before aggregated ones.
+    ORDER_FIFO = 0 # first-in, first-out
+    ORDER_EARLIEST = 1 # smallest total_steps first
+    ORDER_MODE = 2 # states in the same mode are popped consecutively (by mode name)
+    ORDER_ERROR_FIRST = 3 # fewest discrete transitions to an error mode first
+
     def __init__(self, step, max_time, plot_settings=None):
         if plot_settings is None:
             plot_settings = PlotSettings()
@@ -27,20 +33,31 @@ class HylaaSettings(Freezable):
 
         self.add_guard_during_aggregation = True # add guard constraints during aggregation
         self.add_box_during_aggregation = True # add box constraints during aggregation
-        #self.trim_redundant_inv_constraints = True # perform redundant invariant trimming
+        self.trim_redundant_inv_constraints = True # perform redundant invariant trimming
+        self.redundant_constraint_threshold = 32 # num star constraints where redundant constraint removal starts
         self.process_urgent_guards = False # should urgent transition (where 0 time elapses in a mode) be allowed?
         self.stop_when_error_reachable = True # should we stop computing immediately when an error mode is reached?
+        self.waiting_list_order = HylaaSettings.ORDER_FIFO # an ORDER_* value, or a function star -> sort key
+        self.subsumption = False # drop states contained in an explored star in the same mode (see SubsumptionIndex)
 
         self.print_output = True # print status and waiting list information to stdout
         self.skip_step_times = False # print the times at each step
 
         self.opt_decompose_lp = True # use the Minkowski sum decomposition optimization (for systems with inputs)
         self.opt_warm_start_lp = True # reuse the LP instances between guard checks (warm-start LP)
+        self.opt_box_support = True # use closed-form support functions (no LPs) for box star predicates and inputs
+        self.guard_check_threads = None # number of threads for per-transition guard lps (requires a thread-safe glpk)
+        self.parallel_processes = None # number of worker processes for continuous posts (requires PLOT_NONE)
+        self.input_window_steps = None # if set, guard lps keep the exact input effects of only the recent steps
+
+        self.checkpoint_filename = None # if set, the engine state is periodically saved here (see HylaaEngine.resume())
+        self.checkpoint_interval_secs = 600.0 # minimum time between checkpoints (one is also saved when finished)
 
         self.do_guard_strengthening = True
 
         self.counter_example_filename = None # the counter-example filename to create on errors: "counterexample.py"
         self.simulation = SimulationSettings(step)
+        self.lp = LpSettings()
 
         self.freeze_attrs()
 
@@ -65,6 +82,28 @@ class SimulationSettings(Freezable):
 
         self.freeze_attrs()
 
+class LpSettings(Freezable):
+    'linear programming settings container'
+
+    EXPORT_LP = 0 # cplex lp format
+    EXPORT_MPS = 1 # fixed mps format
+
+    def __init__(self):
+        self.memo_size = 8 # number of minimize() results cached per lp instance (0 = disabled)
+
+        # basis matrix entries which change by at most this amount are not re-uploaded to the lp (0 = exact)
+        self.basis_update_tol = 0.0
+
+        self.trace_filename = None # record all lp operations to this binary trace file (see hylaa/lptrace.py)
+
+        # minimize() calls exceeding these thresholds are exported to slow_lp_dir (None = disabled)
+        self.slow_lp_secs = None
+        self.slow_lp_iterations = None
+        self.slow_lp_dir = 'slow_lps'
+        self.slow_lp_format = LpSettings.EXPORT_LP
+
+        self.freeze_attrs()
+
 class PlotSettings(Freezable):
     'plot settings container'
 
@@ -85,6 +124,7 @@ class PlotSettings(Freezable):
         self.label = LabelSettings() # plot title, axis labels, font sizes, ect.
 
         self.num_angles = 512 # how many evenly-spaced angles to put into plot_vecs
+        self.exact_projection = True # compute exact polygons by walking edges, rather than using num_angles
 
         self.extra_lines = None # extra lines to draw on the plot. list of lists of x,y pairs
         self.min_frame_time = 0.025 # max 40 fps. This allows multiple frames to be drawn at once if they're fast.
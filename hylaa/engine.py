@@ -4,19 +4,30 @@ Stanley Bak
 Aug 2016
 '''
 
-from collections import OrderedDict
+import heapq
+import itertools
+import multiprocessing
+import os
+import time
+from collections import OrderedDict, deque
+
 import numpy as np
 
 from hylaa.plotutil import PlotManager
 from hylaa.star import Star
 from hylaa.star import init_hr_to_star, init_constraints_to_star
 from hylaa.starutil import InitParent, AggregationParent, ContinuousPostParent, DiscretePostParent, make_aggregated_star
+from hylaa.starutil import SubsumptionIndex, reset_guard_pool
 from hylaa.hybrid_automaton import LinearHybridAutomaton, LinearAutomatonMode, LinearConstraint, HyperRectangle
 from hylaa.timerutil import Timers
 from hylaa.containers import HylaaSettings, PlotSettings, HylaaResult
 from hylaa.glpk_interface import LpInstance
+from hylaa import serialize
 import hylaa.openblas as openblas
 
+# checkpoint file format version (see HylaaEngine.save_checkpoint())
+CHECKPOINT_VERSION = 1
+
 class HylaaEngine(object):
     'main computation object. initialize and call run()'
 
@@ -36,15 +47,27 @@ class HylaaEngine(object):
         self.settings = hylaa_settings
         self.num_vars = len(ha.variables)
 
+        LpInstance.settings = hylaa_settings.lp
+
         if self.settings.plot.plot_mode != PlotSettings.PLOT_NONE:
             Star.init_plot_vecs(self.num_vars, self.settings.plot)
 
         self.plotman = PlotManager(self, self.settings.plot)
 
         # computation
-        self.waiting_list = WaitingList()
+        subsumption_index = None
+
+        if hylaa_settings.subsumption:
+            exact_only = hylaa_settings.aggregation and hylaa_settings.deaggregation
+            subsumption_index = SubsumptionIndex(exact_only=exact_only)
+
+        self.waiting_list = WaitingList(hylaa_settings.waiting_list_order, ha, subsumption_index)
 
         self.cur_state = None # a Star object
+        self.popped_star = None # with settings.subsumption, the popped star of the current continuous post
+
+        # in parallel worker processes, discrete successors are recorded here rather than being processed
+        self.successor_records = None
         self.cur_step_in_mode = None # how much dwell time in current continuous post
         self.max_steps_remaining = None # bound on num steps left in current mode ; assigned on pop
         self.cur_sim_bundle = None # set on pop
@@ -52,6 +75,11 @@ class HylaaEngine(object):
         self.reached_error = False
         self.result = None # a HylaaResult... assigned on run()
 
+        # checkpoints (see save_checkpoint() and resume())
+        self.horizon_posts = [] # (post_star, state, step_in_mode) of the posts which stopped at the time horizon
+        self.resumed_posts = [] # posts from a checkpoint, continued before popping from the waiting list
+        self.last_checkpoint_time = time.time()
+
         if self.settings.plot.plot_mode == PlotSettings.PLOT_NONE:
             self.settings.simulation.use_presimulation = True
 
@@ -81,7 +109,7 @@ class HylaaEngine(object):
     def is_finished(self):
         'is the computation finished'
 
-        rv = self.waiting_list.is_empty() and self.cur_state is None
+        rv = self.waiting_list.is_empty() and self.cur_state is None and len(self.resumed_posts) == 0
 
         return rv or (self.settings.stop_when_error_reachable and self.reached_error)
 
@@ -90,84 +118,124 @@ class HylaaEngine(object):
 
         assert state is not None
 
+        lp_solutions = None
+
+        if self.settings.guard_check_threads is not None:
+            lp_solutions = state.get_guard_intersections()
+
         for i in xrange(len(state.mode.transitions)):
-            lp_solution = state.get_guard_intersection(i)
+            if lp_solutions is not None:
+                lp_solution = lp_solutions[i]
+            else:
+                lp_solution = state.get_guard_intersection(i)
 
             if lp_solution is not None:
                 transition = state.mode.transitions[i]
-                successor_mode = transition.to_mode
+                discrete_prestate_star, successor = self.make_discrete_successor(state, transition)
+                violation_basis_vec = lp_solution[state.num_dims:]
+
+                if not self.add_discrete_successor(discrete_prestate_star, transition, successor,
+                                                   violation_basis_vec):
+                    # a refinement occurred, stop processing guards
+                    self.cur_state = state = None
+                    self.popped_star = None # the post was not completed, so it can't subsume other states
+                    break
+
+    def make_discrete_successor(self, state, transition):
+        '''
+        compute the discrete successor of the state with the given transition, whose guard the state intersects
+
+        returns a pair (discrete_prestate_star, successor), where successor is None if it's infeasible
+        '''
 
-                if successor_mode.is_error:
-                    assert isinstance(state.parent, ContinuousPostParent)
+        # copy the current star to be the frozen pre-state of the discrete post operation
+        discrete_prestate_star = state.clone()
+        discrete_prestate_star.parent = ContinuousPostParent(state.mode, state.parent.star)
 
-                    # check it it came from an aggregation (and deaggregation is enabled)
-                    if not isinstance(state.parent.star.parent, AggregationParent) or not self.settings.deaggregation:
-                        self.reached_error = True
+        discrete_poststate_star = state.clone()
+        discrete_poststate_star.fast_forward_steps = 0 # reset fast forward on transitions
 
-                        if self.settings.stop_when_error_reachable:
-                            raise FoundErrorTrajectory("Found error trajectory")
+        if all([abs(val) < 1e-9 for val in state.center]):
+            basis_center = state.center
+        else:
+            basis_center = state.vector_to_star_basis(state.center)
 
-                # copy the current star to be the frozen pre-state of the discrete post operation
-                discrete_prestate_star = state.clone()
-                discrete_prestate_star.parent = ContinuousPostParent(state.mode, state.parent.star)
+        discrete_poststate_star.parent = DiscretePostParent(state.mode, discrete_prestate_star,
+                                                            basis_center, transition)
 
-                discrete_poststate_star = state.clone()
-                discrete_poststate_star.fast_forward_steps = 0 # reset fast forward on transitions
+        # add each of the guard conditions to discrete_poststate_star
+        for lin_con in transition.condition_list:
 
-                if all([abs(val) < 1e-9 for val in state.center]):
-                    basis_center = state.center
-                else:
-                    basis_center = state.vector_to_star_basis(state.center)
+            # first, convert the condition to the star's basis
+
+            # basis vectors (non-transpose) * standard_condition
+            basis_influence = np.dot(state.basis_matrix, lin_con.vector)
+            center_value = np.dot(state.center, lin_con.vector)
+            remaining_value = lin_con.value - center_value
 
-                discrete_poststate_star.parent = DiscretePostParent(state.mode, discrete_prestate_star,
-                                                                    basis_center, transition)
+            basis_lc = LinearConstraint(basis_influence, remaining_value)
+            discrete_poststate_star.add_basis_constraint(basis_lc)
 
-                # add each of the guard conditions to discrete_poststate_star
-                for lin_con in transition.condition_list:
+        if transition.reset_matrix is not None:
+            raise RuntimeError("only empty resets are currently supported")
 
-                    # first, convert the condition to the star's basis
+        # there may be minor errors when converting the guard to the star's basis, so
+        # re-check for feasibility
+        successor = None
 
-                    # basis vectors (non-transpose) * standard_condition
-                    basis_influence = np.dot(state.basis_matrix, lin_con.vector)
-                    center_value = np.dot(state.center, lin_con.vector)
-                    remaining_value = lin_con.value - center_value
+        if discrete_poststate_star.is_feasible():
+            # convert origin offset to star basis and add to basis_center
+            successor = discrete_poststate_star
+            #successor.start_center = successor.center
 
-                    basis_lc = LinearConstraint(basis_influence, remaining_value)
-                    discrete_poststate_star.add_basis_constraint(basis_lc)
+            successor.center_into_constraints(basis_center)
 
-                if transition.reset_matrix is not None:
-                    raise RuntimeError("only empty resets are currently supported")
+            #self.plotman.cache_star_verts(successor) # do this before committing temp constriants
 
-                # there may be minor errors when converting the guard to the star's basis, so
-                # re-check for feasibility
+            successor.start_basis_matrix = state.basis_matrix
+            #successor.basis_matrix = None # gets assigned from sim_bundle on pop
 
-                if discrete_poststate_star.is_feasible():
-                    violation_basis_vec = lp_solution[state.num_dims:]
+            successor.mode = transition.to_mode
 
-                    if not self.settings.aggregation or not self.settings.deaggregation or \
-                       self.has_counterexample(state, violation_basis_vec, state.total_steps):
+        return discrete_prestate_star, successor
 
-                        # convert origin offset to star basis and add to basis_center
-                        successor = discrete_poststate_star
-                        #successor.start_center = successor.center
+    def add_discrete_successor(self, state, transition, successor, violation_basis_vec):
+        '''
+        process a discrete successor from make_discrete_successor(): check if an error mode was reached, and add the
+        successor (if it's not None) to the waiting list, unless counter-example guided refinement finds that
+        the guard intersection came from aggregation. state is the star at the time of the guard intersection.
+
+        returns False if a refinement occurred, in which case the rest of the continuous post should be skipped
+        '''
 
-                        successor.center_into_constraints(basis_center)
+        rv = True
 
-                        #self.plotman.cache_star_verts(successor) # do this before committing temp constriants
+        if self.successor_records is not None:
+            self.successor_records.append((state, transition, successor, violation_basis_vec))
+            return rv
 
-                        successor.start_basis_matrix = state.basis_matrix
-                        #successor.basis_matrix = None # gets assigned from sim_bundle on pop
+        if transition.to_mode.is_error:
+            assert isinstance(state.parent, ContinuousPostParent)
 
-                        successor.mode = transition.to_mode
+            # check it it came from an aggregation (and deaggregation is enabled)
+            if not isinstance(state.parent.star.parent, AggregationParent) or not self.settings.deaggregation:
+                self.reached_error = True
 
-                        if self.settings.aggregation:
-                            self.waiting_list.add_aggregated(successor, self.settings)
-                        else:
-                            self.waiting_list.add_deaggregated(successor)
-                    else:
-                        # a refinement occurred, stop processing guards
-                        self.cur_state = state = None
-                        break
+                if self.settings.stop_when_error_reachable:
+                    raise FoundErrorTrajectory("Found error trajectory")
+
+        if successor is not None:
+            if not self.settings.aggregation or not self.settings.deaggregation or \
+               self.has_counterexample(state, violation_basis_vec, state.total_steps):
+
+                if self.settings.aggregation:
+                    self.waiting_list.add_aggregated(successor, self.settings)
+                else:
+                    self.waiting_list.add_deaggregated(successor)
+            else:
+                rv = False
+
+        return rv
 
     def deaggregate_star(self, star, steps_in_cur_star):
         'split an aggregated star in half, and place each half into the waiting list'
@@ -248,20 +316,49 @@ class HylaaEngine(object):
         return rv
 
     def do_step_pop(self, output):
-        'do a step where we pop from the waiting list'
+        'do a step where we pop from the waiting list (posts resumed from a checkpoint are continued first)'
 
         self.plotman.state_popped() # reset certain per-mode plot variables
 
         self.cur_step_in_mode = 0
 
-        if output:
-            self.waiting_list.print_stats()
+        if len(self.resumed_posts) > 0:
+            post_star, state, step_in_mode = self.resumed_posts.pop(0)
+
+            self.continue_post(post_star, state, step_in_mode, output)
+        else:
+            if output:
+                self.waiting_list.print_stats()
 
-        parent_star = self.waiting_list.pop()
+            parent_star = self.waiting_list.pop()
 
-        if output:
-            print "Removed state in mode '{}' at time {:.2f}; fast_forward_steps = {}".format(
-                parent_star.mode.name, parent_star.total_steps * self.settings.step, parent_star.fast_forward_steps)
+            if output:
+                print "Removed state in mode '{}' at time {:.2f}; fast_forward_steps = {}".format(
+                    parent_star.mode.name, parent_star.total_steps * self.settings.step,
+                    parent_star.fast_forward_steps)
+
+            self.start_post(parent_star, output)
+
+    def continue_post(self, post_star, state, step_in_mode, output):
+        '''
+        continue the continuous post of post_star (the popped star), where state is the star at step_in_mode steps
+        into the post. If state is None (it had input effects, so it couldn't be saved), the post is restarted.
+        '''
+
+        if state is None:
+            self.start_post(post_star, output)
+        else:
+            if output:
+                print "Continuing state in mode '{}' at time {:.2f}".format(
+                    state.mode.name, state.total_steps * self.settings.step)
+
+            self.max_steps_remaining = self.settings.num_steps - post_star.total_steps + post_star.fast_forward_steps
+            self.cur_sim_bundle = post_star.mode.get_sim_bundle(self.settings, post_star, self.max_steps_remaining)
+            self.cur_step_in_mode = step_in_mode
+            self.cur_state = state
+
+    def start_post(self, parent_star, output):
+        'start the continuous post of a star removed from the waiting list'
 
         self.max_steps_remaining = self.settings.num_steps - parent_star.total_steps + parent_star.fast_forward_steps
         self.cur_sim_bundle = parent_star.mode.get_sim_bundle(self.settings, parent_star, self.max_steps_remaining)
@@ -271,6 +368,9 @@ class HylaaEngine(object):
         state.parent = ContinuousPostParent(state.mode, parent_star)
         self.cur_state = state
 
+        if self.waiting_list.subsumption_index is not None and not state.mode.is_error:
+            self.popped_star = parent_star
+
         if self.settings.process_urgent_guards:
             self.check_guards(self.cur_state)
 
@@ -297,6 +397,11 @@ class HylaaEngine(object):
         state = self.cur_state
 
         if state.total_steps >= self.settings.num_steps:
+            if self.settings.checkpoint_filename is not None:
+                # checkpoints include the post, so it can be continued if the time horizon is increased
+                saved_state = None if state.has_input_effects() else state
+                self.horizon_posts.append((state.parent.star, saved_state, self.cur_step_in_mode))
+
             self.cur_state = None
         else:
             sim_bundle = self.cur_sim_bundle
@@ -309,29 +414,43 @@ class HylaaEngine(object):
 
             new_basis_matrix, new_center = sim_bundle.get_vecs_origin_at_step(sim_step, self.max_steps_remaining)
 
-            state.update_from_sim(new_basis_matrix, new_center)
+            # the input effects at the previous step, which is the state's current basis matrix (except for the
+            # first step in the mode, where the state's basis matrix may not come from this simulation)
+            input_effects = None
+
+            if state.mode.num_inputs > 0 and state.start_basis_matrix is None and self.cur_step_in_mode > 0:
+                input_effects = sim_bundle.get_input_effects_at_step(sim_step - 1)
+
+            state.update_from_sim(new_basis_matrix, new_center, input_effects)
 
             # increment step
             self.cur_step_in_mode += 1
             state.total_steps += 1
 
-            self.check_guards(self.cur_state)
+            # with inputs held over several steps, the guards and invariant are only checked at the steps which end
+            # a hold interval (see Star.ends_input_hold())
+            if state.ends_input_hold():
+                self.check_guards(self.cur_state)
 
-            # refinement may occur while checking guards, which sets cur_state to None
-            if self.cur_state is None:
-                if output:
-                    print "After checking guards, state was refined away."
-            else:
-                is_still_feasible, inv_vio_star_list = self.cur_state.trim_to_invariant()
+                # refinement may occur while checking guards, which sets cur_state to None
+                if self.cur_state is None:
+                    if output:
+                        print "After checking guards, state was refined away."
+                else:
+                    is_still_feasible, inv_vio_star_list = self.cur_state.trim_to_invariant()
 
-                for star in inv_vio_star_list:
-                    self.plotman.add_inv_violation_star(star)
+                    for star in inv_vio_star_list:
+                        self.plotman.add_inv_violation_star(star)
 
-                if not is_still_feasible:
-                    self.cur_state = None
+                    if not is_still_feasible:
+                        self.cur_state = None
 
         # after continuous post completes
         if self.cur_state is None:
+            if self.popped_star is not None:
+                self.waiting_list.subsumption_index.add(self.popped_star)
+                self.popped_star = None
+
             if self.plotman.settings.plot_mode == PlotSettings.PLOT_INTERACTIVE:
                 self.plotman.interactive.paused = True
 
@@ -343,6 +462,7 @@ class HylaaEngine(object):
         while True:
             output = self.settings.print_output
             self.plotman.reset_temp_polys()
+            prev_state = self.cur_state
 
             if self.cur_state is None:
                 self.do_step_pop(output)
@@ -352,6 +472,9 @@ class HylaaEngine(object):
                 except FoundErrorTrajectory: # this gets raised if an error mode is reachable and we should quit early
                     pass
 
+            if prev_state is not None and prev_state is not self.cur_state:
+                prev_state.release_lps()
+
             if self.cur_state is not None:
                 skipped_plot = self.plotman.plot_current_star(self.cur_state)
 
@@ -365,22 +488,251 @@ class HylaaEngine(object):
             else:
                 print "Result: Error modes are NOT reachable.\n"
 
+        self.checkpoint_if_due()
+
+    def checkpoint_if_due(self):
+        '''
+        save a checkpoint if settings.checkpoint_filename is set and either the computation is finished or
+        settings.checkpoint_interval_secs have elapsed since the last one. The current state can't be saved once it
+        has input effects, so in that case periodic checkpoints wait until its continuous post is done.
+        '''
+
+        filename = self.settings.checkpoint_filename
+
+        if filename is not None:
+            if self.is_finished():
+                self.save_checkpoint(filename)
+            elif self.cur_state is None or not self.cur_state.has_input_effects():
+                if time.time() - self.last_checkpoint_time >= self.settings.checkpoint_interval_secs:
+                    self.save_checkpoint(filename)
+
+    def save_checkpoint(self, filename):
+        '''
+        save the state of the computation to a file, so it can be continued with resume()
+
+        This includes the waiting list (with the subsumption index), the current continuous post, the posts which
+        stopped at the time horizon, the simulations of each mode and the timers. The file is replaced atomically,
+        so a run killed while saving leaves the previous checkpoint.
+        '''
+
+        Timers.tic('checkpoint')
+
+        cur_post = None
+
+        if self.cur_state is not None:
+            # a current state with input effects is saved by restarting its post (see continue_post())
+            if self.cur_state.has_input_effects():
+                cur_post = (self.cur_state.parent.star, None, 0)
+            else:
+                cur_post = (self.cur_state.parent.star, self.cur_state, self.cur_step_in_mode)
+
+        sim_caches = {}
+
+        for name, mode in self.hybrid_automaton.modes.iteritems():
+            sim_cache = mode.get_sim_cache()
+
+            if sim_cache is not None:
+                sim_caches[name] = sim_cache
+
+        checkpoint = {'version': CHECKPOINT_VERSION,
+                      'step': self.settings.step,
+                      'num_steps': self.settings.num_steps,
+                      'waiting_list': self.waiting_list,
+                      'cur_post': cur_post,
+                      'popped_star': self.popped_star if cur_post is not None and cur_post[1] is not None else None,
+                      'resumed_posts': self.resumed_posts,
+                      'horizon_posts': self.horizon_posts,
+                      'reached_error': self.reached_error,
+                      'sim_caches': sim_caches,
+                      'timers': Timers.get_totals()}
+
+        data = serialize.dumps(checkpoint, self.hybrid_automaton, self.settings)
+        temp_filename = filename + '.tmp'
+
+        with open(temp_filename, 'wb') as f:
+            f.write(data)
+
+        os.rename(temp_filename, filename)
+        self.last_checkpoint_time = time.time()
+
+        Timers.toc('checkpoint')
+
+        if self.settings.print_output:
+            print "Saved checkpoint to '{}' ({:.1f} MB)".format(filename, len(data) / 1024.0 / 1024.0)
+
+    def load_checkpoint(self, filename):
+        '''
+        load the state of the computation from a file created with save_checkpoint(). If the time horizon in the
+        settings is longer than when the checkpoint was saved, the posts which stopped at the old horizon are resumed.
+        '''
+
+        with open(filename, 'rb') as f:
+            checkpoint = serialize.loads(f.read(), self.hybrid_automaton, self.settings)
+
+        if checkpoint['version'] != CHECKPOINT_VERSION:
+            raise RuntimeError("Checkpoint '{}' has unsupported version {}".format(filename, checkpoint['version']))
+
+        if checkpoint['step'] != self.settings.step:
+            raise RuntimeError("Checkpoint '{}' used step {}, but settings.step is {}".format(
+                filename, checkpoint['step'], self.settings.step))
+
+        self.waiting_list = checkpoint['waiting_list']
+        self.waiting_list.set_order(self.settings.waiting_list_order, self.hybrid_automaton)
+
+        self.popped_star = checkpoint['popped_star']
+        self.resumed_posts = checkpoint['resumed_posts']
+        self.horizon_posts = checkpoint['horizon_posts']
+        self.reached_error = checkpoint['reached_error']
+
+        if checkpoint['cur_post'] is not None:
+            self.resumed_posts.insert(0, checkpoint['cur_post'])
+
+        if self.settings.num_steps > checkpoint['num_steps']:
+            self.resumed_posts += self.horizon_posts
+            self.horizon_posts = []
+
+        for name, sim_cache in checkpoint['sim_caches'].iteritems():
+            self.hybrid_automaton.modes[name].set_sim_cache(self.settings, sim_cache)
+
+        Timers.add_totals(checkpoint['timers'])
+        self.last_checkpoint_time = time.time()
+
     def run_to_completion(self):
         'run the computation until it finishes (without plotting)'
 
         Timers.tic("total")
 
-        while not self.is_finished():
-            self.do_step()
+        if self.settings.parallel_processes is not None:
+            self.run_parallel()
+        else:
+            while not self.is_finished():
+                self.do_step()
 
         Timers.toc("total")
 
+        LpInstance.close_trace()
+
         if self.settings.print_output:
+            if self.waiting_list.subsumption_index is not None:
+                print "Subsumed states: {}".format(self.waiting_list.subsumption_index.num_subsumed)
+
             LpInstance.print_stats()
             Timers.print_stats()
 
         self.result.time = Timers.timers["total"].total_secs
 
+    def run_parallel(self):
+        '''
+        run the computation, with the continuous posts of the popped states done in settings.parallel_processes
+        worker processes
+
+        Each worker computes a post and its discrete successors (see _parallel_post()). The aggregation and
+        deaggregation decisions are made here, by processing the successors in the order of their steps, as in
+        check_guards(). The pool is kept full by popping a new state as each result is processed, and the results
+        are processed in the order the states were popped, so the output doesn't depend on the worker timing.
+        '''
+
+        assert self.settings.plot.plot_mode == PlotSettings.PLOT_NONE, "parallel_processes requires PLOT_NONE"
+        assert self.settings.lp.trace_filename is None, "lp traces are not supported with parallel_processes"
+
+        output = self.settings.print_output
+        num_processes = self.settings.parallel_processes
+        ha = self.hybrid_automaton
+        num_posts = num_steps = 0
+        worker_secs = 0.0
+
+        # the workers are forked, so the automaton (with strengthened guards) and settings don't need pickling
+        pool = multiprocessing.Pool(num_processes, initializer=_init_parallel_worker,
+                                    initargs=(ha, self.settings))
+
+        # a post resumed from a checkpoint is continued in this process
+        while (self.cur_state is not None or len(self.resumed_posts) > 0) and not self.is_finished():
+            self.do_step()
+
+        in_flight = deque() # (parent_star, async_result), in the order they were popped
+
+        try:
+            while True:
+                while len(in_flight) < num_processes and not self.is_finished():
+                    parent_star = self.waiting_list.pop()
+
+                    if output:
+                        print "Removed state in mode '{}' at time {:.2f}; fast_forward_steps = {}".format(
+                            parent_star.mode.name, parent_star.total_steps * self.settings.step,
+                            parent_star.fast_forward_steps)
+
+                    if parent_star.mode.is_error:
+                        if output:
+                            print "Mode '{}' was an error mode; skipping.".format(parent_star.mode.name)
+
+                        continue
+
+                    # the worker doesn't need the star's parents
+                    task_star = parent_star.clone()
+                    task_star.parent = None
+                    data = serialize.dumps(task_star, ha, self.settings)
+
+                    in_flight.append((parent_star, pool.apply_async(_parallel_post, (data,))))
+
+                if not in_flight or (self.settings.stop_when_error_reachable and self.reached_error):
+                    break
+
+                parent_star, async_result = in_flight.popleft()
+                records, horizon_states, post_steps, post_secs = serialize.loads(async_result.get(), ha,
+                                                                                 self.settings)
+                num_posts += 1
+                num_steps += post_steps
+                worker_secs += post_secs
+
+                for state, step_in_mode in horizon_states:
+                    if state is not None:
+                        state.parent.star = parent_star
+
+                    self.horizon_posts.append((parent_star, state, step_in_mode))
+
+                self.process_post_records(parent_star, records)
+
+                # the posts still running in the workers are saved as resumed posts, which restarts them
+                resumed_posts = self.resumed_posts
+                self.resumed_posts = resumed_posts + [(star, None, 0) for star, _ in in_flight]
+
+                try:
+                    self.checkpoint_if_due()
+                finally:
+                    self.resumed_posts = resumed_posts
+        finally:
+            pool.terminate()
+            pool.join()
+
+        if output:
+            print "Parallel posts: {} ({} steps, {:.2f} worker secs)".format(num_posts, num_steps, worker_secs)
+
+            if self.reached_error:
+                print "Result: Error modes are reachable.\n"
+            else:
+                print "Result: Error modes are NOT reachable.\n"
+
+    def process_post_records(self, parent_star, records):
+        '''
+        process the discrete successors recorded during a parallel continuous post of parent_star. Records after
+        a refinement are skipped, like the rest of the post in check_guards().
+        '''
+
+        completed = True
+
+        try:
+            for state, transition, successor, violation_basis_vec in records:
+                state.parent.star = parent_star
+
+                if not self.add_discrete_successor(state, transition, successor, violation_basis_vec):
+                    completed = False
+                    break
+        except FoundErrorTrajectory: # an error mode is reachable and we should quit early
+            completed = False
+
+        if completed and self.waiting_list.subsumption_index is not None:
+            self.waiting_list.subsumption_index.add(parent_star)
+
     def run(self, init_list):
         '''
         run the computation
@@ -402,6 +754,30 @@ class HylaaEngine(object):
         # convert init states to stars
         self.load_waiting_list(init_list)
 
+        self.run_waiting_list()
+
+    def resume(self, checkpoint_filename):
+        '''
+        continue a computation from a checkpoint (see settings.checkpoint_filename)
+
+        The automaton and settings should be the same as in the original run, except that the time horizon
+        (settings.num_steps) may be increased, in which case the continuous posts which stopped at the original
+        horizon are continued. Plots only include the resumed part of the computation.
+        '''
+
+        if self.settings.do_guard_strengthening:
+            self.hybrid_automaton.do_guard_strengthening()
+
+        self.result = HylaaResult()
+        self.plotman.create_plot()
+
+        self.load_checkpoint(checkpoint_filename)
+
+        self.run_waiting_list()
+
+    def run_waiting_list(self):
+        'run the computation from the loaded waiting list (see run() and resume())'
+
         if self.settings.plot.plot_mode == PlotSettings.PLOT_NONE:
             # run without plotting
             self.run_to_completion()
@@ -421,24 +797,107 @@ class WaitingList(object):
     go into the aggregrated ones, but may be later split and placed into the
     deaggregated list. Thus, deaggregated states, if they exist, are popped first.
     The states here are Star instances
+
+    Both kinds of states are kept in heaps, ordered by order (a HylaaSettings.ORDER_* value, or a function
+    which maps a star to its sort key), with ties broken first-in, first-out. The automaton ha is needed
+    for HylaaSettings.ORDER_ERROR_FIRST.
+
+    If subsumption_index (a SubsumptionIndex) is given, added states which are contained in an explored state are
+    dropped. The engine adds the explored states to the index.
     '''
 
-    def __init__(self):
+    def __init__(self, order=HylaaSettings.ORDER_FIFO, ha=None, subsumption_index=None):
         self.aggregated_mode_to_state = OrderedDict()
-        self.deaggregated_list = []
+        self.subsumption_index = subsumption_index
+
+        # heap entries are (key, seq, push_count, mode_name, star). Aggregated entries become stale when the
+        # mode's star is replaced or its key changes, and are skipped in pop()
+        self._deaggregated_heap = []
+        self._aggregated_heap = []
+        self._aggregated_seq = {} # mode name -> seq of the aggregated state
+        self._seq_counter = itertools.count()
+        self._push_counter = itertools.count()
+
+        self._key_func = None
+        self.set_order(order, ha)
+
+    def __getstate__(self):
+        'get the state for pickling (see HylaaEngine.save_checkpoint()). The order is not included, see set_order()'
+
+        rv = self.__dict__.copy()
+        rv['_key_func'] = None
+        rv['_seq_counter'] = next(self._seq_counter)
+        rv['_push_counter'] = next(self._push_counter)
+
+        return rv
+
+    def __setstate__(self, state):
+        'restore the pickled state'
+
+        self.__dict__.update(state)
+        self._seq_counter = itertools.count(state['_seq_counter'])
+        self._push_counter = itertools.count(state['_push_counter'])
+
+    def set_order(self, order, ha=None):
+        '''
+        set the order in which states are popped (see the class docstring). The states already in the waiting list
+        are reordered, keeping their first-in, first-out ties.
+        '''
+
+        if callable(order):
+            self._key_func = order
+        elif order == HylaaSettings.ORDER_FIFO:
+            self._key_func = lambda star: 0
+        elif order == HylaaSettings.ORDER_EARLIEST:
+            self._key_func = lambda star: star.total_steps
+        elif order == HylaaSettings.ORDER_MODE:
+            self._key_func = lambda star: star.mode.name
+        elif order == HylaaSettings.ORDER_ERROR_FIRST:
+            assert ha is not None, "ORDER_ERROR_FIRST requires the hybrid automaton"
+            distances = ha.get_error_distances()
+            self._key_func = lambda star: distances.get(star.mode.name, float('inf'))
+        else:
+            raise RuntimeError("Unknown waiting list order: {}".format(order))
+
+        self._deaggregated_heap = [(self._key_func(star), seq, push_count, mode_name, star)
+                                   for _, seq, push_count, mode_name, star in self._deaggregated_heap]
+        heapq.heapify(self._deaggregated_heap)
+
+        # this also drops the stale aggregated entries
+        self._aggregated_heap = []
+
+        for mode_name, star in self.aggregated_mode_to_state.iteritems():
+            self._push(self._aggregated_heap, star, self._aggregated_seq[mode_name])
+
+    @property
+    def deaggregated_list(self):
+        'the deaggregated states, in the order they will be popped'
+
+        return [entry[-1] for entry in sorted(self._deaggregated_heap)]
+
+    def _push(self, heap, star, seq):
+        'push a heap entry for the star'
+
+        entry = (self._key_func(star), seq, next(self._push_counter), star.mode.name, star)
+        heapq.heappush(heap, entry)
 
     def pop(self):
         'pop a state from the waiting list'
 
-        assert len(self.aggregated_mode_to_state) + len(self.deaggregated_list) > 0, \
-            "pop() called on empty waiting list"
+        assert not self.is_empty(), "pop() called on empty waiting list"
 
-        if len(self.deaggregated_list) > 0:
-            rv = self.deaggregated_list[0]
-            self.deaggregated_list = self.deaggregated_list[1:]
+        if len(self._deaggregated_heap) > 0:
+            rv = heapq.heappop(self._deaggregated_heap)[-1]
         else:
-            # pop from aggregated list
-            rv = self.aggregated_mode_to_state.popitem(last=False)[1]
+            # pop from aggregated heap, skipping stale entries
+            while True:
+                key, _, _, mode_name, rv = heapq.heappop(self._aggregated_heap)
+
+                if self.aggregated_mode_to_state.get(mode_name) is rv and key == self._key_func(rv):
+                    break
+
+            del self.aggregated_mode_to_state[mode_name]
+            del self._aggregated_seq[mode_name]
 
             assert isinstance(rv, Star)
 
@@ -447,10 +906,10 @@ class WaitingList(object):
     def print_stats(self):
         'print statistics about the waiting list'
 
-        total = len(self.aggregated_mode_to_state) + len(self.deaggregated_list)
+        total = len(self.aggregated_mode_to_state) + len(self._deaggregated_heap)
 
         print "Waiting list contains {} states ({} aggregated and {} deaggregated):".format(
-            total, len(self.aggregated_mode_to_state), len(self.deaggregated_list))
+            total, len(self.aggregated_mode_to_state), len(self._deaggregated_heap))
 
         counter = 1
 
@@ -470,14 +929,15 @@ class WaitingList(object):
     def is_empty(self):
         'is the waiting list empty'
 
-        return len(self.deaggregated_list) == 0 and len(self.aggregated_mode_to_state) == 0
+        return len(self._deaggregated_heap) == 0 and len(self.aggregated_mode_to_state) == 0
 
     def add_deaggregated(self, state):
         'add a state to the deaggregated list'
 
         assert isinstance(state, Star)
 
-        self.deaggregated_list.append(state)
+        if self.subsumption_index is None or not self.subsumption_index.is_subsumed(state):
+            self._push(self._deaggregated_heap, state, next(self._seq_counter))
 
     def add_aggregated(self, new_star, hylaa_settings):
         'add a state to the aggregated map'
@@ -485,15 +945,22 @@ class WaitingList(object):
         assert isinstance(new_star, Star)
         assert new_star.basis_matrix is not None
 
+        if self.subsumption_index is not None and self.subsumption_index.is_subsumed(new_star):
+            return
+
         mode_name = new_star.mode.name
 
         existing_state = self.aggregated_mode_to_state.get(mode_name)
 
         if existing_state is None:
+            seq = self._aggregated_seq[mode_name] = next(self._seq_counter)
             self.aggregated_mode_to_state[mode_name] = new_star
+            self._push(self._aggregated_heap, new_star, seq)
         else:
             # combine the two stars
             cur_star = existing_state
+            seq = self._aggregated_seq[mode_name]
+            old_key = self._key_func(cur_star)
 
             cur_star.total_steps = min(cur_star.total_steps, new_star.total_steps)
 
@@ -504,11 +971,71 @@ class WaitingList(object):
                 # parent is already an aggregation. add it to the list of parents and eat it
                 cur_star.parent.stars.append(new_star)
                 cur_star.eat_star(new_star)
+
+                # the star keeps its place in the fifo order, but its key may have changed
+                if self._key_func(cur_star) != old_key:
+                    self._push(self._aggregated_heap, cur_star, seq)
             else:
                 # create the aggregation parent
                 hull_star = make_aggregated_star([cur_star, new_star], hylaa_settings)
 
                 self.aggregated_mode_to_state[mode_name] = hull_star
+                self._push(self._aggregated_heap, hull_star, seq)
+
+# the engine used to compute continuous posts in a parallel worker process (see HylaaEngine.run_parallel())
+_worker_engine = None
+
+def _init_parallel_worker(ha, settings):
+    'initialize a parallel worker process'
+
+    global _worker_engine # pylint: disable=global-statement
+
+    # the guard threads of the parent process don't exist in the forked worker, and workers can't create pools
+    reset_guard_pool()
+    settings.print_output = False
+    settings.simulation.threads = 1
+    settings.simulation.stdout = False
+
+    _worker_engine = HylaaEngine(ha, settings)
+    _worker_engine.waiting_list.subsumption_index = None
+
+def _parallel_post(data):
+    '''
+    compute the continuous post of a star (pickled with serialize.dumps()) in a parallel worker process
+
+    returns the pickled tuple (records, horizon_states, num_steps, secs), where records is the list of recorded
+    discrete successors (see HylaaEngine.add_discrete_successor()) and horizon_states has the (state, step_in_mode)
+    where the post stopped at the time horizon, if it's saved for checkpoints (see HylaaEngine.horizon_posts)
+    '''
+
+    start = time.time()
+    engine = _worker_engine
+    star = serialize.loads(data, engine.hybrid_automaton, engine.settings)
+
+    engine.successor_records = []
+    engine.cur_step_in_mode = 0
+    engine.start_post(star, False)
+
+    while engine.cur_state is not None:
+        engine.do_step_continuous_post(False)
+
+    records = engine.successor_records
+    engine.successor_records = None
+
+    horizon_states = [(state, step_in_mode) for _, state, step_in_mode in engine.horizon_posts]
+    engine.horizon_posts = []
+
+    # the coordinator links the records to its own copy of the popped star
+    for state, _, _, _ in records:
+        state.parent.star = None
+
+    for state, _ in horizon_states:
+        if state is not None:
+            state.parent.star = None
+
+    rv = (records, horizon_states, engine.cur_step_in_mode, time.time() - start)
+
+    return serialize.dumps(rv, engine.hybrid_automaton, engine.settings)
 
 class FoundErrorTrajectory(RuntimeError):
     'gets thrown if a trajectory to the error states is found when settings.stop_when_error_reachable is True'
@@ -6,19 +6,81 @@ GLPK python <-> C++ interface
 
 import ctypes
 import os
+import threading
+import time
+import traceback
+import weakref
+from collections import OrderedDict, deque
 
 import numpy as np
 from numpy.ctypeslib import ndpointer
 
 from hylaa.timerutil import Timers
 from hylaa.util import Freezable, get_script_path
+from hylaa.containers import LpSettings
+from hylaa import lptrace
 
 class LpInstance(Freezable):
-    'Linear programm instance using the hylaa python/c++ glpk interface'
+    '''
+    Linear programm instance using the hylaa python/c++ glpk interface
+
+    A reduced lp (reduced=True) has no standard variables or equality rows; it contains only the basis variables
+    and basis constraints. Minimizing a standard-basis direction d becomes minimizing (basis_matrix * d) over the
+    basis variables, so updating the basis matrix only changes the objective. Reduced lps do not support
+    standard constraints or input stars.
+    '''
+
+    # lp roles, used to group per-lp statistics
+    ROLE_OTHER = 'other'
+    ROLE_GUARD_NO_INPUT = 'guard no-input'
+    ROLE_GUARD_INPUT = 'guard input'
+    ROLE_COMBINED = 'combined'
+    ROLE_STAR_PLOT = 'star plot'
+    ROLE_INVARIANT = 'invariant'
+    ROLE_AGGREGATION = 'aggregation'
+    ROLE_SUBSUMPTION = 'subsumption'
+    ROLE_FEASIBILITY = 'feasibility'
+
+    # glpk statuses used for reduced lps
+    _GLP_BS = 1 # basic variable
+    _GLP_NU = 3 # non-basic variable on its upper bound
+    _GLP_NS = 5 # non-basic fixed variable
 
     # static member (library)
     _lib = None
 
+    # static settings, assigned by the engine
+    settings = LpSettings()
+
+    # static memoization statistics (accumulated from each instance in _harvest_stats)
+    _memo_hits = 0
+    _memo_misses = 0
+
+    # lock for the static statistics, since lps may be used from multiple threads
+    _stats_lock = threading.Lock()
+
+    # thread-local data: submit is set in threads whose lps should be deleted in the same thread
+    _thread_local = threading.local()
+
+    # (home thread, lp_data) for lps garbage-collected in another thread, when the home thread has no submit
+    # function (like the main thread). These get deleted the next time an lp is created in the home thread.
+    _deferred_deletes = []
+    _deferred_lock = threading.RLock() # reentrant, since garbage collection may run while it's held
+
+    # static LpTraceWriter, used when settings.trace_filename is set
+    _trace = None
+
+    # number of slow lps exported
+    _num_slow_lps = 0
+
+    # per-role statistics: role -> np.array([solves, iterations, infeasible, secs])
+    _role_stats = OrderedDict()
+
+    # (role, stats delta) of lps harvested in __del__, added to the totals in _harvest_all(). __del__ can't take
+    # _stats_lock, since garbage collection may run in a thread which holds it (deque.append is atomic)
+    _pending_stats = deque()
+    _live_instances = weakref.WeakSet() # for collecting statistics from lps which haven't been deleted yet
+
     @staticmethod
     def _init_static():
         'open the library (if not opened already) and initialize the static members'
@@ -37,19 +99,31 @@ class LpInstance(Freezable):
             LpInstance._del_lp.restype = None
             LpInstance._del_lp.argtypes = [ctypes.c_void_p]
 
-            # void updateBasisMatrix(void* lpdata, double* matrix, int w, int h)
+            # int updateBasisMatrix(void* lpdata, double* matrix, int w, int h)
             LpInstance._update_basis_matrix = lib.updateBasisMatrix
             LpInstance._update_basis_matrix.restype = ctypes.c_int
             LpInstance._update_basis_matrix.argtypes = \
                 [ctypes.c_void_p, ndpointer(ctypes.c_double, flags="C_CONTIGUOUS"), ctypes.c_int, ctypes.c_int]
 
+            # void setBasisUpdateTolerance(void* lpdata, double tol)
+            LpInstance._set_basis_update_tolerance = lib.setBasisUpdateTolerance
+            LpInstance._set_basis_update_tolerance.restype = None
+            LpInstance._set_basis_update_tolerance.argtypes = [ctypes.c_void_p, ctypes.c_double]
+
             # void addBasisConstraint(void* lpdata, double* aVec, int aVecLen, double bVal)
             LpInstance._add_basis_constraint = lib.addBasisConstraint
             LpInstance._add_basis_constraint.restype = None
             LpInstance._add_basis_constraint.argtypes = \
                 [ctypes.c_void_p, ndpointer(ctypes.c_double, flags="C_CONTIGUOUS"), ctypes.c_int, ctypes.c_double]
 
-            # void addBasisConstraint(void* lpdata, double* aVec, int aVecLen, double bVal)
+            # void addBasisConstraints(void* lpdata, double* aMat, int numRows, int aVecLen, double* bVec)
+            LpInstance._add_basis_constraints = lib.addBasisConstraints
+            LpInstance._add_basis_constraints.restype = None
+            LpInstance._add_basis_constraints.argtypes = \
+                [ctypes.c_void_p, ndpointer(ctypes.c_double, flags="C_CONTIGUOUS"), ctypes.c_int, ctypes.c_int,
+                 ndpointer(ctypes.c_double, flags="C_CONTIGUOUS")]
+
+            # void addStandardConstraint(void* lpdata, double* aVec, int aVecLen, double bVal)
             LpInstance._add_standard_constraint = lib.addStandardConstraint
             LpInstance._add_standard_constraint.restype = None
             LpInstance._add_standard_constraint.argtypes = \
@@ -65,12 +139,49 @@ class LpInstance(Freezable):
                  ndpointer(ctypes.c_double, flags="C_CONTIGUOUS"), ctypes.c_int,
                  ndpointer(ctypes.c_double, flags="C_CONTIGUOUS"), ctypes.c_int, ctypes.c_int]
 
+            LpInstance._update_last_input_star = lib.updateLastInputStar
+            LpInstance._update_last_input_star.restype = None
+            LpInstance._update_last_input_star.argtypes = \
+                [ctypes.c_void_p, ndpointer(ctypes.c_double, flags="C_CONTIGUOUS"), ctypes.c_int, ctypes.c_int]
+
             # int minimize(void* lpdata, double* direction, int dirLen, double* result, int resLen)
             LpInstance._minimize = lib.minimize
             LpInstance._minimize.restype = ctypes.c_int
             LpInstance._minimize.argtypes = [ctypes.c_void_p, ndpointer(ctypes.c_double, flags="C_CONTIGUOUS"), \
                 ctypes.c_int, ndpointer(ctypes.c_double, flags="C_CONTIGUOUS"), ctypes.c_int]
 
+            # int minimizeBasis(void* lpdata, double* direction, int dirLen, double* result, int resLen)
+            LpInstance._minimize_basis = lib.minimizeBasis
+            LpInstance._minimize_basis.restype = ctypes.c_int
+            LpInstance._minimize_basis.argtypes = [ctypes.c_void_p, ndpointer(ctypes.c_double, flags="C_CONTIGUOUS"), \
+                ctypes.c_int, ndpointer(ctypes.c_double, flags="C_CONTIGUOUS"), ctypes.c_int]
+
+            # int minimizeBasisBatch(void* lpdata, double* directions, int numDirs, int dirLen, double* results,
+            #                        int resLen, char* rowStats, int rowStatsLen, char* colStats, int colStatsLen)
+            LpInstance._minimize_basis_batch = lib.minimizeBasisBatch
+            LpInstance._minimize_basis_batch.restype = ctypes.c_int
+            LpInstance._minimize_basis_batch.argtypes = [ctypes.c_void_p, \
+                ndpointer(ctypes.c_double, flags="C_CONTIGUOUS"), ctypes.c_int, ctypes.c_int, \
+                ndpointer(ctypes.c_double, flags="C_CONTIGUOUS"), ctypes.c_int, \
+                ndpointer(ctypes.c_int8, flags="C_CONTIGUOUS"), ctypes.c_int, \
+                ndpointer(ctypes.c_int8, flags="C_CONTIGUOUS"), ctypes.c_int]
+
+            # int getLastIterations(void* lpdata)
+            LpInstance._get_last_iterations = lib.getLastIterations
+            LpInstance._get_last_iterations.restype = ctypes.c_int
+            LpInstance._get_last_iterations.argtypes = [ctypes.c_void_p]
+
+            # int getStats(void* lpdata, double* store, int storeLen)
+            LpInstance._get_stats = lib.getStats
+            LpInstance._get_stats.restype = ctypes.c_int
+            LpInstance._get_stats.argtypes = [ctypes.c_void_p, ndpointer(ctypes.c_double, flags="C_CONTIGUOUS"),
+                                              ctypes.c_int]
+
+            # int writeLp(void* lpdata, const char* filename, int mps)
+            LpInstance._write_lp = lib.writeLp
+            LpInstance._write_lp.restype = ctypes.c_int
+            LpInstance._write_lp.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int]
+
             # void getColStatuses(void* lpdata, char* store, int storeLen)
             LpInstance._get_col_statuses = lib.getColStatuses
             LpInstance._get_col_statuses.restype = ctypes.c_int
@@ -129,30 +240,296 @@ class LpInstance(Freezable):
             LpInstance._test.restype = None
             LpInstance._test.argtypes = []
 
-    def __init__(self, num_standard_vars, num_basis_vars):
+    def __init__(self, num_standard_vars, num_basis_vars, reduced=False):
         LpInstance._init_static()
+        LpInstance._delete_deferred()
+
+        self.reduced = reduced
+        self.lp_data = LpInstance._init_lp(0 if reduced else num_standard_vars, num_basis_vars)
 
-        self.lp_data = LpInstance._init_lp(num_standard_vars, num_basis_vars)
+        # operation recording
+        self.trace = LpInstance._get_trace() # LpTraceWriter or None
+        self.trace_id = None
+
+        if self.trace is not None:
+            self.trace_id = self.trace.new_lp_id()
+            self.trace.write(lptrace.OP_CREATE, self.trace_id, [num_standard_vars, num_basis_vars, reduced])
+
+        if LpInstance.settings.basis_update_tol != 0:
+            LpInstance._set_basis_update_tolerance(self.lp_data, LpInstance.settings.basis_update_tol)
 
         # put a copy of del_lp into the object for use in the destructor
         self.del_lp = LpInstance._del_lp
 
         # for error-checking
-        self.num_standard_vars = None
-        self.num_basis_vars = None
+        self.num_standard_vars = num_standard_vars if reduced else None
+        self.num_basis_vars = num_basis_vars if reduced else None
         self.num_inputs = None
         self.added_standard_constraint = False
 
+        # the last basis matrix object passed to update_basis_matrix()
+        self.basis_matrix = None
+
+        # weak reference to the object (star) using this lp, included when exporting slow lps
+        self._owner = None
+
+        # per-lp statistics are accumulated into the totals for the lp's current role
+        self.role = LpInstance.ROLE_OTHER
+        self.memo_hits = 0
+        self.memo_misses = 0
+        self._harvested_stats = np.zeros((6,), dtype=float) # native stats, memo hits, memo misses
+
+        with LpInstance._stats_lock:
+            LpInstance._live_instances.add(self)
+
+        # glpk objects should be deleted in the thread that created them (see set_thread_executor())
+        self._home_submit = getattr(LpInstance._thread_local, 'submit', None)
+        self._home_thread = threading.current_thread()
+
+        # memoization of minimize() results
+        self.revision = 0 # incremented by every operation that modifies the lp
+        self._memo = OrderedDict() # lru cache: (revision, direction bytes, result length) -> (is_feasible, result)
+        self._last_key = None # memo key of the last call to minimize()
+        self._solved_key = None # memo key of the solution currently held by glpk
+
         self.freeze_attrs()
 
     def __del__(self):
-        self.del_lp(self.lp_data)
-        self.lp_data = None
+        if self.trace is not None and self.trace.f is not None:
+            self.trace.write(lptrace.OP_DELETE, self.trace_id, [])
+
+        if LpInstance is not None and np is not None: # module globals may be cleared at interpreter exit
+            self._harvest_stats(pending=True)
+
+            if self.lp_data is not None and threading.current_thread() is not self._home_thread:
+                if self._home_submit is not None:
+                    self._home_submit(self.del_lp, self.lp_data)
+                else:
+                    with LpInstance._deferred_lock:
+                        LpInstance._deferred_deletes.append((self._home_thread, self.lp_data))
+
+                self.lp_data = None
+
+        if self.lp_data is not None:
+            self.del_lp(self.lp_data)
+            self.lp_data = None
+
+    @staticmethod
+    def _delete_deferred():
+        'delete the lps which were garbage-collected in other threads, but belong to the current thread'
+
+        if LpInstance._deferred_deletes:
+            cur_thread = threading.current_thread()
+
+            with LpInstance._deferred_lock:
+                mine = [lp_data for thread, lp_data in LpInstance._deferred_deletes if thread is cur_thread]
+                LpInstance._deferred_deletes = [(thread, lp_data) for thread, lp_data in LpInstance._deferred_deletes
+                                                if thread is not cur_thread]
+
+            for lp_data in mine:
+                LpInstance._del_lp(lp_data)
+
+    @staticmethod
+    def set_thread_executor(submit):
+        '''
+        called at the start of a worker thread. LpInstances created in this thread will be deleted in the thread
+        by calling submit(func, *args), which should queue func(*args) to run later in the thread.
+
+        This is needed since glpk objects should only be used by the thread that created them.
+        '''
+
+        LpInstance._thread_local.submit = submit
+
+    @staticmethod
+    def _get_trace():
+        'get the LpTraceWriter if operations should be recorded (opens the trace file if needed), or None'
+
+        filename = LpInstance.settings.trace_filename
+        trace = LpInstance._trace
+
+        if filename is None:
+            rv = None
+        elif trace is not None and trace.filename == filename:
+            rv = trace
+        else:
+            LpInstance.close_trace()
+            rv = LpInstance._trace = lptrace.LpTraceWriter(filename)
+
+        return rv
+
+    @staticmethod
+    def close_trace():
+        'stop recording lp operations, and close the trace file'
+
+        if LpInstance._trace is not None:
+            LpInstance._trace.close()
+            LpInstance._trace = None
+
+    def set_role(self, role):
+        'set the role of the lp (one of the LpInstance.ROLE_* constants), used for grouping statistics'
+
+        if role != self.role:
+            self._harvest_stats()
+            self.role = role
+
+    def _harvest_stats(self, pending=False):
+        '''
+        add the native per-lp statistics accumulated since the last harvest to the totals for the current role
+
+        if pending is True, the statistics are queued in _pending_stats rather than added (see __del__)
+        '''
+
+        cur_stats = np.zeros((6,), dtype=float)
+
+        if LpInstance._get_stats(self.lp_data, cur_stats, 4) != 0:
+            raise RuntimeError("get_stats failed")
+
+        cur_stats[4] = self.memo_hits
+        cur_stats[5] = self.memo_misses
+        delta = cur_stats - self._harvested_stats
+        self._harvested_stats = cur_stats
+
+        if pending:
+            LpInstance._pending_stats.append((self.role, delta))
+        else:
+            LpInstance._add_stats(self.role, delta)
+
+    @staticmethod
+    def _add_stats(role, delta):
+        'add a harvested statistics delta to the totals for the role'
+
+        with LpInstance._stats_lock:
+            role_stats = LpInstance._role_stats.get(role)
+
+            if role_stats is None:
+                role_stats = LpInstance._role_stats[role] = np.zeros((4,), dtype=float)
+
+            role_stats += delta[:4]
+            LpInstance._memo_hits += int(delta[4])
+            LpInstance._memo_misses += int(delta[5])
+
+    @staticmethod
+    def _harvest_all():
+        'harvest the statistics from all lps which are still alive, and add the pending statistics to the totals'
+
+        with LpInstance._stats_lock:
+            live_instances = list(LpInstance._live_instances)
+
+        # glpk objects should only be used by their home thread, so the lps of worker threads (see
+        # set_thread_executor()) are harvested by submitting the harvest to the thread, and waiting for it
+        cur_thread = threading.current_thread()
+        thread_lpis = OrderedDict() # home thread -> (submit, list of lps)
+
+        for lpi in live_instances:
+            if lpi._home_thread is cur_thread:
+                lpi._harvest_stats()
+            elif lpi._home_submit is not None and lpi._home_thread.is_alive():
+                thread_lpis.setdefault(lpi._home_thread, (lpi._home_submit, []))[1].append(lpi)
+
+        events = []
+
+        for submit, lpis in thread_lpis.itervalues():
+            event = threading.Event()
+            submit(LpInstance._harvest_in_thread, lpis, event)
+            events.append(event)
+
+        for event in events:
+            event.wait()
+
+        while True:
+            try:
+                role, delta = LpInstance._pending_stats.popleft()
+            except IndexError:
+                break
+
+            LpInstance._add_stats(role, delta)
+
+    @staticmethod
+    def _harvest_in_thread(lpis, event):
+        'harvest the statistics of lps in their home thread, and then set the event (see _harvest_all())'
+
+        try:
+            for lpi in lpis:
+                if lpi.lp_data is not None:
+                    lpi._harvest_stats()
+        finally:
+            event.set()
+
+    @staticmethod
+    def print_role_stats():
+        'print a table of lp statistics, grouped by lp role'
+
+        LpInstance._harvest_all()
+
+        if len(LpInstance._role_stats) > 0:
+            print "{:>16} {:>10} {:>12} {:>10} {:>10}".format("LP Role", "Solves", "Iterations", "Infeasible",
+                                                              "Secs")
+
+            for role, (solves, iterations, infeasible, secs) in LpInstance._role_stats.iteritems():
+                print "{:>16} {:>10d} {:>12d} {:>10d} {:>10.3f}".format(role, int(solves), int(iterations),
+                                                                         int(infeasible), secs)
+
+    def set_owner(self, owner):
+        'set the object (usually a Star) that uses this lp. A weak reference is stored.'
+
+        self._owner = weakref.ref(owner)
+
+    def write_lp(self, filename, mps=False):
+        'write the lp (including the last minimize objective) to a file, in cplex lp or mps format'
+
+        if LpInstance._write_lp(self.lp_data, filename, 1 if mps else 0) != 0:
+            raise RuntimeError("write_lp failed for file: {}".format(filename))
+
+    def _export_slow_lp(self, secs, iterations):
+        'export the lp after a slow minimize() call, along with its role (the call site), owner and stack'
+
+        settings = LpInstance.settings
+
+        with LpInstance._stats_lock:
+            LpInstance._num_slow_lps += 1
+            num = LpInstance._num_slow_lps
+
+            if not os.path.exists(settings.slow_lp_dir):
+                os.makedirs(settings.slow_lp_dir)
+
+        mps = settings.slow_lp_format == LpSettings.EXPORT_MPS
+        prefix = os.path.join(settings.slow_lp_dir, 'slow_lp_{:04d}'.format(num))
+
+        self.write_lp(prefix + ('.mps' if mps else '.lp'), mps=mps)
+
+        stack = traceback.extract_stack()[:-3] # skip frames inside LpInstance
+        owner = self._owner() if self._owner is not None else None
+
+        with open(prefix + '.txt', 'w') as f:
+            f.write("Slow LP: {:.3f} sec, {} iterations\n".format(secs, iterations))
+            f.write("Call site: {}\n".format(self.role))
+            f.write("Reduced: {}, standard vars: {}, basis vars: {}, inputs: {}\n".format(
+                self.reduced, self.num_standard_vars, self.num_basis_vars, self.num_inputs))
+
+            if owner is not None:
+                f.write("\nOwner:\n{}\n".format(owner))
+
+            f.write("\nStack:\n{}".format(''.join(traceback.format_list(stack))))
+
+    def _record(self, op, fields=()):
+        'record an operation in the trace file, if tracing is enabled'
+
+        if self.trace is not None:
+            self.trace.write(op, self.trace_id, fields)
 
     def get_row_statuses(self, store):
         'get the row statuses of the current lp solution, and store then in the passed-in variable'
 
+        full_store = store
         size = store.shape[0]
+        self._restore_solution()
+
+        if self.reduced:
+            # the equality rows of the full lp are fixed
+            num_eq = self.num_standard_vars
+            store[:num_eq] = LpInstance._GLP_NS
+            store = store[num_eq:]
+            size -= num_eq
 
         Timers.tic("lp get_statuses")
         rv = LpInstance._get_row_statuses(self.lp_data, store, size)
@@ -161,10 +538,21 @@ class LpInstance(Freezable):
         if rv != 0:
             raise RuntimeError("get_row_statuses failed")
 
+        self._record(lptrace.OP_GET_ROW_STATUSES, [full_store])
+
     def get_col_statuses(self, store):
         'get the col statuses of the current lp solution, and store then in the passed-in variable'
 
+        full_store = store
         size = store.shape[0]
+        self._restore_solution()
+
+        if self.reduced:
+            # the standard variables of the full lp are basic
+            num_std = self.num_standard_vars
+            store[:num_std] = LpInstance._GLP_BS
+            store = store[num_std:]
+            size -= num_std
 
         Timers.tic("lp get_statuses")
         rv = LpInstance._get_col_statuses(self.lp_data, store, size)
@@ -173,9 +561,14 @@ class LpInstance(Freezable):
         if rv != 0:
             raise RuntimeError("get_col_statuses failed")
 
+        self._record(lptrace.OP_GET_COL_STATUSES, [full_store])
+
     def set_last_input_statuses(self, row_statuses, col_statuses):
         'set the statuses for the last-added input star'
 
+        assert not self.reduced, "set_last_input_statuses() not supported in reduced lps"
+        self._record(lptrace.OP_SET_LAST_INPUT_STATUSES, [row_statuses, col_statuses])
+
         row_size = row_statuses.shape[0]
         col_size = col_statuses.shape[0]
 
@@ -183,9 +576,14 @@ class LpInstance(Freezable):
         LpInstance._set_last_input_statuses(self.lp_data, row_statuses, row_size, col_statuses, col_size)
         Timers.toc("lp set_statuses")
 
+        self._solved_key = None
+
     def set_standard_basis_statuses(self, row_statuses, col_statuses):
         'set the statuses for the standard variables / constraints and basis variables / constraints'
 
+        assert not self.reduced, "set_standard_basis_statuses() not supported in reduced lps"
+        self._record(lptrace.OP_SET_STANDARD_BASIS_STATUSES, [row_statuses, col_statuses])
+
         row_size = row_statuses.shape[0]
         col_size = col_statuses.shape[0]
 
@@ -193,12 +591,52 @@ class LpInstance(Freezable):
         LpInstance._set_standard_basis_statuses(self.lp_data, row_statuses, row_size, col_statuses, col_size)
         Timers.toc("lp set_statuses")
 
+        self._solved_key = None
+
+    def _modified(self):
+        'called whenever the lp is modified, which invalidates any memoized results'
+
+        self.revision += 1
+
+    def _restore_solution(self):
+        '''
+        if the last minimize() result came from the memo, glpk may hold a different solution. In this case,
+        re-solve the last direction so that the statuses read from glpk match the returned result.
+        '''
+
+        if self._last_key is not None and self._last_key != self._solved_key:
+            direction = np.frombuffer(self._last_key[1], dtype=float).copy()
+            result = np.zeros((self._last_key[2],), dtype=float)
+
+            self._minimize_glpk(direction, result, self._last_key)
+
     def update_basis_matrix(self, matrix):
-        'update the basis matrix in an lp'
+        '''
+        update the basis matrix in an lp
+
+        Each glpk problem owns its constraint matrix, so the lps of a star can't share one uploaded copy.
+        Instead, passing the same (unmodified) matrix object that was last uploaded is a no-op, and the
+        c++ side only rewrites the lp columns whose basis vector changed.
+        '''
 
         assert isinstance(matrix, np.ndarray)
         assert len(matrix.shape) == 2, "expected 2d matrix"
 
+        if matrix is self.basis_matrix:
+            return
+
+        # skipped updates aren't recorded, since replay can't tell that the matrix object is unchanged
+        self._record(lptrace.OP_UPDATE_BASIS_MATRIX, [matrix])
+
+        if self.reduced:
+            assert matrix.shape == (self.num_basis_vars, self.num_standard_vars), \
+                "basis matrix shape {} mismatch in reduced lp".format(matrix.shape)
+
+            # the lp itself doesn't change, only the objectives and results computed in minimize()
+            self.basis_matrix = matrix
+            self._modified()
+            return
+
         if self.num_standard_vars is None:
             self.num_basis_vars = matrix.shape[0]
             self.num_standard_vars = matrix.shape[1]
@@ -207,9 +645,14 @@ class LpInstance(Freezable):
         rv = LpInstance._update_basis_matrix(self.lp_data, matrix, matrix.shape[1], matrix.shape[0])
         Timers.toc("lp update_basis_matrix")
 
-        if rv != 0:
+        if rv < 0:
             raise RuntimeError("update_basis_matrix failed")
 
+        self.basis_matrix = matrix
+
+        if rv > 0:
+            self._modified()
+
     def add_basis_constraint(self, a_vec, b_val):
         '''add a constraint in the star's basis'''
 
@@ -223,28 +666,60 @@ class LpInstance(Freezable):
         assert w == self.num_basis_vars, "add_basis_constraint() had incorrect length: {}; expected: {}".format(
             w, self.num_basis_vars)
 
+        self._record(lptrace.OP_ADD_BASIS_CONSTRAINT, [a_vec, float(b_val)])
+
         Timers.tic("lp add_basis_constraint")
         LpInstance._add_basis_constraint(self.lp_data, a_vec, w, b_val)
         Timers.toc("lp add_basis_constraint")
 
+        self._modified()
+
+    def add_basis_constraints(self, a_mat, b_vec):
+        '''add several constraints in the star's basis at once: a_mat * basis_vars <= b_vec'''
+
+        a_mat = np.ascontiguousarray(a_mat, dtype=float)
+        b_vec = np.ascontiguousarray(b_vec, dtype=float)
+        h, w = a_mat.shape
+
+        assert self.num_inputs is None, "add_basis_constraints() called after adding inputs to LP"
+        assert w == self.num_basis_vars, "add_basis_constraints() had incorrect width: {}; expected: {}".format(
+            w, self.num_basis_vars)
+        assert b_vec.shape == (h,), "add_basis_constraints() expected {} values".format(h)
+
+        if self.trace is not None:
+            for row in xrange(h):
+                self._record(lptrace.OP_ADD_BASIS_CONSTRAINT, [a_mat[row], float(b_vec[row])])
+
+        Timers.tic("lp add_basis_constraint")
+        LpInstance._add_basis_constraints(self.lp_data, a_mat, h, w, b_vec)
+        Timers.toc("lp add_basis_constraint")
+
+        self._modified()
+
     def add_standard_constraint(self, a_vec, b_val):
         '''add a constraint in the standard basis'''
 
+        assert not self.reduced, "add_standard_constraint() not supported in reduced lps"
+
         if len(a_vec.shape) == 1:
             w = a_vec.shape[0]
         else:
             h, w = a_vec.shape
             assert h == 1, "expected 1-d vector in add_standard_constaint()"
 
+        self._record(lptrace.OP_ADD_STANDARD_CONSTRAINT, [a_vec, float(b_val)])
+
         Timers.tic("lp add_standard_constraint")
         LpInstance._add_standard_constraint(self.lp_data, a_vec, w, b_val)
         Timers.toc("lp add_standard_constraint")
 
         self.added_standard_constraint = True
+        self._modified()
 
     def add_input_star(self, a_matrix_t, b_vec, input_basis_matrix):
         '''minkowski add an input star into the lp (creates 1 new variable for each input)'''
 
+        assert not self.reduced, "add_input_star() not supported in reduced lps"
         assert len(a_matrix_t.shape) == 2
         assert len(b_vec.shape) == 1
 
@@ -259,12 +734,37 @@ class LpInstance(Freezable):
         else:
             assert input_basis_matrix.shape[0] == self.num_inputs, "num_inputs changed between calls to add_input_star"
 
+        self._record(lptrace.OP_ADD_INPUT_STAR, [a_matrix_t, b_vec, input_basis_matrix])
+
         Timers.tic("lp add_input_star")
         LpInstance._add_input_star(self.lp_data, a_matrix_t, a_matrix_t.shape[1], a_matrix_t.shape[0], b_vec, \
             b_vec.shape[0], input_basis_matrix, input_basis_matrix.shape[1], input_basis_matrix.shape[0])
 
         Timers.toc("lp add_input_star")
 
+        self._modified()
+
+    def update_last_input_star(self, input_basis_matrix):
+        '''replace the input basis matrix of the most recently added input star
+
+        This is used when inputs are held constant over several steps, where the effect of each step in a hold
+        interval is summed into the same input variables, rather than creating new ones.
+        '''
+
+        assert not self.reduced, "update_last_input_star() not supported in reduced lps"
+        assert self.num_inputs is not None, "update_last_input_star() called before add_input_star()"
+        assert input_basis_matrix.shape == (self.num_inputs, self.num_standard_vars), \
+            "input basis matrix shape mismatch in update_last_input_star()"
+
+        self._record(lptrace.OP_UPDATE_LAST_INPUT_STAR, [input_basis_matrix])
+
+        Timers.tic("lp update_last_input_star")
+        LpInstance._update_last_input_star(self.lp_data, input_basis_matrix, input_basis_matrix.shape[1], \
+            input_basis_matrix.shape[0])
+        Timers.toc("lp update_last_input_star")
+
+        self._modified()
+
     def print_lp(self):
         '''print the lp constraint matrix to stdout (a debugging function)'''
 
@@ -273,12 +773,18 @@ class LpInstance(Freezable):
     def set_standard_constraint_values(self, constraint_vals):
         '''set the values (right-hand-sides) of each of the standard var constraints'''
 
+        self._record(lptrace.OP_SET_STANDARD_CONSTRAINT_VALUES, [constraint_vals])
+
         LpInstance._set_standard_constraint_values(self.lp_data, constraint_vals, constraint_vals.shape[0])
+        self._modified()
 
     def set_basis_constraint_values(self, constraint_vals):
         '''set the values (right-hand-sides) of each of the basis var constraints'''
 
+        self._record(lptrace.OP_SET_BASIS_CONSTRAINT_VALUES, [constraint_vals])
+
         LpInstance._set_basis_constraint_values(self.lp_data, constraint_vals, constraint_vals.shape[0])
+        self._modified()
 
     def minimize(self, direction, result, error_if_infeasible=False):
         '''
@@ -290,20 +796,168 @@ class LpInstance(Freezable):
             "minimize objective length({}) should match number of standard variables({})".format(
                 len(direction), self.num_standard_vars)
 
-        dir_len, = direction.shape
         res_len, = result.shape
+        memo_size = LpInstance.settings.memo_size
+        key = None
+        cached = None
+
+        if memo_size > 0:
+            key = (self.revision, direction.tostring(), res_len)
+            cached = self._memo.pop(key, None)
+
+        if cached is not None:
+            self.memo_hits += 1
+            is_feasible, cached_result = cached
+
+            if is_feasible:
+                result[:] = cached_result
+        else:
+            self.memo_misses += 1
+            is_feasible = self._minimize_glpk(direction, result, key)
+
+            if key is not None:
+                cached = (is_feasible, result.copy() if is_feasible else None)
+
+                if len(self._memo) >= memo_size:
+                    self._memo.popitem(last=False)
 
-        Timers.tic("lp minimize")
-        res = LpInstance._minimize(self.lp_data, direction, dir_len, result, res_len)
-        Timers.toc("lp minimize")
+        if key is not None:
+            self._memo[key] = cached # (re)insert as most recently used
 
-        is_feasible = (res == 0)
+        self._last_key = key
+        self._record(lptrace.OP_MINIMIZE, [direction, is_feasible, result])
 
         if not is_feasible and error_if_infeasible:
             raise RuntimeError('minimize LP was infeasible when error_if_infeasible=True')
 
         return is_feasible
 
+    def _minimize_glpk(self, direction, result, key):
+        'minimize using glpk (no memoization), returns is_feasible'
+
+        dir_len, = direction.shape
+        res_len, = result.shape
+        start = time.time()
+
+        if self.reduced:
+            assert self.basis_matrix is not None, "update_basis_matrix() should be called before minimize()"
+
+            objective = np.dot(self.basis_matrix, direction)
+            basis_result = np.zeros(self.num_basis_vars)
+
+            Timers.tic("lp minimize")
+            res = LpInstance._minimize_basis(self.lp_data, objective, self.num_basis_vars, basis_result, \
+                self.num_basis_vars)
+            Timers.toc("lp minimize")
+
+            if res == 0:
+                # result is [standard variables, basis variables], as in the full lp
+                full_result = np.concatenate((np.dot(basis_result, self.basis_matrix), basis_result))
+                num = min(res_len, full_result.shape[0])
+                result[:num] = full_result[:num]
+        else:
+            Timers.tic("lp minimize")
+            res = LpInstance._minimize(self.lp_data, direction, dir_len, result, res_len)
+            Timers.toc("lp minimize")
+
+        self._solved_key = key
+        self._check_slow_lp(start)
+
+        return res == 0
+
+    def _check_slow_lp(self, start):
+        'export the lp if the solve which began at time start was slow (see LpSettings.slow_lp_secs)'
+
+        settings = LpInstance.settings
+
+        if settings.slow_lp_secs is not None or settings.slow_lp_iterations is not None:
+            secs = time.time() - start
+            iterations = LpInstance._get_last_iterations(self.lp_data)
+
+            if (settings.slow_lp_secs is not None and secs > settings.slow_lp_secs) or \
+                    (settings.slow_lp_iterations is not None and iterations > settings.slow_lp_iterations):
+                self._export_slow_lp(secs, iterations)
+
+    def minimize_batch(self, directions, results, statuses=None, error_if_infeasible=False):
+        '''
+        minimize in several directions (the rows of directions, in the standard basis), like calling minimize()
+        for each one, where row i of results gets the i-th result. For reduced lps, this is a single native call
+        where each solve is warm-started from the previous one. Results are not memoized.
+
+        If statuses is a pair (row_statuses, col_statuses) of int8 matrices, row i of each gets the lp statuses
+        after the i-th solve, like get_row_statuses() and get_col_statuses().
+
+        returns True if the lp was feasible (the constraints are the same for every direction)
+        '''
+
+        num_dirs, dir_len = directions.shape
+        res_len = results.shape[1]
+
+        assert results.shape[0] == num_dirs
+        assert dir_len == self.num_standard_vars, \
+            "minimize_batch objective length({}) should match number of standard variables({})".format(
+                dir_len, self.num_standard_vars)
+
+        if not self.reduced:
+            is_feasible = True
+
+            for i in xrange(num_dirs):
+                is_feasible = self.minimize(directions[i], results[i])
+
+                if not is_feasible:
+                    break
+
+                if statuses is not None:
+                    self.get_row_statuses(statuses[0][i])
+                    self.get_col_statuses(statuses[1][i])
+        else:
+            assert self.basis_matrix is not None, "update_basis_matrix() should be called before minimize_batch()"
+
+            objectives = np.ascontiguousarray(np.dot(directions, self.basis_matrix.T))
+            basis_results = np.zeros((num_dirs, self.num_basis_vars))
+            num_std = self.num_standard_vars
+
+            if statuses is not None:
+                # the equality rows of the full lp are fixed, and its standard variables are basic
+                row_stats = np.zeros((num_dirs, statuses[0].shape[1] - num_std), dtype=np.int8)
+                col_stats = np.zeros((num_dirs, statuses[1].shape[1] - num_std), dtype=np.int8)
+            else:
+                row_stats = col_stats = np.zeros((num_dirs, 0), dtype=np.int8)
+
+            start = time.time()
+
+            Timers.tic("lp minimize")
+            res = LpInstance._minimize_basis_batch(self.lp_data, objectives, num_dirs, self.num_basis_vars, \
+                basis_results, self.num_basis_vars, row_stats, row_stats.shape[1], col_stats, col_stats.shape[1])
+            Timers.toc("lp minimize")
+
+            is_feasible = res == 0
+
+            if is_feasible:
+                # results are [standard variables, basis variables], as in the full lp
+                full_results = np.concatenate((np.dot(basis_results, self.basis_matrix), basis_results), axis=1)
+                num = min(res_len, full_results.shape[1])
+                results[:, :num] = full_results[:, :num]
+
+                if statuses is not None:
+                    statuses[0][:, :num_std] = LpInstance._GLP_NS
+                    statuses[0][:, num_std:] = row_stats
+                    statuses[1][:, :num_std] = LpInstance._GLP_BS
+                    statuses[1][:, num_std:] = col_stats
+
+            # glpk holds the solution of the last direction, which wasn't memoized
+            self._last_key = self._solved_key = None
+            self._check_slow_lp(start)
+
+            if self.trace is not None:
+                for i in xrange(num_dirs):
+                    self._record(lptrace.OP_MINIMIZE, [directions[i], is_feasible, results[i]])
+
+        if not is_feasible and error_if_infeasible:
+            raise RuntimeError('minimize_batch LP was infeasible when error_if_infeasible=True')
+
+        return is_feasible
+
     @staticmethod
     def total_iterations():
         '''returns the total number of lp iterations performed over all the problems'''
@@ -330,5 +984,15 @@ class LpInstance(Freezable):
     def print_stats():
         'print stats about lp solving to stdout'
 
+        LpInstance._harvest_all()
+
         print "LP minimize calls: {}".format(LpInstance.total_optimizations())
         print "LP iterations: {}".format(LpInstance.total_iterations())
+
+        lookups = LpInstance._memo_hits + LpInstance._memo_misses
+
+        if lookups > 0:
+            print "LP memo hits: {} / {} ({:.1f}%)".format(LpInstance._memo_hits, lookups, \
+                100.0 * LpInstance._memo_hits / lookups)
+
+        LpInstance.print_role_stats()
@@ -34,17 +34,33 @@ int updateBasisMatrix(LpData* lpd, double* matrix, int w, int h)
     return lpd->updateBasisMatrix(matrix, w, h);
 }
 
+void setBasisUpdateTolerance(LpData* lpd, double tol)
+{
+    lpd->setBasisUpdateTolerance(tol);
+}
+
 void addInputStar(LpData* lpd, double* aMatrixT, int aWidth, int aHeight, double* bVec, int bLen,
                   double* basisMatrix, int bmWidth, int bmHeight)
 {
     lpd->addInputStar(aMatrixT, aWidth, aHeight, bVec, bLen, basisMatrix, bmWidth, bmHeight);
 }
 
+void updateLastInputStar(LpData* lpd, double* basisMatrix, int bmWidth, int bmHeight)
+{
+    lpd->updateLastInputStar(basisMatrix, bmWidth, bmHeight);
+}
+
 void addBasisConstraint(LpData* lpd, double* aVec, int aVecLen, double bVal)
 {
     lpd->addBasisConstraint(aVec, aVecLen, bVal);
 }
 
+void addBasisConstraints(LpData* lpd, double* aMat, int numRows, int aVecLen, double* bVec)
+{
+    for (int row = 0; row < numRows; ++row)
+        lpd->addBasisConstraint(aMat + row * aVecLen, aVecLen, bVec[row]);
+}
+
 void addStandardConstraint(LpData* lpd, double* aVec, int aVecLen, double bVal)
 {
     lpd->addStandardConstraint(aVec, aVecLen, bVal);
@@ -55,6 +71,33 @@ int minimize(LpData* lpd, double* direction, int dirLen, double* result, int res
     return lpd->minimize(direction, dirLen, result, resLen);
 }
 
+int minimizeBasis(LpData* lpd, double* direction, int dirLen, double* result, int resLen)
+{
+    return lpd->minimizeBasis(direction, dirLen, result, resLen);
+}
+
+int minimizeBasisBatch(LpData* lpd, double* directions, int numDirs, int dirLen, double* results, int resLen,
+                       char* rowStats, int rowStatsLen, char* colStats, int colStatsLen)
+{
+    return lpd->minimizeBasisBatch(directions, numDirs, dirLen, results, resLen, rowStats, rowStatsLen, colStats,
+                                   colStatsLen);
+}
+
+int getLastIterations(LpData* lpd)
+{
+    return lpd->getLastIterations();
+}
+
+int writeLp(LpData* lpd, const char* filename, int mps)
+{
+    return lpd->writeLp(filename, mps != 0);
+}
+
+int getStats(LpData* lpd, double* store, int storeLen)
+{
+    return lpd->getStats(store, storeLen);
+}
+
 void printLp(LpData* lpd)
 {
     lpd->printLp();
@@ -118,6 +161,11 @@ int updateBasisMatrix(void* lpdata, double* matrix, int w, int h)
     return hylaa::updateBasisMatrix((LpData*)lpdata, matrix, w, h);
 }
 
+void setBasisUpdateTolerance(void* lpdata, double tol)
+{
+    hylaa::setBasisUpdateTolerance((LpData*)lpdata, tol);
+}
+
 void addInputStar(void* lpdata, double* aMatrixT, int aWidth, int aHeight, double* bVec, int bLen,
                   double* basisMatrix, int bmWidth, int bmHeight)
 {
@@ -125,11 +173,21 @@ void addInputStar(void* lpdata, double* aMatrixT, int aWidth, int aHeight, doubl
                         bmWidth, bmHeight);
 }
 
+void updateLastInputStar(void* lpdata, double* basisMatrix, int bmWidth, int bmHeight)
+{
+    hylaa::updateLastInputStar((LpData*)lpdata, basisMatrix, bmWidth, bmHeight);
+}
+
 void addBasisConstraint(void* lpdata, double* aVec, int aVecLen, double bVal)
 {
     hylaa::addBasisConstraint((LpData*)lpdata, aVec, aVecLen, bVal);
 }
 
+void addBasisConstraints(void* lpdata, double* aMat, int numRows, int aVecLen, double* bVec)
+{
+    hylaa::addBasisConstraints((LpData*)lpdata, aMat, numRows, aVecLen, bVec);
+}
+
 void addStandardConstraint(void* lpdata, double* aVec, int aVecLen, double bVal)
 {
     hylaa::addStandardConstraint((LpData*)lpdata, aVec, aVecLen, bVal);
@@ -140,6 +198,33 @@ int minimize(void* lpdata, double* direction, int dirLen, double* result, int re
     return hylaa::minimize((LpData*)lpdata, direction, dirLen, result, resLen);
 }
 
+int minimizeBasis(void* lpdata, double* direction, int dirLen, double* result, int resLen)
+{
+    return hylaa::minimizeBasis((LpData*)lpdata, direction, dirLen, result, resLen);
+}
+
+int minimizeBasisBatch(void* lpdata, double* directions, int numDirs, int dirLen, double* results, int resLen,
+                       char* rowStats, int rowStatsLen, char* colStats, int colStatsLen)
+{
+    return hylaa::minimizeBasisBatch((LpData*)lpdata, directions, numDirs, dirLen, results, resLen, rowStats,
+                                     rowStatsLen, colStats, colStatsLen);
+}
+
+int getLastIterations(void* lpdata)
+{
+    return hylaa::getLastIterations((LpData*)lpdata);
+}
+
+int writeLp(void* lpdata, const char* filename, int mps)
+{
+    return hylaa::writeLp((LpData*)lpdata, filename, mps);
+}
+
+int getStats(void* lpdata, double* store, int storeLen)
+{
+    return hylaa::getStats((LpData*)lpdata, store, storeLen);
+}
+
 int totalIterations()
 {
     return global.iterations;
@@ -3,6 +3,9 @@
 // Nov 2016
 
 #include <glpk.h>
+#include <math.h>
+#include <atomic>
+#include <chrono>
 #include <vector>
 
 using namespace std;
@@ -10,10 +13,11 @@ using namespace std;
 #ifndef HYLAA_GLPK_H_
 #define HYLAA_GLPK_H_
 
+// global counters are atomic, since different lps may be solved on different threads
 struct GlobalLpData
 {
-    int optimizations = 0;
-    int iterations = 0;
+    atomic<int> optimizations{0};
+    atomic<int> iterations{0};
 };
 
 extern GlobalLpData global;
@@ -25,7 +29,8 @@ class LpData
         : numStandardVars(numStandardVars),
           numBasisVars(numBasisVars),
           basisConstraintCols(numBasisVars),
-          basisConstraintVals(numBasisVars)
+          basisConstraintVals(numBasisVars),
+          loadedMatrix(numStandardVars * numBasisVars, 0.0)
     {
         // setup lp
         lp = glp_create_prob();
@@ -174,7 +179,13 @@ class LpData
         return 0;
     }
 
-    // returns 1 on error, 0 on success
+    // only basis matrix entries that change by more than this amount cause a column to be rewritten
+    void setBasisUpdateTolerance(double tol)
+    {
+        basisUpdateTol = tol;
+    }
+
+    // returns -1 on error, otherwise the number of lp columns that were rewritten
     int updateBasisMatrix(double* matrix, int w, int h)
     {
         // the transpose of the matrix goes into the LP
@@ -184,7 +195,7 @@ class LpData
                 "Fatal Error: Matrix dimensions mismatch in updateBasisMatrix: "
                 "w(%d) != numStandardVars(%d) || h(%d) != numBasisVars(%d)\n",
                 w, numStandardVars, h, numBasisVars);
-            return 1;
+            return -1;
         }
 
         int numRows = glp_get_num_rows(lp);
@@ -205,10 +216,28 @@ class LpData
             }
         }
 
+        int changedCols = 0;
+
         // replace each column in the lp with a row in the current basis matrix
-        // (this transposes the matrix)
+        // (this transposes the matrix). Rows which didn't change since the last update are skipped.
         for (int row = 0; row < h; ++row)
         {
+            double* loadedRow = &loadedMatrix[row * w];
+            bool changed = false;
+
+            for (int col = 0; col < w; ++col)
+            {
+                if (fabs(matrix[row * w + col] - loadedRow[col]) > basisUpdateTol)
+                {
+                    changed = true;
+                    break;
+                }
+            }
+
+            if (!changed)
+                continue;
+
+            ++changedCols;
             int index = 1;
 
             int inds[numStandardVars + basisConstraintCols[row].size() + 1];
@@ -217,6 +246,7 @@ class LpData
             for (int col = 0; col < w; ++col)
             {
                 double val = matrix[row * w + col];
+                loadedRow[col] = val;
 
                 if (val != 0)
                 {
@@ -235,7 +265,7 @@ class LpData
             glp_set_mat_col(lp, numStandardVars + row + 1, index - 1, inds, vals);
         }
 
-        return 0;
+        return changedCols;
     }
 
     /**
@@ -407,6 +437,63 @@ class LpData
             copyLastInputSolution(lpRows, lpCols, aHeight, aWidth);
     }
 
+    // replace the basis matrix coefficients of the most recently added input star (used when the input
+    // is held constant over several steps, so that the effect of each step is summed into one input star)
+    void updateLastInputStar(double* basisMatrix, int bmWidth, int bmHeight)
+    {
+        if (!addedInput)
+        {
+            printf("Fatal Error: updateLastInputStar was called before input star was added.\n");
+            exit(1);
+        }
+
+        if (bmWidth != numStandardVars || bmHeight != numInputs)
+        {
+            printf("Fatal Error: Matrix size error in updateLastInputStar. One of the following conditions "
+                "failed: bmWidth(%d)==numStandardVars(%d) bmHeight(%d)==numInputs(%d)\n",
+                bmWidth, numStandardVars, bmHeight, numInputs);
+            exit(1);
+        }
+
+        int lpRows = glp_get_num_rows(lp);
+        int lpCols = glp_get_num_cols(lp);
+        int oldInds[lpRows + 1];
+        double oldVals[lpRows + 1];
+        int inds[bmWidth + lpRows + 1];
+        double vals[bmWidth + lpRows + 1];
+
+        for (int r = 0; r < bmHeight; ++r)
+        {
+            int col = lpCols - numInputs + r + 1;
+            int index = 1;
+
+            for (int c = 0; c < bmWidth; ++c)
+            {
+                double val = basisMatrix[r * bmWidth + c];
+
+                if (val != 0)
+                {
+                    inds[index] = c + 1;
+                    vals[index++] = val;
+                }
+            }
+
+            // keep the input constraint coefficients, which are in the rows after the standard rows
+            int oldLen = glp_get_mat_col(lp, col, oldInds, oldVals);
+
+            for (int i = 1; i <= oldLen; ++i)
+            {
+                if (oldInds[i] > numStandardVars)
+                {
+                    inds[index] = oldInds[i];
+                    vals[index++] = oldVals[i];
+                }
+            }
+
+            glp_set_mat_col(lp, col, index - 1, inds, vals);
+        }
+    }
+
     void setStandardBasisStatuses(char* rowStats, int rLen, char* colStats, int cLen)
     {
         if (cLen != numStandardVars + numBasisVars)
@@ -495,14 +582,100 @@ class LpData
         for (int i = 0; i < numBasisVars; ++i)
             glp_set_obj_coef(lp, 1 + numStandardVars + i, 0);
 
-        int startIterations = glp_get_it_cnt(lp);
+        return solve(result, resLen);
+    }
 
-        int simplexRes = glp_simplex(lp, &params);
-        
-        int newIterations = glp_get_it_cnt(lp) - startIterations;
-        global.iterations += newIterations;
-        
-        return processSimplexResult(simplexRes, result, resLen);
+    // number of simplex iterations in the last call to minimize() or minimizeBasis()
+    int getLastIterations()
+    {
+        return lastIterations;
+    }
+
+    // get the per-lp statistics: solves, iterations, infeasible, seconds
+    // returns 0 on success, 1 on error
+    int getStats(double* store, int storeLen)
+    {
+        if (storeLen != 4)
+        {
+            printf("Error: storeLen(%d) was not 4 in getStats\n", storeLen);
+            return 1;
+        }
+
+        store[0] = stats.solves;
+        store[1] = stats.iterations;
+        store[2] = stats.infeasible;
+        store[3] = stats.secs;
+
+        return 0;
+    }
+
+    // write the lp (including the last objective) to a file in cplex lp format or mps format
+    // returns 0 on success
+    int writeLp(const char* filename, bool mps)
+    {
+        int rv;
+        int oldTermOut = glp_term_out(GLP_OFF);
+
+        if (mps)
+            rv = glp_write_mps(lp, GLP_MPS_FILE, nullptr, filename);
+        else
+            rv = glp_write_lp(lp, nullptr, filename);
+
+        glp_term_out(oldTermOut);
+
+        return rv;
+    }
+
+    // minimize a direction given over the basis variables (the standard variables get a zero objective)
+    // this is used by reduced lps, which have no standard variables
+    // returns 0 on success
+    // returns 1 on unsat
+    int minimizeBasis(double* direction, int dirLen, double* result, int resLen)
+    {
+        ++global.optimizations;
+
+        if (dirLen != numBasisVars)
+        {
+            printf("Fatal Error: dirLen(%d) is not equal to numBasisVars(%d) in call to minimizeBasis()\n", dirLen, numBasisVars);
+            exit(1);
+        }
+
+        for (int i = 0; i < numStandardVars; ++i)
+            glp_set_obj_coef(lp, 1 + i, 0);
+
+        for (int i = 0; i < numBasisVars; ++i)
+            glp_set_obj_coef(lp, 1 + numStandardVars + i, direction[i]);
+
+        return solve(result, resLen);
+    }
+
+    // minimize several directions given over the basis variables, like minimizeBasis(), where each solve is
+    // warm-started from the previous one. directions has numDirs rows of length dirLen, and results gets numDirs
+    // rows of length resLen. If rowStatsLen / colStatsLen are nonzero (the number of lp rows / cols), rowStats /
+    // colStats get the statuses after each solve, one row per direction.
+    // returns 0 on success
+    // returns 1 on unsat (the constraints are the same for every direction, so the remaining ones are skipped)
+    int minimizeBasisBatch(double* directions, int numDirs, int dirLen, double* results, int resLen,
+                           char* rowStats, int rowStatsLen, char* colStats, int colStatsLen)
+    {
+        int rv = 0;
+        int totalIterations = 0;
+
+        for (int d = 0; d < numDirs && rv == 0; ++d)
+        {
+            rv = minimizeBasis(directions + d * dirLen, dirLen, results + d * resLen, resLen);
+            totalIterations += lastIterations;
+
+            if (rv == 0 && rowStatsLen > 0 && getRowStatuses(rowStats + d * rowStatsLen, rowStatsLen) != 0)
+                exit(1);
+
+            if (rv == 0 && colStatsLen > 0 && getColStatuses(colStats + d * colStatsLen, colStatsLen) != 0)
+                exit(1);
+        }
+
+        lastIterations = totalIterations;
+
+        return rv;
     }
     
 /////////////////////////////////
@@ -522,6 +695,53 @@ class LpData
     vector<int> standardConstraintRows; //  use size() when numStandardConstraints is needed
     vector<int> basisConstraintRows; //  use size() when numBasisConstraints is needed
 
+    vector<double> loadedMatrix; // the basis matrix currently in the lp (initially all zeros)
+    double basisUpdateTol = 0;
+
+    int lastIterations = 0;
+
+    struct
+    {
+        int solves = 0;
+        int iterations = 0;
+        int infeasible = 0;
+        double secs = 0;
+    } stats;
+
+    // run the simplex method using the current objective, and extract the result
+    int solve(double* result, int resLen)
+    {
+        auto startTime = chrono::steady_clock::now();
+        int startIterations = glp_get_it_cnt(lp);
+
+        int simplexRes = glp_simplex(lp, &params);
+
+        if (simplexRes == GLP_EBADB || simplexRes == GLP_ESING || simplexRes == GLP_ECOND)
+        {
+            // the warm-start basis was invalid (statuses copied between input stars or from another lp
+            // may not form a basis), restart from the standard basis which is always valid
+            glp_std_basis(lp);
+            simplexRes = glp_simplex(lp, &params);
+        }
+
+        int newIterations = glp_get_it_cnt(lp) - startIterations;
+        global.iterations += newIterations;
+        lastIterations = newIterations;
+        
+        int rv = processSimplexResult(simplexRes, result, resLen);
+
+        // per-lp statistics
+        ++stats.solves;
+        stats.iterations += newIterations;
+
+        if (rv != 0)
+            ++stats.infeasible;
+
+        stats.secs += chrono::duration<double>(chrono::steady_clock::now() - startTime).count();
+
+        return rv;
+    }
+
     void addRows(int numRows, int num, double* bound)
     {
         glp_add_rows(lp, num);
@@ -559,8 +779,8 @@ class LpData
     void populateInputConstraints(int lpRows, int lpCols, double* aMatrixT, int aWidth, int aHeight,
                                   double* basisMatrix, int bmWidth, int bmHeight)
     {
-        int inds[bmWidth + aHeight + 1];
-        double vals[bmWidth + aHeight + 1];
+        int inds[bmWidth + aWidth + 1];
+        double vals[bmWidth + aWidth + 1];
 
         for (int r = 0; r < bmHeight; ++r)
         {
@@ -132,7 +132,13 @@ class LinearAutomatonMode(Freezable):
         self.u_constraints_a = None # linear constraints on inputs u are Au <= b
         self.u_constraints_a_t = None
         self.u_constraints_b = None # linear constraints on inputs u are Au <= b
+        self.u_box = None # (low, high) input bounds, if the input constraints are a box (assigned in set_inputs)
         self.num_inputs = 0
+        # inputs are piecewise constant over this many steps (see Star.update_from_sim()). The guards and invariant
+        # are only checked at the end of each hold interval, counting from the start of the post (see
+        # Star.ends_input_hold()), so transitions and invariant violations at the steps in between, including the
+        # steps after the last full interval before the time horizon, are not detected
+        self.input_hold_steps = 1
 
         self.inv_list = [] # a list of LinearConstraint, if all are true then the invariant is true
 
@@ -167,6 +173,10 @@ class LinearAutomatonMode(Freezable):
 
             self._sim_bundle = SimulationBundle(self.a_matrix, self.c_vector, self.sim_settings)
 
+            if self.b_matrix is not None:
+                # simulate the input effects along with the basis vectors (see InputStar)
+                self._sim_bundle.set_input_rows(self.get_gb_t())
+
             if self.sim_settings.use_presimulation:
                 self.presimulate(star, max_steps_remaining)
 
@@ -179,6 +189,24 @@ class LinearAutomatonMode(Freezable):
 
         return self._sim_bundle
 
+    def get_sim_cache(self):
+        'get the simulation data of this mode (saved in checkpoints), or None if get_sim_bundle() was never called'
+
+        rv = None
+
+        if self._sim_bundle is not None:
+            rv = (self._sim_bundle, self._gbt_matrix)
+
+        return rv
+
+    def set_sim_cache(self, settings, sim_cache):
+        'restore the simulation data from get_sim_cache(), rather than recomputing it in get_sim_bundle()'
+
+        assert isinstance(settings, HylaaSettings)
+
+        self.sim_settings = settings.simulation
+        self._sim_bundle, self._gbt_matrix = sim_cache
+
     def presimulate(self, star, max_steps_remaining):
         'this is an optimation where we try to guess the dwell time using a simulation, so we avoid repeated calls'
 
@@ -263,6 +291,45 @@ class LinearAutomatonMode(Freezable):
         self.u_constraints_a = u_constraints_a
         self.u_constraints_a_t = u_constraints_a.transpose().copy()
         self.u_constraints_b = u_constraints_b
+        self.u_box = self._get_input_box()
+
+    def _get_input_box(self):
+        '''
+        if the input constraints are a box (each constraint bounds a single input, and each input has exactly one
+        lower and one upper bound, with low < high), return the pair (low, high) of bound arrays. Otherwise,
+        return None.
+        '''
+
+        a_mat = self.u_constraints_a
+        low = np.full(self.num_inputs, -np.inf)
+        high = np.full(self.num_inputs, np.inf)
+        rv = None
+
+        if a_mat.shape[0] == 2 * self.num_inputs:
+            rv = (low, high)
+
+            for row, value in zip(a_mat, self.u_constraints_b):
+                nonzeros = np.nonzero(row)[0]
+
+                if len(nonzeros) != 1:
+                    rv = None
+                    break
+
+                i = nonzeros[0]
+                bound = value / row[i]
+
+                if row[i] > 0 and high[i] == np.inf:
+                    high[i] = bound
+                elif row[i] < 0 and low[i] == -np.inf:
+                    low[i] = bound
+                else:
+                    rv = None # second upper or lower bound for the same input
+                    break
+
+            if rv is not None and not np.all(low < high):
+                rv = None
+
+        return rv
 
     def __str__(self):
         extra = ' (error mode)' if self.is_error else ''
@@ -310,6 +377,32 @@ class LinearHybridAutomaton(object):
 
         return t
 
+    def get_error_distances(self):
+        '''
+        get the minimum number of discrete transitions from each mode to an error mode
+
+        returns a map of mode name -> distance, modes which cannot reach an error mode are not included
+        '''
+
+        rv = {}
+        frontier = [mode for mode in self.modes.values() if mode.is_error]
+
+        for mode in frontier:
+            rv[mode.name] = 0
+
+        while frontier:
+            next_frontier = []
+
+            for mode in frontier:
+                for t in self.transitions:
+                    if t.to_mode is mode and t.from_mode.name not in rv:
+                        rv[t.from_mode.name] = rv[mode.name] + 1
+                        next_frontier.append(t.from_mode)
+
+            frontier = next_frontier
+
+        return rv
+
     def do_guard_strengthening(self):
         '''
         Strengthen the guards to include the invariants of target modes
@@ -0,0 +1,272 @@
+'''
+Hylaa LP Trace Recording and Replay
+
+When LpSettings.trace_filename is set, every LpInstance operation is recorded to a compact binary trace file.
+The trace can then be replayed against any lp backend with the LpInstance interface, which allows lp performance
+to be measured on real workloads without running the simulation:
+
+python -m hylaa.lptrace trace.lpt
+'''
+
+import atexit
+import struct
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from hylaa.util import Freezable
+
+MAGIC = 'HYLPTRC1'
+
+# operation codes
+OP_CREATE = 0 # num_standard_vars, num_basis_vars, reduced
+OP_DELETE = 1
+OP_UPDATE_BASIS_MATRIX = 2 # matrix
+OP_ADD_BASIS_CONSTRAINT = 3 # vector, value
+OP_ADD_STANDARD_CONSTRAINT = 4 # vector, value
+OP_ADD_INPUT_STAR = 5 # a_matrix_t, b_vec, input_basis_matrix
+OP_SET_STANDARD_CONSTRAINT_VALUES = 6 # values
+OP_SET_BASIS_CONSTRAINT_VALUES = 7 # values
+OP_SET_LAST_INPUT_STATUSES = 8 # row_statuses, col_statuses
+OP_SET_STANDARD_BASIS_STATUSES = 9 # row_statuses, col_statuses
+OP_GET_ROW_STATUSES = 10 # statuses
+OP_GET_COL_STATUSES = 11 # statuses
+OP_MINIMIZE = 12 # direction, is_feasible, result
+OP_UPDATE_LAST_INPUT_STAR = 13 # input_basis_matrix
+
+OP_NAMES = ['create', 'delete', 'update_basis_matrix', 'add_basis_constraint', 'add_standard_constraint',
+            'add_input_star', 'set_standard_constraint_values', 'set_basis_constraint_values',
+            'set_last_input_statuses', 'set_standard_basis_statuses', 'get_row_statuses', 'get_col_statuses',
+            'minimize', 'update_last_input_star']
+
+# record header: op code, lp id, number of fields
+HEADER = struct.Struct('<BiB')
+
+# field tags
+TAG_INT = 'i'
+TAG_FLOAT = 'd'
+TAG_ARRAY = 'a'
+
+# array dtype codes
+DTYPE_CODES = {np.dtype(float): 'd', np.dtype(np.int8): 'b'}
+CODE_DTYPES = {'d': np.dtype(float), 'b': np.dtype(np.int8)}
+
+class LpTraceWriter(Freezable):
+    'writes lp operations to a binary trace file'
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.next_lp_id = 0
+        self.lock = threading.Lock() # lps may be used from multiple threads
+        self.f = open(filename, 'wb')
+        self.f.write(MAGIC)
+
+        atexit.register(self.close)
+
+        self.freeze_attrs()
+
+    def new_lp_id(self):
+        'get a unique id for a newly-created lp'
+
+        with self.lock:
+            rv = self.next_lp_id
+            self.next_lp_id += 1
+
+        return rv
+
+    def write(self, op, lp_id, fields):
+        'write a record to the trace. fields is a list of ints, floats or numpy arrays'
+
+        data = [HEADER.pack(op, lp_id, len(fields))]
+
+        for field in fields:
+            if isinstance(field, np.ndarray):
+                arr = np.ascontiguousarray(field)
+                data.append(TAG_ARRAY + DTYPE_CODES[arr.dtype] + struct.pack('<B', arr.ndim))
+                data.append(struct.pack('<{}i'.format(arr.ndim), *arr.shape))
+                data.append(arr.tostring())
+            elif isinstance(field, (int, long, bool, np.integer)):
+                data.append(TAG_INT + struct.pack('<i', field))
+            else:
+                data.append(TAG_FLOAT + struct.pack('<d', field))
+
+        with self.lock:
+            if self.f is not None:
+                self.f.write(''.join(data))
+
+    def close(self):
+        'close the trace file'
+
+        with self.lock:
+            if self.f is not None:
+                self.f.close()
+                self.f = None
+
+def _read_exact(f, num_bytes):
+    'read exactly num_bytes from the file'
+
+    rv = f.read(num_bytes)
+
+    if len(rv) != num_bytes:
+        raise RuntimeError("lp trace file was truncated")
+
+    return rv
+
+def read_trace(filename):
+    'generator which yields (op, lp_id, fields) for each record in a trace file'
+
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise RuntimeError("'{}' is not an lp trace file".format(filename))
+
+        while True:
+            header = f.read(HEADER.size)
+
+            if len(header) == 0:
+                break
+
+            if len(header) != HEADER.size:
+                raise RuntimeError("lp trace file was truncated")
+
+            op, lp_id, num_fields = HEADER.unpack(header)
+            fields = []
+
+            for _ in xrange(num_fields):
+                tag = _read_exact(f, 1)
+
+                if tag == TAG_INT:
+                    fields.append(struct.unpack('<i', _read_exact(f, 4))[0])
+                elif tag == TAG_FLOAT:
+                    fields.append(struct.unpack('<d', _read_exact(f, 8))[0])
+                elif tag == TAG_ARRAY:
+                    dtype = CODE_DTYPES[_read_exact(f, 1)]
+                    ndim = struct.unpack('<B', _read_exact(f, 1))[0]
+                    shape = struct.unpack('<{}i'.format(ndim), _read_exact(f, 4 * ndim))
+                    size = int(np.prod(shape)) if ndim > 0 else 1
+                    data = _read_exact(f, size * dtype.itemsize)
+                    fields.append(np.frombuffer(data, dtype=dtype).reshape(shape).copy())
+                else:
+                    raise RuntimeError("unknown field tag in lp trace file: '{}'".format(tag))
+
+            yield op, lp_id, fields
+
+class ReplayStats(Freezable):
+    'statistics from replaying an lp trace'
+
+    def __init__(self):
+        self.op_stats = OrderedDict() # op name -> [num_calls, total_secs]
+        self.num_mismatches = 0 # minimize calls where the replayed result differed from the recorded one
+
+        self.freeze_attrs()
+
+    def add(self, op, secs):
+        'add the time for a single operation'
+
+        stats = self.op_stats.get(OP_NAMES[op])
+
+        if stats is None:
+            stats = self.op_stats[OP_NAMES[op]] = [0, 0.0]
+
+        stats[0] += 1
+        stats[1] += secs
+
+    def print_stats(self):
+        'print the replay statistics to stdout'
+
+        total = sum([secs for _, secs in self.op_stats.itervalues()])
+
+        for name, (num_calls, secs) in self.op_stats.iteritems():
+            print "{} ({} calls): {:.3f} sec ({:.1f} us/call, {:.1f}%)".format(
+                name, num_calls, secs, 1e6 * secs / num_calls, 100.0 * secs / total if total > 0 else 0)
+
+        print "Total LP Time: {:.3f} sec".format(total)
+        print "Minimize result mismatches: {}".format(self.num_mismatches)
+
+def replay(filename, lp_factory, tol=1e-6):
+    '''
+    re-execute the lp operations in a trace file, and return a ReplayStats object
+
+    lp_factory(num_standard_vars, num_basis_vars, reduced) should create an object with the LpInstance interface.
+    Minimize results are compared with the recorded values (feasibility and objective value, up to tol).
+    '''
+
+    stats = ReplayStats()
+    lps = {}
+
+    for op, lp_id, fields in read_trace(filename):
+        if op == OP_CREATE:
+            start = time.time()
+            lps[lp_id] = lp_factory(fields[0], fields[1], bool(fields[2]))
+            stats.add(op, time.time() - start)
+            continue
+
+        lpi = lps[lp_id]
+
+        if op == OP_DELETE:
+            start = time.time()
+            del lps[lp_id]
+            del lpi
+            stats.add(op, time.time() - start)
+        elif op == OP_MINIMIZE:
+            direction, was_feasible, recorded_result = fields
+            result = np.zeros(recorded_result.shape)
+
+            start = time.time()
+            is_feasible = lpi.minimize(direction, result)
+            stats.add(op, time.time() - start)
+
+            if is_feasible != bool(was_feasible):
+                stats.num_mismatches += 1
+            elif is_feasible:
+                dims = direction.shape[0]
+                expected = np.dot(recorded_result[:dims], direction)
+
+                if abs(np.dot(result[:dims], direction) - expected) > tol * max(1.0, abs(expected)):
+                    stats.num_mismatches += 1
+        elif op == OP_GET_ROW_STATUSES or op == OP_GET_COL_STATUSES:
+            store = np.zeros(fields[0].shape, dtype=np.int8)
+            func = lpi.get_row_statuses if op == OP_GET_ROW_STATUSES else lpi.get_col_statuses
+
+            start = time.time()
+            func(store)
+            stats.add(op, time.time() - start)
+        else:
+            func = {OP_UPDATE_BASIS_MATRIX: lpi.update_basis_matrix,
+                    OP_ADD_BASIS_CONSTRAINT: lpi.add_basis_constraint,
+                    OP_ADD_STANDARD_CONSTRAINT: lpi.add_standard_constraint,
+                    OP_ADD_INPUT_STAR: lpi.add_input_star,
+                    OP_UPDATE_LAST_INPUT_STAR: lpi.update_last_input_star,
+                    OP_SET_STANDARD_CONSTRAINT_VALUES: lpi.set_standard_constraint_values,
+                    OP_SET_BASIS_CONSTRAINT_VALUES: lpi.set_basis_constraint_values,
+                    OP_SET_LAST_INPUT_STATUSES: lpi.set_last_input_statuses,
+                    OP_SET_STANDARD_BASIS_STATUSES: lpi.set_standard_basis_statuses}[op]
+
+            start = time.time()
+            func(*fields)
+            stats.add(op, time.time() - start)
+
+    return stats
+
+def main():
+    'replay a trace file using the glpk LpInstance backend and print timing statistics'
+
+    if len(sys.argv) < 2:
+        print "usage: python -m hylaa.lptrace <trace_file> [--memo]"
+        sys.exit(1)
+
+    from hylaa.glpk_interface import LpInstance
+
+    if '--memo' not in sys.argv[2:]:
+        LpInstance.settings.memo_size = 0 # time the lp solver, not the memoization
+
+    stats = replay(sys.argv[1], LpInstance)
+    stats.print_stats()
+
+    print ""
+    LpInstance.print_stats()
+
+if __name__ == '__main__':
+    main()
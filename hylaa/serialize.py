@@ -0,0 +1,75 @@
+'''
+Hylaa Serialization
+
+Pickling of Hylaa objects, such as stars along with their parent chains, for sending them to worker processes or
+saving them to files. The hybrid automaton (including its modes and transitions) and the settings are not pickled.
+They are referenced by name or index, and are resolved when loading, using the automaton and settings passed to
+loads().
+'''
+
+import cPickle as pickle
+from cStringIO import StringIO
+
+from hylaa.hybrid_automaton import LinearAutomatonMode, LinearAutomatonTransition
+
+def dumps(obj, ha, settings):
+    'pickle obj to a string, referencing (but not pickling) the hybrid automaton ha and the settings'
+
+    transition_indices = {}
+
+    for index, transition in enumerate(ha.transitions):
+        transition_indices[id(transition)] = index
+
+    def persistent_id(o):
+        'get the reference for an object which should not be pickled, or None'
+
+        rv = None
+
+        if o is ha:
+            rv = 'ha'
+        elif o is settings:
+            rv = 'settings'
+        elif o is settings.simulation:
+            rv = 'sim_settings'
+        elif isinstance(o, LinearAutomatonMode):
+            assert ha.modes.get(o.name) is o, "mode '{}' is not part of the automaton".format(o.name)
+            rv = 'mode:' + o.name
+        elif isinstance(o, LinearAutomatonTransition):
+            rv = 'transition:{}'.format(transition_indices[id(o)])
+
+        return rv
+
+    f = StringIO()
+    pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = persistent_id
+    pickler.dump(obj)
+
+    return f.getvalue()
+
+def loads(data, ha, settings):
+    'unpickle an object from a string created with dumps(), resolving references with ha and settings'
+
+    def persistent_load(pid):
+        'resolve a reference created in dumps()'
+
+        kind, _, name = pid.partition(':')
+
+        if kind == 'ha':
+            rv = ha
+        elif kind == 'settings':
+            rv = settings
+        elif kind == 'sim_settings':
+            rv = settings.simulation
+        elif kind == 'mode':
+            rv = ha.modes[name]
+        elif kind == 'transition':
+            rv = ha.transitions[int(name)]
+        else:
+            raise pickle.UnpicklingError("unknown persistent id: '{}'".format(pid))
+
+        return rv
+
+    unpickler = pickle.Unpickler(StringIO(data))
+    unpickler.persistent_load = persistent_load
+
+    return unpickler.load()
@@ -51,6 +51,14 @@ class DyData(Freezable):
 
         self.freeze_attrs()
 
+    def __getstate__(self):
+        'get the state for pickling. The jacobian function is not included, it gets recreated in make_jac_func()'
+
+        rv = self.__dict__.copy()
+        rv['jac_func'] = rv['max_upper'] = rv['max_lower'] = None
+
+        return rv
+
     def make_dense_matrices(self):
         '''
         make the dense versions of a_matrix and b_vector, if needed
@@ -204,6 +212,11 @@ class SimulationBundle(Freezable):
         self.vec_values = None
         self.step_offset = None
 
+        # input-effect rows (G(A, h) * B transposed), simulated alongside the basis vectors (see set_input_rows())
+        self.input_rows = None
+        self.input_values = None # index is step (may be offset), like vec_values
+        self.input_values_before = None # input_values at step_offset - 1, if known
+
         # itemsize is bytes per float
         if self.settings.sim_mode == SimulationSettings.SIMULATION:
             mb_per_step = np.dtype(float).itemsize * self.num_dims * self.num_dims / 1024.0 / 1024.0
@@ -229,6 +242,41 @@ class SimulationBundle(Freezable):
 
         return result
 
+    def set_input_rows(self, input_rows):
+        '''
+        set the input-effect rows (gb_t, one row per input) to simulate alongside the basis vectors. Since the
+        dynamics are linear, the rows at step k equal input_rows * (the basis matrix at step k), which can then be
+        read with get_input_effects_at_step() rather than computed with a matrix product.
+        '''
+
+        assert input_rows.shape[1] == self.num_dims
+
+        self.input_rows = input_rows
+        self.step_offset = None # reset the simulations, so the input rows are included
+
+    def _simulate_vecs_and_inputs(self, start_list, input_start, steps, include_step_zero=False):
+        '''
+        simulate the basis vectors and the input-effect rows (if input_start is not None) together
+
+        returns a tuple (vec_values, input_values), where input_values may be None
+        '''
+
+        if input_start is not None:
+            start_list = np.concatenate((start_list, input_start))
+
+        if self.settings.sim_mode == SimulationSettings.SIMULATION:
+            values = self.simulate_vecs(start_list, steps, include_step_zero=include_step_zero)
+        else:
+            values = self.matrix_exp_vecs(start_list, steps)
+
+        if input_start is None:
+            rv = (values, None)
+        else:
+            dims = self.num_dims
+            rv = ([v[:dims] for v in values], [v[dims:] for v in values])
+
+        return rv
+
     def simulate_vecs(self, start_list, steps, include_step_zero=False):
         '''simulate from each of the vector points, from the last state in self.vec_values'''
 
@@ -238,10 +286,11 @@ class SimulationBundle(Freezable):
         linear_dy = DyData(self.dy_data.sparse_a_matrix, None, self.settings.sparse)
 
         sim_start_time = time.time()
+        num_vecs = len(start_list)
         args = []
 
-        for dim in xrange(self.num_dims):
-            args.append([sim_start_time, start_list[dim], steps, include_step_zero, linear_dy, self.settings])
+        for index in xrange(num_vecs):
+            args.append([sim_start_time, start_list[index], steps, include_step_zero, linear_dy, self.settings])
 
         if self.settings.stdout:
             SHARED_NEXT_PRINT.value = sim_start_time + self.settings.print_interval_secs
@@ -264,10 +313,10 @@ class SimulationBundle(Freezable):
         rv = []
 
         for step in xrange(result[0].shape[0]):
-            single_step_result = np.empty((self.num_dims, self.num_dims))
+            single_step_result = np.empty((num_vecs, self.num_dims))
 
-            for dim in xrange(self.num_dims):
-                single_step_result[dim] = result[dim][step]
+            for index in xrange(num_vecs):
+                single_step_result[index] = result[index][step]
 
             rv.append(single_step_result)
 
@@ -328,9 +377,11 @@ class SimulationBundle(Freezable):
 
             assert len(self.origin_sim) == 1 + desired_step
 
-            # presimulate vec_values
+            # presimulate vec_values (and input_values)
             start_list = np.identity(self.num_dims)
-            self.vec_values = self.simulate_vecs(start_list, desired_step, include_step_zero=True)
+            self.vec_values, self.input_values = self._simulate_vecs_and_inputs(
+                start_list, self.input_rows, desired_step, include_step_zero=True)
+            self.input_values_before = None
 
             assert len(self.vec_values) == 1 + desired_step
             assert len(self.vec_values) == len(self.origin_sim)
@@ -356,6 +407,8 @@ class SimulationBundle(Freezable):
                 # reset origin sim and, if needed, vec_values
                 self.origin_sim = [np.zeros((self.num_dims,))] # index is step (may be offset)
                 self.vec_values = [np.identity(self.num_dims)] # index is step (may be offset)
+                self.input_values = [self.input_rows] if self.input_rows is not None else None
+                self.input_values_before = None
                 self.step_offset = 0
 
         rel_step = step - self.step_offset
@@ -385,19 +438,42 @@ class SimulationBundle(Freezable):
             self.origin_sim = None
             self.origin_sim = self.simulate_origin(start, num_new_steps)
 
-            # also advance vec_values
+            # also advance vec_values and input_values
             start_list = self.vec_values[-1].copy()
             self.vec_values = None
 
-            if self.settings.sim_mode == SimulationSettings.SIMULATION:
-                self.vec_values = self.simulate_vecs(start_list, num_new_steps)
-            elif self.settings.sim_mode == SimulationSettings.MATRIX_EXP:
-                self.vec_values = self.matrix_exp_vecs(start_list, num_new_steps)
+            input_start = None
+
+            if self.input_values is not None:
+                input_start = self.input_values_before = self.input_values[-1].copy()
+                self.input_values = None
+
+            self.vec_values, self.input_values = self._simulate_vecs_and_inputs(start_list, input_start,
+                                                                                num_new_steps)
 
         Timers.toc("sim + overhead")
 
         return (self.vec_values[rel_step], self.origin_sim[rel_step])
 
+    def get_input_effects_at_step(self, step):
+        '''
+        get the input-effect rows (gb_t times the basis matrix) at a specific, absolute step number, or None if
+        they are not available: set_input_rows() was not called, or the step is no longer in memory. The step
+        should be at most the last step passed to get_vecs_origin_at_step(), and at least the one before it.
+        '''
+
+        rv = None
+
+        if self.input_values is not None and self.step_offset is not None:
+            rel_step = step - self.step_offset
+
+            if 0 <= rel_step < len(self.input_values):
+                rv = self.input_values[rel_step]
+            elif rel_step == -1:
+                rv = self.input_values_before
+
+        return rv
+
     def matrix_exp_vecs(self, start_list, num_steps):
         'use the one-step matrix exp strategy to get the next value of the basis vectors and origin simulation'
 
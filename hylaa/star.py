@@ -6,17 +6,20 @@ Aug 2016
 
 import math
 import time
+import weakref
+from collections import OrderedDict
 
 import numpy as np
 from numpy import array_repr
 from numpy.linalg import lstsq
 from numpy.testing import assert_array_almost_equal
+from scipy.linalg import lu_factor, lu_solve
 
 from hylaa.glpk_interface import LpInstance
 from hylaa.hybrid_automaton import HyperRectangle, LinearAutomatonTransition, LinearAutomatonMode, LinearConstraint
 from hylaa.timerutil import Timers as Timers
 from hylaa.util import Freezable
-from hylaa.starutil import GuardOptData, InitParent
+from hylaa.starutil import GuardOptData, InvariantOptData, InputSupport, InitParent, minimize_box
 from hylaa.containers import PlotSettings, HylaaSettings
 
 class InputStar(Freezable):
@@ -28,9 +31,12 @@ class InputStar(Freezable):
     parent star's basis matrix at a particular step, and multiplying by B (from x' = Ax + Bu + c).
 
     B.T (m by n) * star_basis_matrix (n by n) = input_basis_matrix (m by n) [this is transposed]
+
+    If the input_basis_matrix is already known (simulated along with the basis vectors, see
+    SimulationBundle.set_input_rows()), it can be passed in and the product is skipped.
     '''
 
-    def __init__(self, mode, star_basis_matrix):
+    def __init__(self, mode, star_basis_matrix, input_basis_matrix=None):
         Timers.tic('InputStar constructor')
         input_a_matrix_t = mode.u_constraints_a_t
         input_b_vector = mode.u_constraints_b
@@ -41,22 +47,127 @@ class InputStar(Freezable):
 
         self.a_matrix_t = input_a_matrix_t
         self.b_vector = input_b_vector
-        gb_t = mode.get_gb_t()
 
-        Timers.tic('InputStar constructor (dot)')
-        self.input_basis_matrix = np.dot(gb_t, star_basis_matrix)
-        Timers.toc('InputStar constructor (dot)')
+        if input_basis_matrix is not None:
+            self.input_basis_matrix = input_basis_matrix
+        else:
+            gb_t = mode.get_gb_t()
+
+            Timers.tic('InputStar constructor (dot)')
+            self.input_basis_matrix = np.dot(gb_t, star_basis_matrix)
+            Timers.toc('InputStar constructor (dot)')
         #print "input_basis_matrix = \n{}\n *\n {}\n = \n{}".format(gb_t, star_basis_matrix, self.input_basis_matrix)
         Timers.toc('InputStar constructor')
 
         self.freeze_attrs()
 
+class ConstraintStorage(object):
+    '''
+    Growable buffers for a star's constraint matrix and values. Cloned stars share the storage copy-on-write:
+    a star copies the storage before modifying it if num_sharing > 1 (see Star.get_writable_constraints()).
+    The stars are tracked with weak references, so stars which were garbage-collected don't count.
+    '''
+
+    def __init__(self, a_buf, b_buf):
+        self.a_buf = a_buf
+        self.b_buf = b_buf
+        self.sharers = weakref.WeakSet() # the stars using this storage
+        self.box = None # cached result of Star.box_bounds(), False if the predicate is not a box
+
+    @property
+    def num_sharing(self):
+        'the number of stars using this storage'
+
+        return len(self.sharers)
+
+    def __getstate__(self):
+        'get the state for pickling. The stars add themselves to sharers when they are unpickled.'
+
+        rv = self.__dict__.copy()
+        rv['sharers'] = None
+
+        return rv
+
+    def __setstate__(self, state):
+        'restore the pickled state'
+
+        self.__dict__.update(state)
+        self.sharers = weakref.WeakSet()
+
+class LinearConstraintView(LinearConstraint):
+    '''
+    A LinearConstraint which refers to a row of a star's constraint matrix (a_matrix, b_vector), so that
+    reading or assigning its vector and value reads or modifies the star's predicate.
+
+    Views are for compatibility with code using Star.constraint_list. They are invalidated if the star's
+    constraints are removed (remove_redundant_constraints()).
+    '''
+
+    def __init__(self, star, index): # pylint: disable=super-init-not-called
+        self.star = star
+        self.index = index
+
+    @property
+    def vector(self):
+        'the constraint vector (a view of the row in the a_matrix of the star)'
+
+        return self.star.a_matrix[self.index]
+
+    @vector.setter
+    def vector(self, vector):
+        self.star.get_writable_constraints()[0][self.index] = vector
+
+    @property
+    def value(self):
+        'the constraint value (from the b_vector of the star)'
+
+        return float(self.star.b_vector[self.index])
+
+    @value.setter
+    def value(self, value):
+        self.star.get_writable_constraints()[1][self.index] = value
+
+class ConstraintList(object):
+    'a read-only sequence of LinearConstraintView objects, one for each constraint in a star'
+
+    def __init__(self, star, storage):
+        self.star = star
+        self.storage = storage
+
+    def __len__(self):
+        return self.star.num_constraints
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            rv = [self[i] for i in xrange(*index.indices(len(self)))]
+        else:
+            if index < 0:
+                index += len(self)
+
+            if index < 0 or index >= len(self):
+                raise IndexError("constraint index out of range")
+
+            rv = LinearConstraintView(self.star, index)
+
+        return rv
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield LinearConstraintView(self.star, index)
+
+    def __str__(self):
+        return str(list(self))
+
+    def __repr__(self):
+        return repr(list(self))
+
 class Star(Freezable):
     '''
     A generalized star where linear constraints specify the containment predicate.
 
     A point alpha (expressed in the basis vectors) is in the star if each
-    LinearConstraint is satisfied.
+    LinearConstraint is satisfied. The constraints are stored as a matrix: a_matrix * alpha <= b_vector.
+    constraint_list gives a (read-only) sequence of LinearConstraint views of the rows.
 
     The star's center is directly assigned from the origin simulation vector at each step.
 
@@ -102,17 +213,30 @@ class Star(Freezable):
         assert isinstance(mode, LinearAutomatonMode)
         self.mode = mode # the LinearAutomatonMode
 
-        for lc in constraint_list:
-            isinstance(lc, LinearConstraint), "constraint_list should be a list of LinearConstraint objects"
-            assert lc.vector.shape[0] == self.num_dims, "each star's constraint's size should match num_dims"
+        # the star's predicate, a_matrix * alpha <= b_vector, is stored in the first num_constraints rows
+        # of growable buffers (see add_basis_constraint())
+        self._storage = None
+        self.num_constraints = 0
+
+        if isinstance(constraint_list, ConstraintList):
+            # share the other star's constraints, copy-on-write
+            self._storage = constraint_list.storage
+            self._storage.sharers.add(self)
+            self.num_constraints = len(constraint_list)
+        else:
+            for lc in constraint_list:
+                assert isinstance(lc, LinearConstraint), "constraint_list should be a list of LinearConstraint objects"
+                assert lc.vector.shape[0] == self.num_dims, "each star's constraint's size should match num_dims"
 
-        self.constraint_list = [c.clone() for c in constraint_list] # copy constraints
+            self._set_constraints(np.array([lc.vector for lc in constraint_list], dtype=float),
+                                  np.array([lc.value for lc in constraint_list], dtype=float))
 
         self.total_steps = 0
         self.fast_forward_steps = 0
 
+        # input stars are needed to rebuild the lps with inputs after invariant trimming (see add_basis_constraint())
         if settings.opt_decompose_lp and settings.opt_warm_start_lp and \
-                                         settings.plot.plot_mode == PlotSettings.PLOT_NONE:
+                        settings.plot.plot_mode == PlotSettings.PLOT_NONE and len(mode.inv_list) == 0:
             self.input_stars = None
         else:
             self.input_stars = [] # list of InputStars
@@ -125,11 +249,121 @@ class Star(Freezable):
         ## private member initialization ##
         ###################################
         self._star_lpi = None # LpInstance for plotting and non-guard operations
-        self._guard_opt_data = GuardOptData(self) # contains LP instance(s) for guard checks
+        self._guard_opt_data = None # contains LP instance(s) for guard checks, created on first use
+        self._guard_steps = 0 # steps done before _guard_opt_data was created (see update_from_sim())
+        self._inv_opt_data = None # with inputs, the accumulated input effects for invariant checks
+        self._input_support = None # with inputs, the input effects of the last step in the guard / invariant directions
+        self._input_steps = 0 # number of steps whose input effects were added (see update_from_sim())
+        self._last_input_star = None # the input star of the current hold interval, see mode.input_hold_steps
         self._verts = None # for plotting optimization, a cached copy of this star's projected polygon verts
+        self._basis_lu = None # cached (basis_matrix, lu factorization of basis_matrix.T), see _get_basis_lu()
+        self._redundant_check_size = settings.redundant_constraint_threshold # when to remove redundant constraints
 
         self.freeze_attrs()
 
+    @property
+    def a_matrix(self):
+        '''
+        the constraint matrix of the predicate (one row per constraint, in the star basis)
+
+        this is a read-only view, since the storage may be shared with clones (see get_writable_constraints())
+        '''
+
+        rv = self._storage.a_buf[:self.num_constraints]
+        rv.flags.writeable = False
+
+        return rv
+
+    @property
+    def b_vector(self):
+        'the constraint values of the predicate (a read-only view, like a_matrix)'
+
+        rv = self._storage.b_buf[:self.num_constraints]
+        rv.flags.writeable = False
+
+        return rv
+
+    @property
+    def constraint_list(self):
+        'the constraints, as a sequence of LinearConstraint views'
+
+        return ConstraintList(self, self._storage)
+
+    def _set_constraints(self, a_matrix, b_vector):
+        'set the predicate to (copies of) the passed-in constraint matrix and values'
+
+        assert a_matrix.shape == (b_vector.shape[0], self.num_dims)
+
+        if self._storage is not None:
+            self._storage.sharers.discard(self)
+
+        self._storage = ConstraintStorage(np.array(a_matrix, dtype=float), np.array(b_vector, dtype=float))
+        self._storage.sharers.add(self)
+        self.num_constraints = b_vector.shape[0]
+
+    def get_writable_constraints(self):
+        '''
+        get writable views of the star's (a_matrix, b_vector), copying the constraint storage first if it's
+        shared with other stars. The caller should update the star's lps if the constraints are changed.
+        '''
+
+        storage = self._storage
+
+        if storage.num_sharing > 1:
+            self._set_constraints(self.a_matrix, self.b_vector)
+            storage = self._storage
+        else:
+            storage.box = None
+
+        return storage.a_buf[:self.num_constraints], storage.b_buf[:self.num_constraints]
+
+    def release_lps(self):
+        '''
+        free the star's lps (they get recreated if they're needed again). The engine calls this when the star
+        stops being the current state.
+
+        With inputs, only lps that can be rebuilt are freed: the guard lps accumulate the input effects, and the
+        star's lp can be rebuilt only if the input stars are stored.
+        '''
+
+        if self.mode.num_inputs == 0 or self.input_stars is not None:
+            self._star_lpi = None
+
+        if self.mode.num_inputs == 0 and self._guard_opt_data is not None:
+            self._guard_steps = self._guard_opt_data.total_steps
+            self._guard_opt_data = None
+
+        if self._inv_opt_data is not None:
+            self._inv_opt_data.release_lps()
+
+        if self._input_support is not None:
+            self._input_support.release_lps()
+
+    def _get_guard_opt_data(self):
+        'get the GuardOptData for the star, creating it on first use'
+
+        if self._guard_opt_data is None:
+            self._guard_opt_data = GuardOptData(self)
+            self._guard_opt_data.total_steps = self._guard_steps
+
+        return self._guard_opt_data
+
+    def _get_inv_opt_data(self):
+        'get the InvariantOptData for the star, creating it on first use (before the first input star is added)'
+
+        if self._inv_opt_data is None:
+            self._inv_opt_data = InvariantOptData(self)
+
+        return self._inv_opt_data
+
+    def get_input_support(self):
+        'get the InputSupport for the star, creating it on first use'
+
+        if self._input_support is None:
+            self._input_support = InputSupport(self)
+
+        return self._input_support
+
     def init_post_jump_data(self, start_basis_matrix, total_steps, fast_forward_steps):
         '''initialize extra data after a discrete post occurs'''
 
@@ -142,17 +376,21 @@ class Star(Freezable):
         self.total_steps = total_steps # number of continuous post steps completed
         self.fast_forward_steps = fast_forward_steps
 
-    def get_lpi(self):
-        'get (maybe create) the LpInstance object for this star + inputs, and return it'
+    def get_lpi(self, role=None):
+        '''
+        get (maybe create) the LpInstance object for this star + inputs, and return it
+
+        role is the LpInstance.ROLE_* for the upcoming lp calls (for statistics), or None to leave it unchanged
+        '''
 
         rv = self._star_lpi
 
         if rv is None:
-            rv = LpInstance(self.num_dims, self.num_dims)
+            # without inputs, a reduced lp suffices since only the objective changes with the basis matrix
+            rv = LpInstance(self.num_dims, self.num_dims, reduced=self.mode.num_inputs == 0)
+            rv.set_owner(self)
             rv.update_basis_matrix(self.basis_matrix)
-
-            for lc in self.constraint_list:
-                rv.add_basis_constraint(lc.vector, lc.value)
+            rv.add_basis_constraints(self.a_matrix, self.b_vector)
 
             # add the influence of the inputs
             if self.input_stars is not None:
@@ -161,10 +399,73 @@ class Star(Freezable):
 
             self._star_lpi = rv
 
+        if role is not None:
+            rv.set_role(role)
+
+        return rv
+
+    def box_bounds(self):
+        '''
+        if the star's predicate is a box in the basis space (every constraint bounds a single basis variable,
+        and every basis variable has a lower and an upper bound), return the pair (low, high) of bound arrays.
+        Otherwise (or if settings.opt_box_support is False), return None.
+        '''
+
+        storage = self._storage
+
+        if storage.box is None:
+            storage.box = False
+
+            a_mat = self.a_matrix
+            nonzero = a_mat != 0
+
+            if self.settings.opt_box_support and np.all(np.sum(nonzero, axis=1) == 1):
+                low = np.array([-np.inf] * self.num_dims)
+                high = np.array([np.inf] * self.num_dims)
+
+                indices = np.argmax(nonzero, axis=1)
+                coeffs = a_mat[np.arange(self.num_constraints), indices]
+                bounds = self.b_vector / coeffs
+
+                upper = coeffs > 0
+                np.minimum.at(high, indices[upper], bounds[upper])
+                np.maximum.at(low, indices[~upper], bounds[~upper])
+
+                if np.all(np.isfinite(low)) and np.all(np.isfinite(high)):
+                    storage.box = (low, high)
+
+        return storage.box if storage.box is not False else None
+
+    def minimize(self, direction, result, role=None, error_if_infeasible=False):
+        '''
+        minimize the star in the passed-in direction (in the standard basis), like LpInstance.minimize() on the
+        star's lp: result gets the optimal offset from the star's center, followed by the optimal basis point and
+        the input values (as much as fits).
+
+        Box-shaped stars without inputs are minimized in closed form, otherwise the star's lp is used with the
+        given role (see get_lpi()).
+
+        returns True if the star is feasible
+        '''
+
+        box = self.box_bounds() if self.mode.num_inputs == 0 else None
+
+        if box is not None:
+            rv = minimize_box(self.basis_matrix, box, direction, result)
+
+            if not rv and error_if_infeasible:
+                raise RuntimeError('minimize LP was infeasible when error_if_infeasible=True')
+        else:
+            rv = self.get_lpi(role).minimize(direction, result, error_if_infeasible=error_if_infeasible)
+
         return rv
 
-    def update_from_sim(self, new_basis_matrix, new_center):
-        'update the star based on values from a new simulation time instant'
+    def update_from_sim(self, new_basis_matrix, new_center, input_effects=None):
+        '''
+        update the star based on values from a new simulation time instant
+
+        input_effects, if known, is gb_t times the current (pre-update) basis matrix, from the simulation
+        '''
 
         assert isinstance(new_basis_matrix, np.ndarray)
         assert isinstance(new_center, np.ndarray)
@@ -175,15 +476,43 @@ class Star(Freezable):
         Timers.tic('star.update_from_sim (make input star)')
         # add input star using the current basis matrix (before updating)
         input_star = None
+        merge = False
+
         if self.mode.num_inputs > 0:
             mode = self.mode
-            input_star = InputStar(mode, prev_basis_matrix)
+            input_star = InputStar(mode, prev_basis_matrix, input_effects)
+
+            # inputs held over several steps share the variables of a single input star, whose input basis matrix
+            # is the sum of the input effects of the steps in the hold interval. The intervals are counted back
+            # from the current step, so the oldest interval may be shorter (see ends_input_hold()).
+            assert mode.input_hold_steps >= 1
+            merge = self._input_steps % mode.input_hold_steps != 0
+
+            if merge:
+                input_star.input_basis_matrix = input_star.input_basis_matrix + \
+                    self._last_input_star.input_basis_matrix
+
+            self._last_input_star = input_star
+            self._input_steps += 1
 
             if self.input_stars is not None:
-                self.input_stars.append(input_star)
+                if merge:
+                    self.input_stars[-1] = input_star
+                else:
+                    self.input_stars.append(input_star)
 
             if self._star_lpi is not None:
-                self._star_lpi.add_input_star(input_star.a_matrix_t, input_star.b_vector, input_star.input_basis_matrix)
+                if merge:
+                    self._star_lpi.update_last_input_star(input_star.input_basis_matrix)
+                else:
+                    self._star_lpi.add_input_star(input_star.a_matrix_t, input_star.b_vector,
+                                                  input_star.input_basis_matrix)
+
+            # the input effects in all the guard and invariant directions are computed together
+            self.get_input_support().update(input_star, merge)
+
+            if len(mode.inv_list) > 0:
+                self._get_inv_opt_data().update_from_sim()
 
         Timers.toc('star.update_from_sim (make input star)')
         Timers.tic('star.update_from_sim (update basis matrix)')
@@ -195,6 +524,7 @@ class Star(Freezable):
             self.basis_matrix = np.dot(self.start_basis_matrix, new_basis_matrix)
 
         self.center = new_center
+        self._basis_lu = None
 
         if self._star_lpi is not None:
             self._star_lpi.update_basis_matrix(self.basis_matrix)
@@ -205,9 +535,13 @@ class Star(Freezable):
 
         Timers.toc('star.update_from_sim')
 
-        Timers.tic('guard_opt_data.update_from_sim')
-        self._guard_opt_data.update_from_sim(input_star)
-        Timers.toc('guard_opt_data.update_from_sim')
+        # without inputs, the guard lps don't depend on the steps so they can be created later
+        if self._guard_opt_data is None and self.mode.num_inputs == 0:
+            self._guard_steps += 1
+        else:
+            Timers.tic('guard_opt_data.update_from_sim')
+            self._get_guard_opt_data().update_from_sim(input_star, merge)
+            Timers.toc('guard_opt_data.update_from_sim')
 
     def center_into_constraints(self, basis_center):
         '''
@@ -219,15 +553,10 @@ class Star(Freezable):
         computing it twice.
         '''
 
-        new_vals = []
-
-        for lc in self.constraint_list:
-            offset = np.dot(lc.vector, basis_center)
-            lc.value += offset
-
-            new_vals.append(lc.value)
+        b_vec = self.get_writable_constraints()[1]
+        b_vec += np.dot(self.a_matrix, basis_center)
 
-        new_vals = np.array(new_vals, dtype=float)
+        new_vals = self.b_vector.copy()
 
         # reset center_sim to 0
         self.center = np.zeros((self.num_dims), dtype=float)
@@ -245,6 +574,20 @@ class Star(Freezable):
 
         return self.vector_to_star_basis(vec)
 
+    def _get_basis_lu(self):
+        '''
+        get the lu factorization of basis_matrix.T, which is computed once for each basis matrix.
+
+        This is used to solve systems with either basis_matrix.T or basis_matrix (lu_solve with trans=1).
+        '''
+
+        if self._basis_lu is None or self._basis_lu[0] is not self.basis_matrix:
+            Timers.tic("basis lu factorization")
+            self._basis_lu = (self.basis_matrix, lu_factor(self.basis_matrix.T, check_finite=False))
+            Timers.toc("basis lu factorization")
+
+        return self._basis_lu[1]
+
     def vector_to_star_basis(self, standard_vec):
         '''
         convert a vector in the standard basis to a point in the star's basis.
@@ -253,20 +596,30 @@ class Star(Freezable):
         inverse of basis_matrix, which can become ill-conditioned.
         '''
 
-        Timers.tic("vector_to_star_basis()")
+        rv = self.vectors_to_star_basis(np.array([standard_vec], dtype=float))[0]
+
+        assert isinstance(rv, np.ndarray)
+
+        return rv
+
+    def vectors_to_star_basis(self, standard_vecs):
+        '''
+        convert several vectors in the standard basis (the rows of standard_vecs) to points in the star's basis,
+        using the cached factorization of the basis matrix
+
+        returns a matrix where each row is the converted vector
+        '''
 
-        rv = np.linalg.solve(self.basis_matrix.T, standard_vec)
+        Timers.tic("vector_to_star_basis()")
 
-        #rv = lstsq(self.basis_matrix.T, np.array(standard_vec, dtype=float))[0]
+        rv = lu_solve(self._get_basis_lu(), standard_vecs.T, check_finite=False).T
 
         # double-check that we've found the solution within some tolerance
-        if not np.allclose(np.dot(self.basis_matrix.T, rv), standard_vec):
+        if not np.allclose(np.dot(rv, self.basis_matrix), standard_vecs):
             raise RuntimeError("basis matrix was ill-conditioned, vector_to_star_basis() failed")
 
         Timers.toc("vector_to_star_basis()")
 
-        assert isinstance(rv, np.ndarray)
-
         return rv
 
     def get_feasible_point(self, standard_dir=None):
@@ -274,15 +627,13 @@ class Star(Freezable):
         if it is feasible, this returns a point which is feasible, otherwise returns None
         '''
 
-        lpi = self.get_lpi()
-
         dims = self.num_dims
         num_inputs = self.mode.num_inputs
         input_dims = self.total_steps * num_inputs
         result = np.zeros(2 * dims + input_dims)
         opt_direction = -1 * np.array(standard_dir, dtype=float) if standard_dir is not None else np.zeros(dims)
 
-        if lpi.minimize(opt_direction, result, error_if_infeasible=False):
+        if self.minimize(opt_direction, result, role=LpInstance.ROLE_FEASIBILITY, error_if_infeasible=False):
             rv = result[0:dims] + self.center
         else:
             rv = None
@@ -298,7 +649,18 @@ class Star(Freezable):
 
         is_error_intersection = self.mode.transitions[index].to_mode.is_error
 
-        return self._guard_opt_data.get_guard_intersection(index, is_error_intersection)
+        return self._get_guard_opt_data().get_guard_intersection(index, is_error_intersection)
+
+    def get_guard_intersections(self):
+        '''
+        get the intersections with every guard, which are computed in parallel if guard threads are enabled
+
+        returns a list, with the optimal lp solution vector or None for each transition
+        '''
+
+        is_error_list = [t.to_mode.is_error for t in self.mode.transitions]
+
+        return self._get_guard_opt_data().get_guard_intersections(is_error_list)
 
     def is_feasible(self):
         'check if a star is feasible (not empty set)'
@@ -306,18 +668,44 @@ class Star(Freezable):
         return self.get_feasible_point() is not None
 
     def add_basis_constraint(self, lc):
-        '''add a linear constraint, in the star's basis, to the star's predicate'''
+        '''
+        add a linear constraint, in the star's basis, to the star's predicate
+
+        with inputs, the lps which contain input stars are rebuilt (the input stars must be stored)
+        '''
+
+        # add to the predicate matrix, doubling the buffer sizes if they're full
+        self.get_writable_constraints()
+        storage = self._storage
+
+        if self.num_constraints == storage.b_buf.shape[0]:
+            capacity = max(1, 2 * self.num_constraints)
 
-        assert self.mode.num_inputs == 0, "add_basis_constraint() w/ time-varying inputs not yet supported"
+            a_buf = np.zeros((capacity, self.num_dims))
+            a_buf[:self.num_constraints] = self.a_matrix
+            b_buf = np.zeros((capacity,))
+            b_buf[:self.num_constraints] = self.b_vector
 
-        # add to predicate list
-        self.constraint_list.append(lc)
+            storage.a_buf = a_buf
+            storage.b_buf = b_buf
+
+        storage.a_buf[self.num_constraints] = lc.vector
+        storage.b_buf[self.num_constraints] = lc.value
+        self.num_constraints += 1
 
         # add to guard opt data
-        self._guard_opt_data.add_basis_constraint(lc)
+        if self._guard_opt_data is not None:
+            self._guard_opt_data.add_basis_constraint(lc)
+
+        if self._inv_opt_data is not None:
+            self._inv_opt_data.add_basis_constraint(lc)
 
         if self._star_lpi is not None:
-            self._star_lpi.add_basis_constraint(lc.vector, lc.value)
+            if self.mode.num_inputs == 0:
+                self._star_lpi.add_basis_constraint(lc.vector, lc.value)
+            else:
+                assert self.input_stars is not None, "add_basis_constraint() w/ inputs requires stored input stars"
+                self._star_lpi = None # gets rebuilt in get_lpi()
 
         if self._verts is not None:
             self._verts = None
@@ -326,6 +714,11 @@ class Star(Freezable):
         '''
         trim the star to the mode's invariant.
 
+        With inputs, the star's support in each invariant direction is computed by decomposition (see
+        InvariantOptData): only the no-input star is optimized. If an invariant may be violated, the constraint
+        added to the star's predicate (in the star's basis) assumes the most favorable input effects, which
+        over-approximates the intersection with the invariant. Only then are the lps with inputs rebuilt.
+
         returns (is_still_feasible, inv_vio_star_list)
         '''
 
@@ -333,21 +726,30 @@ class Star(Freezable):
         inv_vio_star_list = []
 
         if len(self.mode.inv_list) > 0:
-            assert self.mode.num_inputs == 0, "mode invariants + dynamics with time-varying inputs not yet supported"
+            inv_data = self._get_inv_opt_data() if self.mode.num_inputs > 0 else None
+            result = np.zeros(2 * self.num_dims)
 
             # check each invariant condition to see if it is violated
-            lpi = self.get_lpi()
-
-            for lin_con in self.mode.inv_list:
+            for inv_index in xrange(len(self.mode.inv_list)):
+                lin_con = self.mode.inv_list[inv_index]
                 objective = np.array([-ele for ele in lin_con.vector], dtype=float)
-                result = np.zeros(2 * self.num_dims)
 
-                lpi.minimize(objective, result, error_if_infeasible=True)
+                if inv_data is None:
+                    self.minimize(objective, result, role=LpInstance.ROLE_INVARIANT, error_if_infeasible=True)
 
-                offset = result[0:self.num_dims]
-                point = self.center + offset
+                    offset = result[0:self.num_dims]
+                    point = self.center + offset
 
-                val = np.dot(point, lin_con.vector)
+                    val = np.dot(point, lin_con.vector)
+                else:
+                    # Minkowski sum: center + no-input star + the accumulated input effects
+                    if not inv_data.minimize_no_input(objective, result):
+                        still_feasible = False
+                        break
+
+                    no_input_val = np.dot(result[0:self.num_dims], lin_con.vector)
+
+                    val = np.dot(self.center, lin_con.vector) + no_input_val + inv_data.input_maxs[inv_index]
 
                 if val > lin_con.value:
                     # add the constraint to the star's constraints
@@ -358,9 +760,16 @@ class Star(Freezable):
                     center_value = np.dot(self.center, lin_con.vector)
                     remaining_value = lin_con.value - center_value
 
+                    if inv_data is not None:
+                        # the inputs can't be constrained in the star's basis, so use the most favorable inputs
+                        remaining_value -= inv_data.input_mins[inv_index]
+
+                        if no_input_val <= remaining_value:
+                            continue # the constraint would not cut the no-input star
+
                     basis_lc = LinearConstraint(basis_condition, remaining_value)
 
-                    if self.settings.plot.plot_mode != PlotSettings.PLOT_NONE:
+                    if self.settings.plot.plot_mode != PlotSettings.PLOT_NONE and inv_data is None:
                         # use the inverse of the invariant constraint for plotting
 
                         inv_lc = LinearConstraint([-1 * ele for ele in basis_lc.vector], -basis_lc.value)
@@ -375,13 +784,108 @@ class Star(Freezable):
                     # add the constraint AFTER making the plot violation star
                     self.add_basis_constraint(basis_lc)
 
+                    if inv_data is not None and not inv_data.minimize_no_input(objective, result):
+                        # with inputs, the star is empty if the no-input star is empty
+                        still_feasible = False
+                        break
+
                 # we added a new constraint to the star, check if it's still feasible
-                if not self.is_feasible():
+                if inv_data is None and not self.is_feasible():
                     still_feasible = False
                     break # don't check the remaining invariant linear conditions
 
+        if still_feasible and self.settings.trim_redundant_inv_constraints and self.mode.num_inputs == 0 and \
+                                            self.num_constraints >= self._redundant_check_size:
+            self.remove_redundant_constraints()
+
+            # if many constraints remain, don't check again until the number doubles
+            self._redundant_check_size = max(self.settings.redundant_constraint_threshold,
+                                             2 * self.num_constraints)
+
         return (still_feasible, inv_vio_star_list)
 
+    def remove_redundant_constraints(self):
+        '''
+        remove redundant constraints from the star's constraint list, and rebuild the star's lps using only
+        the remaining constraints. Cheap tests are done first (zero vectors and parallel duplicates), and then
+        each of the remaining constraints is checked using an lp.
+
+        returns the number of constraints removed
+        '''
+
+        assert self.mode.num_inputs == 0, "remove_redundant_constraints() w/ time-varying inputs not yet supported"
+
+        Timers.tic('remove_redundant_constraints')
+
+        a_mat = self.a_matrix
+        b_vec = self.b_vector
+
+        # cheap tests: skip zero constraints that are always true, and keep only the tightest parallel constraint
+        tightest = OrderedDict() # normalized vector -> (normalized value, constraint index)
+        norms = np.linalg.norm(a_mat, axis=1)
+
+        for index in xrange(self.num_constraints):
+            norm = norms[index]
+
+            if norm == 0:
+                if b_vec[index] < 0:
+                    tightest[index] = (None, index) # always false, keep it
+            else:
+                key = tuple(np.round(a_mat[index] / norm, 12))
+                val = b_vec[index] / norm
+                existing = tightest.get(key)
+
+                if existing is None or val < existing[0]:
+                    tightest[key] = (val, index)
+
+        candidates = [index for _, index in tightest.itervalues()]
+        keep = candidates
+
+        # lp test: a constraint is redundant if maximizing in its direction (with the constraint relaxed)
+        # doesn't exceed its value
+        if len(candidates) > 1:
+            lpi = LpInstance(self.num_dims, self.num_dims, reduced=True)
+            lpi.set_owner(self)
+            lpi.set_role(LpInstance.ROLE_INVARIANT)
+            lpi.update_basis_matrix(np.identity(self.num_dims))
+            lpi.add_basis_constraints(a_mat[candidates], b_vec[candidates])
+
+            vals = b_vec[candidates]
+            result = np.zeros(self.num_dims)
+            keep = []
+
+            for index in xrange(len(candidates)):
+                vector = a_mat[candidates[index]]
+                value = vals[index]
+
+                vals[index] = value + max(1.0, abs(value))
+                lpi.set_basis_constraint_values(vals)
+
+                if not lpi.minimize(-1 * vector, result):
+                    keep = candidates # star is infeasible, don't remove anything
+                    break
+
+                if np.dot(result, vector) > value + 1e-9 * max(1.0, abs(value)):
+                    vals[index] = value
+                    keep.append(candidates[index])
+                # else redundant; it's safe to leave it relaxed for checking the remaining constraints
+
+        num_removed = self.num_constraints - len(keep)
+
+        if num_removed > 0:
+            self._set_constraints(a_mat[keep], b_vec[keep])
+
+            # rebuild lps using the remaining constraints (the guard lps are recreated on next use)
+            self._star_lpi = None
+
+            if self._guard_opt_data is not None:
+                self._guard_steps = self._guard_opt_data.total_steps
+                self._guard_opt_data = None
+
+        Timers.toc('remove_redundant_constraints')
+
+        return num_removed
+
     def add_std_constraint_direction(self, standard_direction):
         '''
         add a constraint direction, given in the standard basis to the star
@@ -390,25 +894,43 @@ class Star(Freezable):
         assert isinstance(standard_direction, np.ndarray)
         assert standard_direction.shape == (self.num_dims,)
 
-        lpi = self.get_lpi()
-        basis_direction = np.dot(self.basis_matrix, standard_direction)
+        self.add_std_constraint_directions([standard_direction])
 
-        result = np.zeros((2 * self.num_dims))
+    def add_std_constraint_directions(self, standard_directions):
+        '''
+        add several constraint directions, given in the standard basis, to the star
 
-        # multiplying by -1 turns it into a maximization
-        lpi.minimize(-1 * standard_direction, result, error_if_infeasible=True)
+        The optimal points are all found before any constraint is added (the new constraints touch the star, so they
+        don't change it), and then converted to the star's basis together.
+        '''
 
-        opt_pt = result[:self.num_dims]
-        basis_pt = self.vector_to_star_basis(opt_pt)
+        if not standard_directions:
+            return
 
-        opt_val = np.dot(basis_pt, basis_direction)
+        dims = self.num_dims
+        opt_pts = np.zeros((len(standard_directions), dims))
+        result = np.zeros((2 * dims))
 
-        # offset the multiple to account for the stars' centers
-        opt_val -= np.dot(basis_direction, self.center)
+        for index in xrange(len(standard_directions)):
+            standard_direction = standard_directions[index]
 
-        lc = LinearConstraint(basis_direction, opt_val)
+            # multiplying by -1 turns it into a maximization
+            self.minimize(-1 * standard_direction, result, role=LpInstance.ROLE_AGGREGATION, error_if_infeasible=True)
+            opt_pts[index] = result[:dims]
+
+        basis_pts = self.vectors_to_star_basis(opt_pts)
+
+        for index in xrange(len(standard_directions)):
+            basis_direction = np.dot(self.basis_matrix, standard_directions[index])
+
+            opt_val = np.dot(basis_pts[index], basis_direction)
 
-        self.add_basis_constraint(lc)
+            # offset the multiple to account for the stars' centers
+            opt_val -= np.dot(basis_direction, self.center)
+
+            lc = LinearConstraint(basis_direction, opt_val)
+
+            self.add_basis_constraint(lc)
 
     def eat_star(self, other_star):
         '''
@@ -419,8 +941,6 @@ class Star(Freezable):
         # This may be possible without inverting the basis matrix... but I couldn't figure it out
         # may not matter; new intersection will probably need to use combined LP
 
-        changed = False
-
         # first update total_steps to be the minimum
         self.total_steps = min(self.total_steps, other_star.total_steps)
 
@@ -428,41 +948,41 @@ class Star(Freezable):
         assert isinstance(other_star, Star)
         assert self.num_dims == other_star.num_dims
 
-        lpi = other_star.get_lpi()
         result = np.zeros((2 * self.num_dims))
+        num_constraints = self.num_constraints
 
-        # possibly increase every constraint
-        lc_vals = []
+        # the basis constraint directions in the standard basis: inv(basis_matrix) * lc.vector, for each constraint
+        a_mat = self.a_matrix
+        standard_directions = lu_solve(self._get_basis_lu(), a_mat.T, trans=1, check_finite=False).T
 
-        for lc in self.constraint_list:
-            # maximize the basis constraint direction in other_star
-            standard_direction = np.dot(np.linalg.inv(self.basis_matrix), lc.vector)
+        # maximize each basis constraint direction in other_star
+        opt_pts = np.zeros((num_constraints, self.num_dims))
 
+        for index in xrange(num_constraints):
             # multiplying by -1 turns it into a maximization
-            lpi.minimize(-1 * standard_direction, result, error_if_infeasible=True)
+            other_star.minimize(-1 * standard_directions[index], result, role=LpInstance.ROLE_AGGREGATION,
+                                error_if_infeasible=True)
 
-            opt_pt = result[:self.num_dims]
+            opt_pts[index] = result[:self.num_dims]
 
-            basis_pt = self.vector_to_star_basis(opt_pt)
+        basis_pts = self.vectors_to_star_basis(opt_pts)
 
-            opt_val = np.dot(basis_pt, lc.vector)
+        opt_vals = np.sum(basis_pts * a_mat, axis=1)
 
-            # offset the multiple to account for the stars' centers
-            opt_val += np.dot(lc.vector, other_star.center)
-            opt_val -= np.dot(lc.vector, self.center)
-
-            # and update if the new constraint is looser
-            if opt_val > lc.value:
-                lc.value = opt_val
-                changed = True
+        # offset the multiple to account for the stars' centers
+        opt_vals += np.dot(a_mat, other_star.center)
+        opt_vals -= np.dot(a_mat, self.center)
 
-            lc_vals.append(lc.value)
+        # possibly increase every constraint, if the new constraint is looser
+        looser = opt_vals > self.b_vector
 
         # reset cached values if the star's constraints were changed
-        if changed:
+        if np.any(looser):
+            self.get_writable_constraints()[1][looser] = opt_vals[looser]
+
             self._verts = None
 
-            lc_vals = np.array(lc_vals, dtype=float)
+            lc_vals = self.b_vector.copy()
 
             if self._star_lpi is not None:
                 self._star_lpi.set_basis_constraint_values(lc_vals)
@@ -471,16 +991,61 @@ class Star(Freezable):
                 self._guard_opt_data.set_basis_constraint_values(lc_vals)
 
     def clone(self):
-        'return a copy of the star'
+        '''
+        return a copy of the star
+
+        This is cheap: the center and basis matrix are shared (they are replaced rather than modified), the
+        constraints are shared copy-on-write, and the clone's lps are only created if they get used.
+        '''
 
         assert self.input_stars is None or len(self.input_stars) == 0, "clone() not supported with input stars"
 
         rv = Star(self.settings, self.center, self.basis_matrix, self.constraint_list, self.parent, self.mode)
 
         rv.init_post_jump_data(self.start_basis_matrix, self.total_steps, self.fast_forward_steps)
+        rv._basis_lu = self._basis_lu
+
+        return rv
+
+    def has_input_effects(self):
+        'have the input effects of any steps been added to the star (see update_from_sim())'
+
+        return self._input_steps > 0
+
+    def ends_input_hold(self):
+        '''
+        does the current step end a hold interval of the inputs (see mode.input_hold_steps)? The intervals are
+        counted back from the current step, so only at these steps are they aligned with the start of the post, where
+        the star is the reachable set of the input schedules which are piecewise constant from the start of the post.
+        '''
+
+        return self._input_steps % self.mode.input_hold_steps == 0
+
+    def __getstate__(self):
+        '''
+        get the state for pickling (see hylaa/serialize.py). Like in release_lps(), the lps and cached data are
+        not included, they get recreated if they're needed again. The guard lps of a star with inputs accumulate the
+        input effects and can't be recreated, so such a star can only be pickled before its first step.
+        '''
+
+        assert self._input_steps == 0, "stars with input effects can't be pickled"
+
+        rv = self.__dict__.copy()
+
+        if self._guard_opt_data is not None:
+            rv['_guard_steps'] = self._guard_opt_data.total_steps
+
+        for key in ['_star_lpi', '_guard_opt_data', '_inv_opt_data', '_input_support', '_verts', '_basis_lu']:
+            rv[key] = None
 
         return rv
 
+    def __setstate__(self, state):
+        'restore the pickled state'
+
+        self.__dict__.update(state)
+        self._storage.sharers.add(self)
+
     def __repr__(self):
         '''
         this does not print parent. mode is printed as ha.modes['name']
@@ -504,20 +1069,9 @@ class Star(Freezable):
         expressed as basis vectors) contained in the set?
         '''
 
-        a_mat = np.zeros((len(self.constraint_list), self.num_dims))
-
-        for i in xrange(len(self.constraint_list)):
-            a_mat[i, :] = self.constraint_list[i].vector
+        result = np.dot(self.a_matrix, basis_vals)
 
-        result = np.dot(a_mat, basis_vals)
-        rv = True
-
-        for i in xrange(len(result)):
-            if result[i] > atol + self.constraint_list[i].value:
-                rv = False
-                break
-
-        return rv
+        return bool(np.all(result <= atol + self.b_vector))
 
     def contains_point(self, standard_point, atol=0):
         'is the passed-in point (in the standard basis) contained in the set?'
@@ -526,6 +1080,35 @@ class Star(Freezable):
 
         return self.contains_basis(basis_vecs, atol=atol)
 
+    def contains_basis_batch(self, basis_vals, atol=0):
+        '''
+        which of the passed-in points (the rows of basis_vals, already offset by the star's center and
+        expressed as basis vectors) are contained in the set?
+
+        returns a boolean array with one entry per point
+        '''
+
+        basis_vals = np.array(basis_vals, dtype=float, ndmin=2)
+        assert basis_vals.shape[1] == self.num_dims
+
+        result = np.dot(basis_vals, self.a_matrix.T)
+
+        return np.all(result <= atol + self.b_vector, axis=1)
+
+    def contains_points(self, standard_points, atol=0):
+        '''
+        which of the passed-in points (the rows of standard_points, in the standard basis) are contained in the set?
+
+        returns a boolean array with one entry per point
+        '''
+
+        standard_points = np.array(standard_points, dtype=float, ndmin=2)
+        assert standard_points.shape[1] == self.num_dims
+
+        basis_vals = self.vectors_to_star_basis(standard_points - self.center)
+
+        return self.contains_basis_batch(basis_vals, atol=atol)
+
     def __str__(self):
         return "[Star: dims={}, center={}, basis_matrix=\n{}\n, constraint_list=\n{}\n, total_steps={}]".format(
             self.num_dims, self.center, self.basis_matrix, self.constraint_list, self.total_steps)
@@ -588,9 +1171,13 @@ class Star(Freezable):
             if Star.high_vert_mode:
                 use_binary_search = False
 
-            pts = self._find_star_boundaries(use_binary_search=use_binary_search)
+            if self.settings.plot.exact_projection and xdim != ydim:
+                pts = self._find_exact_boundaries()
+            else:
+                pts = self._find_star_boundaries(use_binary_search=use_binary_search)
 
-            if len(pts) > len(Star.plot_vecs)/2 and not Star.high_vert_mode:
+            if len(pts) > len(Star.plot_vecs)/2 and not Star.high_vert_mode and \
+                                    not self.settings.plot.exact_projection:
                 # don't use binary search anymore, and reduce the number of directions being plotted
 
                 Star.high_vert_mode = True
@@ -620,8 +1207,6 @@ class Star(Freezable):
         points which match start_point or end_point are not returned
         '''
 
-        star_lpi = self.get_lpi()
-
         dirs = Star.plot_vecs
         rv = []
 
@@ -629,7 +1214,7 @@ class Star(Freezable):
             mid = (start + end) / 2
             mid_point = np.zeros(self.num_dims)
 
-            star_lpi.minimize(dirs[mid], mid_point, error_if_infeasible=True)
+            self.minimize(dirs[mid], mid_point, role=LpInstance.ROLE_STAR_PLOT, error_if_infeasible=True)
 
             not_start = not np.array_equal(start_point, mid_point)
             not_end = not np.array_equal(end_point, mid_point)
@@ -652,8 +1237,7 @@ class Star(Freezable):
         of the passed-in directions
         '''
 
-        star_lpi = self.get_lpi()
-
+        role = LpInstance.ROLE_STAR_PLOT
         standard_center = self.center
         point = np.zeros(self.num_dims)
         direction_list = Star.plot_vecs
@@ -666,35 +1250,35 @@ class Star(Freezable):
             last_point = None
 
             for direction in direction_list:
-                star_lpi.minimize(direction, point, error_if_infeasible=True)
+                self.minimize(direction, point, role=role, error_if_infeasible=True)
 
                 if last_point is None or not np.array_equal(point, last_point):
                     last_point = point.copy()
                     rv.append(standard_center + point)
         else:
             # optimized approach: do binary search to find changes
-            star_lpi.minimize(direction_list[0], point, error_if_infeasible=True)
+            self.minimize(direction_list[0], point, role=role, error_if_infeasible=True)
             rv.append(point.copy())
 
             # add it in thirds, to ensure we don't miss anything
             third = len(direction_list) / 3
 
             # 0 to 1/3
-            star_lpi.minimize(direction_list[third], point, error_if_infeasible=True)
+            self.minimize(direction_list[third], point, role=role, error_if_infeasible=True)
 
             if not np.array_equal(point, rv[-1]):
                 rv += self._binary_search_star_boundaries(0, third, rv[-1], point)
                 rv.append(point.copy())
 
             # 1/3 to 2/3
-            star_lpi.minimize(direction_list[2*third], point, error_if_infeasible=True)
+            self.minimize(direction_list[2*third], point, role=role, error_if_infeasible=True)
 
             if not np.array_equal(point, rv[-1]):
                 rv += self._binary_search_star_boundaries(third, 2*third, rv[-1], point)
                 rv.append(point.copy())
 
             # 2/3 to end
-            star_lpi.minimize(direction_list[-1], point, error_if_infeasible=True)
+            self.minimize(direction_list[-1], point, role=role, error_if_infeasible=True)
 
             if not np.array_equal(point, rv[-1]):
                 rv += self._binary_search_star_boundaries(2*third, len(direction_list) - 1, rv[-1], point)
@@ -709,6 +1293,79 @@ class Star(Freezable):
 
         return rv
 
+    def _find_exact_boundaries(self, rel_tol=1e-9):
+        '''
+        find the verticies of the star's exact projection onto the plot dimensions, in counter-clockwise order
+        (returned as points in the standard basis, like _find_star_boundaries()).
+
+        This starts from the optimal points in three directions and walks the polygon edges between consecutive
+        verticies. For each edge, one lp is solved in the edge's outward normal direction: either the edge is
+        confirmed, or a new vertex is found and both sub-edges are checked. The number of lps is therefore
+        proportional to the number of verticies of the projection, and does not depend on num_angles.
+
+        rel_tol is the tolerance for confirming an edge, relative to the size of the polygon
+        '''
+
+        role = LpInstance.ROLE_STAR_PLOT
+        xdim = self.settings.plot.xdim
+        ydim = self.settings.plot.ydim
+
+        def optimize(x, y):
+            'get the point which minimizes (x, y) in the plot dimensions'
+
+            direction = np.zeros(self.num_dims)
+            direction[xdim] = x
+            direction[ydim] = y
+
+            point = np.zeros(self.num_dims)
+            self.minimize(direction, point, role=role, error_if_infeasible=True)
+
+            return point
+
+        # minimizing in directions with increasing angles gives counter-clockwise points
+        pts = [optimize(math.cos(theta), math.sin(theta)) for theta in [0, 2 * math.pi / 3, 4 * math.pi / 3]]
+
+        xy_pts = np.array([[pt[xdim], pt[ydim]] for pt in pts])
+        scale = max(1.0, np.max(np.abs(xy_pts[0] - xy_pts[1:])))
+        tol = rel_tol * scale
+
+        # rv is the list of confirmed verticies, stack are the unconfirmed ones, the top is the next vertex
+        rv = [pts[0]]
+        stack = [pts[0], pts[2], pts[1]]
+
+        # each new vertex is strictly outside the current polygon, so this terminates; the limit guards against
+        # numerical issues, and is the most verticies that optimizing in num_angles directions could find
+        max_verts = self.settings.plot.num_angles
+
+        while stack:
+            start = rv[-1]
+            end = stack[-1]
+
+            edge_x = end[xdim] - start[xdim]
+            edge_y = end[ydim] - start[ydim]
+
+            if abs(edge_x) <= tol and abs(edge_y) <= tol:
+                # same point; it's also optimal in all directions between the two (no lp needed)
+                stack.pop()
+                continue
+
+            # minimize the inward normal of the edge to find the point farthest outside it
+            point = optimize(-edge_y, edge_x)
+
+            # distance outside the edge, scaled by the edge length
+            dist = edge_y * (point[xdim] - start[xdim]) - edge_x * (point[ydim] - start[ydim])
+
+            if dist > tol * math.sqrt(edge_x**2 + edge_y**2) and len(rv) + len(stack) < max_verts:
+                stack.append(point)
+            else:
+                rv.append(stack.pop())
+
+        # the last point is the first point
+        if len(rv) > 1:
+            rv.pop()
+
+        return [self.center + pt for pt in rv]
+
 def init_point_to_star(settings, pt, mode):
     'convert an n-d point to a LinearConstraintStar'
 
@@ -9,7 +9,8 @@ import itertools
 
 import numpy as np
 from hylaa.hybrid_automaton import LinearAutomatonMode, LinearAutomatonTransition
-from hylaa.util import Freezable
+from hylaa.util import Freezable, PinnedThreadPool
+from hylaa.timerutil import Timers
 from hylaa.glpk_interface import LpInstance
 
 class StarParent(object):
@@ -62,14 +63,40 @@ class AggregationParent(StarParent):
 
         assert len(stars) > 1, "aggregation successor should be of 2 or more stars"
 
+# worker threads for the per-transition guard lps, created on first use (see HylaaSettings.guard_check_threads)
+_guard_pool = None
+
+def get_guard_pool(num_threads):
+    'get the worker thread pool for guard checks with the given number of threads'
+
+    global _guard_pool # pylint: disable=global-statement
+
+    if _guard_pool is None or _guard_pool.num_threads != num_threads:
+        _guard_pool = PinnedThreadPool(num_threads, thread_init=LpInstance.set_thread_executor)
+
+    return _guard_pool
+
+def reset_guard_pool():
+    'forget the guard thread pool, for example in a forked process (where its threads do not exist)'
+
+    global _guard_pool # pylint: disable=global-statement
+
+    _guard_pool = None
+
 class GuardOptData(Freezable):
     'data for guard optimization'
 
     def __init__(self, star):
         self.star = star
+        num_transitions = len(star.mode.transitions)
 
+        # if threads are used, the lps for transition i are created and used only in worker thread i % num_threads
+        num_threads = star.settings.guard_check_threads
+        self.pool = get_guard_pool(num_threads) if num_threads is not None and num_transitions > 1 else None
+
+        # the lps for each transition are created the first time they're needed (see _init_guard_lps())
         if star.settings.opt_warm_start_lp:
-            self.combined_lpis = [self.make_combined_lpi(trans, skip_inputs=True) for trans in star.mode.transitions]
+            self.combined_lpis = [None] * num_transitions
 
         if star.settings.opt_decompose_lp:
             # one lpi for every direction in every guard
@@ -80,36 +107,115 @@ class GuardOptData(Freezable):
                 self.guard_constraint_min_list.append([0.0] * num_conditions)
 
         if star.settings.opt_warm_start_lp and star.settings.opt_decompose_lp:
-            self.solved_full_lp = False # gets set when the full lp is solved the first time
+            # gets set for each transition when its full lp is solved the first time
+            self.solved_full_lp = [False] * num_transitions
 
-            self.no_input_lpis = []
-            self.input_lpis = []
+            self.no_input_lpis = [None] * num_transitions
 
-            for trans in star.mode.transitions:
-                num_conditions = len(trans.condition_list)
+        # with settings.input_window_steps = k, the combined lps contain the exact input effects of the last k to
+        # 2k-1 steps (input_window). Older input effects are folded into folded_mins, the sum of their minimums
+        # in each guard condition's direction, which relaxes the guard conditions (an over-approximation).
+        self.input_window = None
+        self.window_mins = None # for each transition, a list of the per-condition minimums of each window step
+        self.folded_mins = None # for each transition, the per-condition sum of the folded steps' minimums
+        self.num_folded_steps = 0
+
+        if star.settings.input_window_steps is not None and star.mode.num_inputs > 0:
+            assert star.settings.input_window_steps >= 1
+            assert star.settings.opt_decompose_lp, "input_window_steps requires settings.opt_decompose_lp"
 
-                self.no_input_lpis.append([self.make_no_input_lpi() for _ in xrange(num_conditions)])
-                self.input_lpis.append([self.make_input_lpi() for _ in xrange(num_conditions)])
+            self.input_window = []
+            self.window_mins = [[] for _ in star.mode.transitions]
+            self.folded_mins = [np.zeros(len(t.condition_list)) for t in star.mode.transitions]
 
         self.total_steps = 0
+        self.num_input_stars = 0 # the number of input stars (fewer than total_steps if inputs are held)
         self.freeze_attrs()
 
-    def add_basis_constraint(self, lc):
+    def _init_guard_lps(self, guard_index):
         '''
-        add a constraint which is given in the star's basis. This assumes there are no inputs.
+        create the warm-start lps for a single transition, if they don't exist yet. This is called (in the
+        transition's worker thread, if guard threads are enabled) right before the lps are first used.
+
+        With inputs, update_from_sim() creates the lps before the first input star is added, so the input
+        effects don't need to be replayed.
         '''
 
-        assert self.star.mode.num_inputs == 0, 'adding constaints w/ inputs unsupported'
+        if self.star.settings.opt_warm_start_lp and self.combined_lpis[guard_index] is None:
+            transition = self.star.mode.transitions[guard_index]
+            self.combined_lpis[guard_index] = self.make_combined_lpi(transition, skip_inputs=True)
+
+    def _get_no_input_lpis(self, guard_index):
+        '''
+        get the warm-start no-input lps for a single transition (one per condition), creating them if needed. These
+        are not needed while the no-input term is computed in closed form (for box stars).
+        '''
+
+        if self.no_input_lpis[guard_index] is None:
+            condition_list = self.star.mode.transitions[guard_index].condition_list
+            self.no_input_lpis[guard_index] = [self.make_no_input_lpi() for _ in condition_list]
+
+        return self.no_input_lpis[guard_index]
+
+    def num_created_lps(self):
+        'get the number of transitions whose lps (combined or no-input) have been created'
+
+        rv = 0
 
         if self.star.settings.opt_warm_start_lp:
-            for lpi in self.combined_lpis:
-                lpi.add_basis_constraint(lc.vector, lc.value)
+            for guard_index in xrange(len(self.combined_lpis)):
+                if self.combined_lpis[guard_index] is not None or \
+                        (self.star.settings.opt_decompose_lp and self.no_input_lpis[guard_index] is not None):
+                    rv += 1
 
-        if self.star.settings.opt_decompose_lp:
+        return rv
 
-            for guard_lpis in self.no_input_lpis:
-                for lpi in guard_lpis:
-                    lpi.add_basis_constraint(lc.vector, lc.value)
+    def _for_each_guard(self, func, *args):
+        '''
+        call func(guard_index, *args) for every transition, and return the list of results
+
+        if guard threads are enabled, each call is run in the transition's worker thread
+        '''
+
+        num_transitions = len(self.star.mode.transitions)
+
+        if self.pool is None:
+            rv = [func(i, *args) for i in xrange(num_transitions)]
+        else:
+            rv = self.pool.map([(i, func, (i,) + args) for i in xrange(num_transitions)])
+
+        return rv
+
+    def add_basis_constraint(self, lc):
+        '''
+        add a constraint which is given in the star's basis.
+
+        With inputs, the combined lps are rebuilt (lp rows can't be added after the input stars), so the star's
+        input stars (or the input window) must be stored.
+        '''
+
+        self._for_each_guard(self._add_guard_basis_constraint, lc)
+
+    def _add_guard_basis_constraint(self, guard_index, lc):
+        'add a basis constraint to the lps for a single transition'
+
+        # lps which are created later will include the constraint
+        if self.star.settings.opt_warm_start_lp and self.combined_lpis[guard_index] is not None:
+            if self.star.mode.num_inputs == 0:
+                self.combined_lpis[guard_index].add_basis_constraint(lc.vector, lc.value)
+            else:
+                assert self.input_window is not None or self.star.input_stars is not None
+
+                self.combined_lpis[guard_index] = self.make_combined_lpi(self.star.mode.transitions[guard_index])
+
+                if self.star.settings.opt_decompose_lp:
+                    # warm-start the rebuilt lp like a new one (see _lp_guard_intersection())
+                    self.solved_full_lp[guard_index] = False
+
+        if self.star.settings.opt_warm_start_lp and self.star.settings.opt_decompose_lp and \
+                self.no_input_lpis[guard_index] is not None:
+            for lpi in self.no_input_lpis[guard_index]:
+                lpi.add_basis_constraint(lc.vector, lc.value)
 
     def set_basis_constraint_values(self, new_vals):
         '''
@@ -118,23 +224,27 @@ class GuardOptData(Freezable):
 
         assert self.star.mode.num_inputs == 0, 'setting constaint values w/ inputs unsupported'
 
-        if self.star.settings.opt_warm_start_lp:
-            for lpi in self.combined_lpis:
-                lpi.set_basis_constraint_values(new_vals)
+        self._for_each_guard(self._set_guard_basis_constraint_values, new_vals)
 
-        if self.star.settings.opt_decompose_lp:
-            for guard_lpis in self.no_input_lpis:
-                for lpi in guard_lpis:
-                    lpi.set_basis_constraint_values(new_vals)
+    def _set_guard_basis_constraint_values(self, guard_index, new_vals):
+        'set the basis constraint values in the lps for a single transition'
+
+        if self.star.settings.opt_warm_start_lp and self.combined_lpis[guard_index] is not None:
+            self.combined_lpis[guard_index].set_basis_constraint_values(new_vals)
+
+        if self.star.settings.opt_warm_start_lp and self.star.settings.opt_decompose_lp and \
+                self.no_input_lpis[guard_index] is not None:
+            for lpi in self.no_input_lpis[guard_index]:
+                lpi.set_basis_constraint_values(new_vals)
 
     def make_combined_lpi(self, automaton_transition=None, skip_inputs=False):
         'create one lpi per guard, which will have both the star and input effects, as well as the guard condition'
 
         lpi = LpInstance(self.star.num_dims, self.star.num_dims)
+        lpi.set_owner(self.star)
+        lpi.set_role(LpInstance.ROLE_COMBINED)
         lpi.update_basis_matrix(self.star.basis_matrix)
-
-        for lc in self.star.constraint_list:
-            lpi.add_basis_constraint(lc.vector, lc.value)
+        lpi.add_basis_constraints(self.star.a_matrix, self.star.b_vector)
 
         # add standard basis guard constraints
         if automaton_transition is not None:
@@ -143,122 +253,177 @@ class GuardOptData(Freezable):
 
         # add any input star constraints
         mode = self.star.mode
+        input_stars = self.input_window if self.input_window is not None else self.star.input_stars
 
-        if not skip_inputs and self.star.input_stars is not None:
-            for input_star in self.star.input_stars:
+        if not skip_inputs and input_stars is not None:
+            for input_star in input_stars:
                 lpi.add_input_star(mode.u_constraints_a_t, mode.u_constraints_b, input_star.input_basis_matrix)
 
         return lpi
 
     def make_no_input_lpi(self, basis_matrix=None):
-        '''make the lpi object for the input-free star, using the current star's basis matrix'''
+        '''make the (reduced) lpi object for the input-free star, using the current star's basis matrix'''
 
         if basis_matrix is None:
             basis_matrix = np.zeros((self.star.num_dims, self.star.num_dims))
 
-        rv = LpInstance(self.star.num_dims, self.star.num_dims)
+        rv = LpInstance(self.star.num_dims, self.star.num_dims, reduced=True)
+        rv.set_owner(self.star)
+        rv.set_role(LpInstance.ROLE_GUARD_NO_INPUT)
         rv.update_basis_matrix(basis_matrix)
-
-        for lc in self.star.constraint_list:
-            rv.add_basis_constraint(lc.vector, lc.value)
+        rv.add_basis_constraints(self.star.a_matrix, self.star.b_vector)
 
         return rv
 
-    def make_input_lpi(self, basis_matrix=None):
-        'make the lpi object for the input star'
+    def update_from_sim(self, input_star, merge=False):
+        '''
+        update the basis matrix based on the star's current basis matrix
 
-        rv = None
+        if merge is True, input_star replaces the last input star (its steps are in the same input hold interval)
+        '''
+
+        self.total_steps += 1
 
-        if self.star.mode.num_inputs > 0:
-            rv = LpInstance(self.star.num_dims, self.star.mode.num_inputs)
+        if self.star.mode.b_matrix is not None:
+            if not merge:
+                self.num_input_stars += 1
 
-            if basis_matrix is None:
-                basis_matrix = np.zeros((self.star.mode.num_inputs, self.star.num_dims))
+            if self.input_window is not None:
+                if merge:
+                    self.input_window[-1] = input_star
+                else:
+                    self.input_window.append(input_star)
 
-            rv.update_basis_matrix(basis_matrix)
+            self._for_each_guard(self._update_guard_from_sim, input_star, merge)
 
-            for i in xrange(self.star.mode.u_constraints_b.shape[0]):
-                rv.add_basis_constraint(self.star.mode.u_constraints_a[i, :], self.star.mode.u_constraints_b[i])
+            if self.input_window is not None and len(self.input_window) >= 2 * self.star.settings.input_window_steps:
+                self._fold_inputs()
 
-        return rv
+    def _fold_inputs(self):
+        '''
+        fold the oldest input effects out of the input window, so that input_window_steps steps remain, and
+        rebuild the combined lps with the remaining window
+        '''
 
-    def update_from_sim(self, input_star):
-        '''update the basis matrix based on the star's current basis matrix'''
+        num_folded = len(self.input_window) - self.star.settings.input_window_steps
 
-        self.total_steps += 1
-        mode = self.star.mode
+        self.input_window = self.input_window[num_folded:]
+        self.num_folded_steps += num_folded * self.star.mode.input_hold_steps # the folded hold intervals are full
+        self._for_each_guard(self._fold_guard_inputs, num_folded)
 
-        if mode.b_matrix is not None:
-            # update combined_lpis
-            if self.star.settings.opt_warm_start_lp:
-                for guard_index in xrange(len(mode.transitions)):
-                    combined_lpi = self.combined_lpis[guard_index]
-                    combined_lpi.add_input_star(mode.u_constraints_a_t, mode.u_constraints_b,
-                                                input_star.input_basis_matrix)
+    def _fold_guard_inputs(self, guard_index, num_folded):
+        'fold the oldest num_folded input steps for a single transition'
 
-            # update no-input and input lpis
-            if self.star.settings.opt_decompose_lp:
-                for guard_index in xrange(len(mode.transitions)):
-                    guard = mode.transitions[guard_index]
-                    constraint_min_list = self.guard_constraint_min_list[guard_index]
+        step_mins = self.window_mins[guard_index]
+        self.folded_mins[guard_index] += np.sum(step_mins[:num_folded], axis=0)
+        self.window_mins[guard_index] = step_mins[num_folded:]
 
-                    # for each constraint, optimize in its direction and add to constraint_min_list
-                    result = np.zeros(self.star.num_dims)
+        if self.star.settings.opt_warm_start_lp and self.combined_lpis[guard_index] is not None:
+            self.combined_lpis[guard_index] = self.make_combined_lpi(self.star.mode.transitions[guard_index])
 
-                    for condition_index in xrange(len(guard.condition_list)):
-                        lc = guard.condition_list[condition_index]
+            # warm-start the rebuilt lp like a new one (see _lp_guard_intersection())
+            self.solved_full_lp[guard_index] = False
 
-                        # we are going to upscale the star conditions, which gives a more accurate LP result
-                        # when the constraints are small (for example, for small time steps)
-                        # we probably want to make this a setting or auto-detect when it's needed
-                        scale = 1024.0 #65536.0 # powers of two should be marginally faster to multiply
+    def _update_guard_from_sim(self, guard_index, input_star, merge):
+        'update the lps for a single transition with the new input star'
 
-                        input_basis_matrix = scale * input_star.input_basis_matrix
+        mode = self.star.mode
+        self._init_guard_lps(guard_index)
 
-                        if not self.star.settings.opt_warm_start_lp:
-                            input_lpi = self.make_input_lpi(input_basis_matrix)
-                        else:
-                            input_lpi = self.input_lpis[guard_index][condition_index]
-                            input_lpi.update_basis_matrix(input_basis_matrix)
+        # update combined_lpis
+        if self.star.settings.opt_warm_start_lp:
+            combined_lpi = self.combined_lpis[guard_index]
 
-                        input_lpi.minimize(lc.vector, result, error_if_infeasible=True)
+            if merge:
+                combined_lpi.update_last_input_star(input_star.input_basis_matrix)
+            else:
+                combined_lpi.add_input_star(mode.u_constraints_a_t, mode.u_constraints_b,
+                                            input_star.input_basis_matrix)
 
-                        value = np.dot(result, lc.vector)
+        # update the input terms of the decomposed guard check
+        if self.star.settings.opt_decompose_lp:
+            self._add_guard_input_mins(guard_index, merge)
 
-                        constraint_min_list[condition_index] += value / scale
+    def _add_guard_input_mins(self, guard_index, merge):
+        '''
+        add the minimums of the last input star in each guard condition's direction (from the star's InputSupport)
+        to the input terms of the decomposed guard check for a single transition. If merge is True, the last input
+        star replaced the previous one, so only the change in its minimums is added.
+        '''
 
-                        if condition_index == 0 and value != 0:
-                            # if we haven't solved the full LP yet, reuse the first star's solution in combined_lpi
-                            if self.star.settings.opt_warm_start_lp and not self.solved_full_lp:
-                                numi = mode.num_inputs
-                                numcons = mode.u_constraints_a.shape[0]
-                                dims = self.star.num_dims
+        mode = self.star.mode
+        support = self.star.get_input_support()
+        offset = support.guard_offsets[guard_index]
+        constraint_min_list = self.guard_constraint_min_list[guard_index]
+        step_mins = support.mins[offset:offset + len(constraint_min_list)]
+        step_deltas = support.deltas[offset:offset + len(constraint_min_list)]
+
+        for condition_index in xrange(len(constraint_min_list)):
+            constraint_min_list[condition_index] += step_deltas[condition_index]
+
+        # if we haven't solved the full LP yet, initialize the new input's statuses in combined_lpi to the
+        # solution for the first condition
+        if self.star.settings.opt_warm_start_lp and not self.solved_full_lp[guard_index] and step_mins[0] != 0:
+            numi = mode.num_inputs
+            numcons = mode.u_constraints_a.shape[0]
+
+            if support.u_opt is not None:
+                # box inputs: the inputs are basic, as are the input constraints which are not tight
+                values = np.dot(mode.u_constraints_a, support.u_opt[offset])
+                tight = values >= mode.u_constraints_b - 1e-9 * np.maximum(1.0, np.abs(mode.u_constraints_b))
+
+                rows = np.where(tight, LpInstance._GLP_NU, LpInstance._GLP_BS).astype(np.int8)
+                cols = np.array([LpInstance._GLP_BS] * numi, dtype=np.int8)
+            else:
+                rows = support.row_statuses[offset][-numcons:]
+                cols = support.col_statuses[offset][-numi:]
+
+                total_basic = sum([1 if stat == 1 else 0 for stat in itertools.chain(rows, cols)])
+
+                if total_basic != numcons:
+                    # in certain cases at certain times, the input value doesn't affect
+                    # the variables we're optimizing (the input effect is orthogonal)
+                    # in that case, the LP has multiple possible solutions, and can choose to make
+                    # both input constraints basic variables... we shouldn't try to reuse the solution
+                    # in these cases, as it's invalid in the larger problem
+
+                    # I added a filter for these cases above (if step_mins[0] != 0), so this shouldn't
+                    # happen anymore. Print a warning for now.
+                    print "Warning: Num basic vars in star LP != number of constraints in starutil.py"
+                    rows = None
+
+            if rows is not None:
+                self.combined_lpis[guard_index].set_last_input_statuses(rows, cols)
+
+        if self.window_mins is not None:
+            if merge:
+                self.window_mins[guard_index][-1] = step_mins
+            else:
+                self.window_mins[guard_index].append(step_mins)
 
-                                cols = np.array([0] * (dims + numi), dtype=np.dtype('int8'))
-                                rows = np.array([0] * (dims + numcons), dtype=np.dtype('int8'))
+    def get_guard_intersection(self, guard_index, is_error_intersection):
+        '''Does the star intersect the guard with the given index?
+        if is_error_intersection is True, this will possibly export a counter-example error trace file.
 
-                                input_lpi.get_row_statuses(rows)
-                                input_lpi.get_col_statuses(cols)
+        returns the optimal lp solution if feasible or None if no intersection
+        '''
 
-                                total_basic = sum([1 if stat == 1 else 0 for stat in
-                                                   itertools.chain(rows[-numcons:], cols[-numi:])])
+        if self.pool is None:
+            rv = self._get_guard_intersection(guard_index, is_error_intersection)
+        else:
+            rv = self.pool.map([(guard_index, self._get_guard_intersection, (guard_index, is_error_intersection))])[0]
 
-                                if total_basic != numcons:
-                                    # in certain cases at certain times, the input value doesn't affect
-                                    # the variables we're optimizing (the input effect is orthogonal)
-                                    # in that case, the LP has multiple possible solutions, and can choose to make
-                                    # both input constraints basic variables... we shouldn't try to reuse the solution
-                                    # in these cases, as it's invalid in the larger problem
+        return rv
 
-                                    # I added a filter for these cases above (if value != 0), so this shouldn't
-                                    # happen anymore. Print a warning for now.
-                                    print "Warning: Num basic vars in star LP != number of constraints in starutil.py"
-                                else:
-                                    # initialize the solution for the new rows / cols
-                                    combined_lpi = self.combined_lpis[guard_index]
-                                    combined_lpi.set_last_input_statuses(rows[-numcons:], cols[-numi:])
+    def get_guard_intersections(self, is_error_intersection_list):
+        '''check the star's intersection with every guard (in parallel if guard threads are enabled)
 
-    def get_guard_intersection(self, guard_index, is_error_intersection):
+        returns a list with the optimal lp solution or None for each transition
+        '''
+
+        return self._for_each_guard(lambda i: self._get_guard_intersection(i, is_error_intersection_list[i]))
+
+    def _get_guard_intersection(self, guard_index, is_error_intersection):
         '''Does the star intersect the guard with the given index?
         This one first tries an optimized approach which is a sufficient condition... and only calls
         the more-expensive exact check if that one succeeds.
@@ -276,18 +441,22 @@ class GuardOptData(Freezable):
 
         if self.star.settings.opt_decompose_lp:
             no_input_basis_matrix = self.star.basis_matrix
+            box = self.star.box_bounds()
 
             for condition_index in xrange(len(condition_list)):
-                if not self.star.settings.opt_warm_start_lp:
-                    no_input_lpi = self.make_no_input_lpi(basis_matrix=no_input_basis_matrix)
-                else:
-                    no_input_lpi = self.no_input_lpis[guard_index][condition_index]
-                    no_input_lpi.update_basis_matrix(no_input_basis_matrix)
-
                 lc = condition_list[condition_index]
 
                 # add no_input term
-                no_input_lpi.minimize(lc.vector, result)
+                if box is not None:
+                    minimize_box(no_input_basis_matrix, box, lc.vector, result)
+                else:
+                    if not self.star.settings.opt_warm_start_lp:
+                        no_input_lpi = self.make_no_input_lpi(basis_matrix=no_input_basis_matrix)
+                    else:
+                        no_input_lpi = self._get_no_input_lpis(guard_index)[condition_index]
+                        no_input_lpi.update_basis_matrix(no_input_basis_matrix)
+
+                    no_input_lpi.minimize(lc.vector, result)
 
                 accumulated_min = np.dot(result, lc.vector)
 
@@ -312,17 +481,70 @@ class GuardOptData(Freezable):
     def get_guard_intersection_exact(self, guard_index, is_error_intersection):
         '''Does the star intersect the guard with the given index?
 
-        This one uses the combined lpi to do the check (slow).
+        This one uses the combined lpi to do the check (slow), unless the star is a box without inputs and the
+        guard has a single condition, in which case the check is done in closed form.
         if is_error_intersection is True, this will possibly export a counter-example error trace file.
 
         returns the optimal lp solution if feasible or None if no intersection
         '''
 
-        rv = None
+        constraints = self.star.mode.transitions[guard_index].condition_list
+        box = None
+
+        if self.star.mode.num_inputs == 0 and len(constraints) == 1:
+            box = self.star.box_bounds()
+
+        if box is not None:
+            rv = self._box_guard_intersection(box, constraints[0])
+        else:
+            rv = self._lp_guard_intersection(guard_index)
+
+        if rv is not None and is_error_intersection:
+            ce_filename = self.star.settings.counter_example_filename
+
+            if ce_filename is not None and self.num_folded_steps > 0:
+                if self.star.settings.print_output:
+                    print "Found possible specification violation, but the inputs of the first {} steps were " \
+                          "over-approximated (settings.input_window_steps); skipping counter-example".format(
+                              self.num_folded_steps)
+            elif ce_filename is not None:
+                if self.star.settings.print_output:
+                    print "Found specification violation! Writing counter-example to {}".format(ce_filename)
+
+                export_counter_example(ce_filename, self.star.mode, rv, self.star.center, self.star.num_dims, \
+                    self.star.settings.step, self.total_steps, constraints[0])
+            elif self.star.settings.print_output:
+                print "Counter-example file disabled in settings; skipping"
+
+        return rv
+
+    def _box_guard_intersection(self, box, lc):
+        '''
+        check the intersection of a box star (without inputs) with the single guard condition lc
+
+        returns the guard-minimizing point in the star, in the format of the combined lp solution, or None
+        '''
+
+        dims = self.star.num_dims
+        result = np.zeros(2 * dims)
+
+        if not minimize_box(self.star.basis_matrix, box, lc.vector, result) or \
+                np.dot(self.star.center + result[:dims], lc.vector) > lc.value:
+            result = None
+
+        return result
+
+    def _lp_guard_intersection(self, guard_index):
+        '''
+        check the intersection with a guard using the combined lpi
+
+        returns the optimal lp solution if feasible or None if no intersection
+        '''
 
         if not self.star.settings.opt_warm_start_lp:
             combined_lpi = self.make_combined_lpi(self.star.mode.transitions[guard_index])
         else:
+            self._init_guard_lps(guard_index)
             combined_lpi = self.combined_lpis[guard_index]
 
             # update combined_lpi to have the current basis matrix
@@ -338,47 +560,360 @@ class GuardOptData(Freezable):
 
             constraint_vals[i] = lc.value - sim_value
 
+            if self.folded_mins is not None:
+                constraint_vals[i] -= self.folded_mins[guard_index][i]
+
             combined_lpi.set_standard_constraint_values(constraint_vals)
 
         dims = self.star.num_dims
 
-        # possibly update solution in the combined lpi to be the solution in the no input lpi
-        if self.star.settings.opt_warm_start_lp and self.star.settings.opt_decompose_lp and not self.solved_full_lp:
-            self.solved_full_lp = True
+        # possibly update solution in the combined lpi to be the solution in the no input lpi. If the no-input term
+        # was computed in closed form (box stars), the no-input lps don't exist and there's no solution to copy
+        if self.star.settings.opt_warm_start_lp and self.star.settings.opt_decompose_lp and \
+                not self.solved_full_lp[guard_index]:
+            self.solved_full_lp[guard_index] = True
 
-            cols = np.array([0] * (dims * 2), dtype=np.dtype('int8'))
-            rows = np.array([0] * (dims + len(self.star.constraint_list)), dtype=np.dtype('int8'))
-            self.no_input_lpis[guard_index][0].get_row_statuses(rows)
-            self.no_input_lpis[guard_index][0].get_col_statuses(cols)
-            combined_lpi.set_standard_basis_statuses(rows, cols)
+            if self.no_input_lpis[guard_index] is not None:
+                cols = np.array([0] * (dims * 2), dtype=np.dtype('int8'))
+                rows = np.array([0] * (dims + self.star.num_constraints), dtype=np.dtype('int8'))
+                self.no_input_lpis[guard_index][0].get_row_statuses(rows)
+                self.no_input_lpis[guard_index][0].get_col_statuses(cols)
+                combined_lpi.set_standard_basis_statuses(rows, cols)
 
         # combined_lpi is now up to date. check if it's feasible
         num_inputs = self.star.mode.num_inputs
-        input_dims = self.total_steps * num_inputs
+        num_input_stars = self.num_input_stars if self.input_window is None else len(self.input_window)
+        input_dims = num_input_stars * num_inputs
         result = np.zeros(2 * dims + input_dims)
 
         opt_direction = np.zeros(dims)
 
         if combined_lpi.minimize(opt_direction, result, error_if_infeasible=False):
-            # lp was feasible
+            rv = result # lp was feasible
+        else:
+            rv = None
 
-            rv = result
-            ce_filename = self.star.settings.counter_example_filename
+        return rv
 
-            if is_error_intersection:
-                if ce_filename is not None:
-                    if self.star.settings.print_output:
-                        print "Found specification violation! Writing counter-example to {}".format(ce_filename)
+class InputSupport(Freezable):
+    '''
+    the minimums of the input effects of a single step (an InputStar) in the directions needed by the decomposed guard
+    and invariant checks of a star: each guard condition (with settings.opt_decompose_lp), and each invariant
+    condition and its negation.
+
+    For box inputs these are computed in closed form (see minimize_input_box()), otherwise a single reduced input
+    lp is used, with one batched minimize call per step for all the directions (see LpInstance.minimize_batch()).
+    '''
+
+    def __init__(self, star):
+        self.star = star
+        mode = star.mode
+
+        directions = []
+        self.guard_offsets = [] # index of the first condition of each transition in directions
+
+        for transition in mode.transitions:
+            self.guard_offsets.append(len(directions))
+
+            if star.settings.opt_decompose_lp:
+                directions += [lc.vector for lc in transition.condition_list]
+
+        self.inv_offset = len(directions) # index of the invariant directions, which are followed by their negations
+        directions += [lc.vector for lc in mode.inv_list]
+        directions += [-1 * lc.vector for lc in mode.inv_list]
+
+        self.directions = np.array(directions, dtype=float).reshape((len(directions), star.num_dims))
+
+        self.mins = None # the minimum in each direction, for the last input star
+        self.deltas = None # the change in mins from the last update (mins, unless the input star was merged)
+        self.u_opt = None # with box inputs, the minimizing input for each direction
+        self.row_statuses = None # with the input lp, the lp statuses after minimizing in each direction
+        self.col_statuses = None
+
+        self.lpi = None # the input lp, created on first use
+
+        self.freeze_attrs()
 
-                    export_counter_example(ce_filename, self.star.mode, result, self.star.center, dims, \
-                        self.star.settings.step, self.total_steps, constraints[0])
-                elif self.star.settings.print_output:
-                    print "Counter-example file disabled in settings; skipping"
+    def release_lps(self):
+        'free the input lp (it gets recreated if needed again)'
+
+        self.lpi = None
+
+    def update(self, input_star, merge=False):
+        '''
+        compute the minimums for a new input star
+
+        if merge is True, input_star replaces the last input star (its steps are in the same input hold interval)
+        '''
+
+        star = self.star
+        mode = star.mode
+        prev_mins = self.mins
+
+        if self.directions.shape[0] == 0:
+            self.mins = np.zeros((0,))
+        elif mode.u_box is not None and star.settings.opt_box_support:
+            self.mins, self.u_opt = minimize_input_box(input_star.input_basis_matrix, mode.u_box, self.directions)
         else:
-            rv = None
+            # we are going to upscale the input effects, which gives a more accurate LP result
+            # when they are small (for example, for small time steps)
+            # we probably want to make this a setting or auto-detect when it's needed
+            scale = 1024.0 #65536.0 # powers of two should be marginally faster to multiply
+
+            input_basis_matrix = scale * input_star.input_basis_matrix
+
+            if self.lpi is None or not star.settings.opt_warm_start_lp:
+                self.lpi = LpInstance(star.num_dims, mode.num_inputs, reduced=True)
+                self.lpi.set_owner(star)
+                self.lpi.set_role(LpInstance.ROLE_GUARD_INPUT)
+                self.lpi.update_basis_matrix(input_basis_matrix)
+                self.lpi.add_basis_constraints(mode.u_constraints_a, mode.u_constraints_b)
+            else:
+                self.lpi.update_basis_matrix(input_basis_matrix)
+
+            num_dirs = self.directions.shape[0]
+            results = np.zeros((num_dirs, star.num_dims))
+            statuses = None
+
+            # the statuses are used to warm-start the combined guard lps (see GuardOptData._add_guard_input_mins())
+            if star.settings.opt_warm_start_lp and star.settings.opt_decompose_lp and len(mode.transitions) > 0:
+                if self.row_statuses is None:
+                    self.row_statuses = np.zeros((num_dirs, star.num_dims + mode.u_constraints_a.shape[0]),
+                                                 dtype=np.int8)
+                    self.col_statuses = np.zeros((num_dirs, star.num_dims + mode.num_inputs), dtype=np.int8)
+
+                statuses = (self.row_statuses, self.col_statuses)
+
+            self.lpi.minimize_batch(self.directions, results, statuses, error_if_infeasible=True)
+
+            self.mins = np.sum(results * self.directions, axis=1) / scale
+
+        self.deltas = self.mins - prev_mins if merge else self.mins
+
+class InvariantOptData(Freezable):
+    '''
+    data for decomposed invariant checks of a star with inputs (see Star.trim_to_invariant())
+
+    The star is the Minkowski sum of the no-input star and the input effects of each step, so its support in each
+    invariant direction is the sum of their supports. The input terms are accumulated once per step (input_mins
+    and input_maxs), and only the no-input star needs to be optimized when the invariant is checked.
+    '''
+
+    def __init__(self, star):
+        self.star = star
+
+        self.input_mins = np.zeros(len(star.mode.inv_list)) # sum of each step's minimum input effect per invariant
+        self.input_maxs = np.zeros(len(star.mode.inv_list)) # sum of each step's maximum input effect per invariant
+
+        self.no_input_lpi = None # created on first use
+
+        self.freeze_attrs()
+
+    def release_lps(self):
+        'free the no-input lp (it gets recreated if needed again)'
+
+        self.no_input_lpi = None
+
+    def update_from_sim(self):
+        'accumulate the input effects of the last input star (from the InputSupport of the star)'
+
+        support = self.star.get_input_support()
+        num_invs = self.input_mins.shape[0]
+        mins = support.deltas[support.inv_offset:]
+
+        self.input_mins += mins[:num_invs]
+        self.input_maxs -= mins[num_invs:]
+
+    def add_basis_constraint(self, lc):
+        'add a constraint, given in the star basis, to the no-input lp'
+
+        if self.no_input_lpi is not None:
+            self.no_input_lpi.add_basis_constraint(lc.vector, lc.value)
+
+    def minimize_no_input(self, direction, result):
+        '''
+        minimize the no-input star (offset from the star center) in the passed-in direction, like
+        Star.minimize(). The box bounds of the star are used if possible, otherwise the no-input lp.
+
+        returns True if the no-input star is feasible
+        '''
+
+        star = self.star
+        box = star.box_bounds()
+
+        if box is not None:
+            rv = minimize_box(star.basis_matrix, box, direction, result)
+        else:
+            if self.no_input_lpi is None:
+                self.no_input_lpi = LpInstance(star.num_dims, star.num_dims, reduced=True)
+                self.no_input_lpi.set_owner(star)
+                self.no_input_lpi.set_role(LpInstance.ROLE_INVARIANT)
+                self.no_input_lpi.add_basis_constraints(star.a_matrix, star.b_vector)
+
+            self.no_input_lpi.update_basis_matrix(star.basis_matrix)
+            rv = self.no_input_lpi.minimize(direction, result)
 
         return rv
 
+class SubsumptionIndex(Freezable):
+    '''
+    an index of the explored stars in each mode, used to drop waiting list states which are contained in an
+    explored star (see HylaaSettings.subsumption)
+
+    The continuous dynamics are time-invariant, so a star explored from step t covers the reachable states of any
+    star it contains which is in the same mode at step t' >= t. Stars which were fast-forwarded (deaggregation)
+    are not indexed or dropped. Candidates are prefiltered by bounding box, and containment is checked by
+    maximizing the new star in the direction of each constraint of the explored star.
+
+    With deaggregation, an error reached from an aggregated star may be found to be spurious after refinement,
+    which only re-explores the aggregated stars. So, if exact_only is True, only stars without aggregation in
+    their history are indexed.
+    '''
+
+    def __init__(self, exact_only=True, tol=1e-9):
+        self.exact_only = exact_only
+        self.tol = tol # relative tolerance for the containment checks
+        self.mode_to_entries = {} # mode name -> list of (total_steps, box_low, box_high, h_matrix, h_vector)
+        self.num_subsumed = 0 # number of stars found to be contained in an explored star
+
+        self.freeze_attrs()
+
+    @staticmethod
+    def _bounding_box(star):
+        'get the (low, high) bounding box of a star in the standard basis'
+
+        dims = star.num_dims
+        low = np.zeros(dims)
+        high = np.zeros(dims)
+        result = np.zeros(dims)
+
+        for d in xrange(dims):
+            direction = np.zeros(dims)
+
+            direction[d] = 1
+            star.minimize(direction, result, role=LpInstance.ROLE_SUBSUMPTION, error_if_infeasible=True)
+            low[d] = star.center[d] + result[d]
+
+            direction[d] = -1
+            star.minimize(direction, result, role=LpInstance.ROLE_SUBSUMPTION, error_if_infeasible=True)
+            high[d] = star.center[d] + result[d]
+
+        return low, high
+
+    @staticmethod
+    def _is_exact(star):
+        'does the star have no aggregation in its history'
+
+        parent = star.parent
+
+        while not isinstance(parent, (InitParent, AggregationParent)):
+            if isinstance(parent, ContinuousPostParent):
+                parent = parent.star.parent
+            else:
+                parent = parent.prestar.parent
+
+        return isinstance(parent, InitParent)
+
+    def add(self, star):
+        '''add a star whose continuous post was explored (the star as it was when popped from the waiting list)'''
+
+        if star.fast_forward_steps == 0 and (not self.exact_only or self._is_exact(star)) and star.is_feasible():
+            Timers.tic('subsumption add')
+
+            # convert the predicate to the standard basis: x = center + basis_matrix.T * alpha, a_matrix * alpha <= b
+            try:
+                h_matrix = np.linalg.solve(star.basis_matrix, star.a_matrix.T).T
+            except np.linalg.LinAlgError:
+                h_matrix = None
+
+            if h_matrix is not None:
+                h_vector = star.b_vector + np.dot(h_matrix, star.center)
+                low, high = self._bounding_box(star)
+
+                entries = self.mode_to_entries.setdefault(star.mode.name, [])
+                entries.append((star.total_steps, low, high, h_matrix, h_vector))
+
+            Timers.toc('subsumption add')
+
+    def is_subsumed(self, star):
+        'is the star (which should be feasible) contained in an explored star in the same mode at an earlier step'
+
+        rv = False
+        entries = self.mode_to_entries.get(star.mode.name)
+
+        if entries and star.fast_forward_steps == 0:
+            candidates = [e for e in entries if e[0] <= star.total_steps]
+
+            if candidates:
+                Timers.tic('subsumption check')
+                low, high = self._bounding_box(star)
+                result = np.zeros(star.num_dims)
+
+                for _, c_low, c_high, h_matrix, h_vector in candidates:
+                    if np.any(low < c_low - self.tol * np.maximum(1.0, np.abs(c_low))) or \
+                            np.any(high > c_high + self.tol * np.maximum(1.0, np.abs(c_high))):
+                        continue
+
+                    rv = True
+
+                    for row, value in zip(h_matrix, h_vector):
+                        star.minimize(-row, result, role=LpInstance.ROLE_SUBSUMPTION, error_if_infeasible=True)
+
+                        if np.dot(star.center + result, row) > value + self.tol * max(1.0, abs(value)):
+                            rv = False
+                            break
+
+                    if rv:
+                        self.num_subsumed += 1
+                        break
+
+                Timers.toc('subsumption check')
+
+        return rv
+
+def minimize_box(basis_matrix, box, direction, result):
+    '''
+    minimize in a direction (in the standard basis) over a star whose predicate is a box in the basis space.
+    The box is the pair (low, high) of bound arrays, as returned by Star.box_bounds().
+
+    Like LpInstance.minimize() on the star's lp, result gets the optimal offset from the star's center in its
+    first num_dims entries, followed by the optimal basis point (if result has room for it).
+
+    returns True if the box is nonempty
+    '''
+
+    low, high = box
+    dims = low.shape[0]
+    rv = not np.any(low > high)
+
+    if rv:
+        # minimizing a linear function over a box: each basis variable goes to the bound opposite its coefficient
+        alpha = np.where(np.dot(basis_matrix, direction) > 0, low, high)
+
+        result[:dims] = np.dot(alpha, basis_matrix)
+
+        if result.shape[0] >= 2 * dims:
+            result[dims:2 * dims] = alpha
+
+    return rv
+
+def minimize_input_box(input_basis_matrix, u_box, directions):
+    '''
+    minimize in each of the passed-in directions (the rows of the directions matrix, in the standard basis) over
+    the effect of box-bounded inputs at one step: {u * input_basis_matrix | low <= u <= high}. The box is the pair
+    (low, high) of bound arrays, as in LinearAutomatonMode.u_box.
+
+    returns a tuple (mins, u_opt), with the minimum for each direction and the minimizing input (one row each)
+    '''
+
+    low, high = u_box
+
+    # each input goes to the bound opposite its coefficient
+    coefficients = np.dot(directions, input_basis_matrix.T)
+    u_opt = np.where(coefficients > 0, low, high)
+
+    return np.sum(coefficients * u_opt, axis=1), u_opt
+
 def array_str(nums):
     'get a python-parsable spring reprentation for this list'
 
@@ -426,16 +961,20 @@ def make_aggregated_star(star_list, hylaa_settings):
 
     # create the aggregation parent
 
+    directions = []
+
     if hylaa_settings.add_guard_during_aggregation:
         for lc in first_star_parent.transition.condition_list:
-            hull_star.add_std_constraint_direction(lc.vector)
-            hull_star.add_std_constraint_direction(-1 * lc.vector)
+            directions.append(lc.vector)
+            directions.append(-1 * lc.vector)
 
     if hylaa_settings.add_box_during_aggregation:
         for dim in xrange(hull_star.num_dims):
             vector = np.array([1.0 if d == dim else 0.0 for d in xrange(hull_star.num_dims)], dtype=float)
-            hull_star.add_std_constraint_direction(vector)
-            hull_star.add_std_constraint_direction(-1 * vector)
+            directions.append(vector)
+            directions.append(-1 * vector)
+
+    hull_star.add_std_constraint_directions(directions)
 
     for star_index in xrange(1, len(star_list)):
         star = star_list[star_index]
@@ -489,11 +1028,16 @@ def export_counter_example(filename, mode, result, center, dims, step_size, tota
             inputs = list(result[2*dims:])
             inputs.reverse()
 
-            for step in xrange(total_steps):
-                offset = step * mode.num_inputs
+            # each input star is held for mode.input_hold_steps steps, except the oldest one, which may be shorter
+            hold_steps = mode.input_hold_steps
+            num_input_stars = len(inputs) // mode.num_inputs
+
+            for index in xrange(num_input_stars):
+                offset = index * mode.num_inputs
                 cur_inputs = inputs[offset:offset+mode.num_inputs]
+                count = hold_steps if index > 0 else total_steps - (num_input_stars - 1) * hold_steps
 
-                ordered_inputs.append([num for num in reversed(cur_inputs)])
+                ordered_inputs += [[num for num in reversed(cur_inputs)]] * count
 
             f.write("    inputs = []\n")
 
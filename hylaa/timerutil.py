@@ -7,6 +7,7 @@ September 2016
 '''
 
 import time 
+import threading
 from collections import OrderedDict
 
 class TimerData(object):
@@ -46,6 +47,9 @@ class Timers(object):
     # map of timer_name -> TimerData
     timers = OrderedDict([('total', TimerData('total'))])
 
+    # timers are only measured in the main thread (calls from worker threads are ignored)
+    main_thread = threading.current_thread()
+
     def __init__(self):
         raise RuntimeError('Timers is a static class; should not be instantiated')
 
@@ -59,6 +63,9 @@ class Timers(object):
     def tic(name):
         'start a timer'
 
+        if threading.current_thread() is not Timers.main_thread:
+            return
+
         # create timer object if it doesn't exist
         if Timers.timers.get(name) is None:
             Timers.timers[name] = TimerData(name)
@@ -69,8 +76,39 @@ class Timers(object):
     def toc(name):
         'stop a timer'
 
+        if threading.current_thread() is not Timers.main_thread:
+            return
+
         Timers.timers[name].toc()
 
+    @staticmethod
+    def get_totals():
+        'get a list of (name, num_calls, total_secs) for all timers, including the elapsed time of running timers'
+
+        now = time.time()
+        rv = []
+
+        for timer in Timers.timers.values():
+            secs = timer.total_secs
+
+            if timer.last_start_time is not None:
+                secs += now - timer.last_start_time
+
+            rv.append((timer.name, timer.num_calls, secs))
+
+        return rv
+
+    @staticmethod
+    def add_totals(totals):
+        'add the timer totals from get_totals(), for example from a checkpoint of an earlier run'
+
+        for name, num_calls, secs in totals:
+            if Timers.timers.get(name) is None:
+                Timers.timers[name] = TimerData(name)
+
+            Timers.timers[name].num_calls += num_calls
+            Timers.timers[name].total_secs += secs
+
     @staticmethod
     def print_stats():
         'print statistics about performance timers to stdout'
@@ -5,6 +5,9 @@ Methods / Classes in this one shouldn't require non-standard imports.
 '''
 
 import os
+import sys
+import threading
+import Queue
 
 class Freezable(object):
     'a class where you can freeze the fields (prevent new fields from being created)'
@@ -24,3 +27,69 @@ class Freezable(object):
 def get_script_path(filename):
     '''get the path this script, pass in __file__ for the filename'''
     return os.path.dirname(os.path.realpath(filename))
+
+class PinnedThreadPool(object):
+    '''
+    A pool of worker threads, where each task is run on a specific thread (given by its index). This is useful
+    for libraries (like glpk) where an object should only be used by the thread that created it.
+
+    thread_init, if given, is called at the start of each worker thread with a function submit(func, *args),
+    which queues func(*args) to run later on that thread.
+    '''
+
+    def __init__(self, num_threads, thread_init=None):
+        assert num_threads > 0
+
+        self.num_threads = num_threads
+        self.queues = [Queue.Queue() for _ in xrange(num_threads)]
+
+        for queue in self.queues:
+            thread = threading.Thread(target=PinnedThreadPool._worker, args=(queue, thread_init))
+            thread.daemon = True
+            thread.start()
+
+    @staticmethod
+    def _worker(queue, thread_init):
+        'the worker thread loop'
+
+        if thread_init is not None:
+            thread_init(lambda func, *args: queue.put((func, args, None, None)))
+
+        while True:
+            func, args, index, results = queue.get()
+
+            try:
+                rv = (index, func(*args), None)
+            except Exception: # pylint: disable=broad-except
+                rv = (index, None, sys.exc_info())
+
+            if results is not None:
+                results.put(rv)
+
+    def map(self, tasks):
+        '''
+        run a list of tasks, each of which is (thread_index, func, args), and wait for them to finish.
+
+        returns the list of results (in the same order as tasks). If a task raised an exception, it's re-raised here.
+        '''
+
+        results = Queue.Queue()
+
+        for index in xrange(len(tasks)):
+            thread_index, func, args = tasks[index]
+            self.queues[thread_index % self.num_threads].put((func, args, index, results))
+
+        rv = [None] * len(tasks)
+        exc_info = None
+
+        for _ in xrange(len(tasks)):
+            index, result, task_exc_info = results.get()
+            rv[index] = result
+
+            if task_exc_info is not None and exc_info is None:
+                exc_info = task_exc_info
+
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+        return rv
@@ -6,12 +6,77 @@ September 2016
 
 import unittest
 import math
+import os
+import shutil
+import tempfile
 import numpy as np
+from numpy.testing import assert_allclose
 
-from hylaa.hybrid_automaton import HyperRectangle, LinearHybridAutomaton
-from hylaa.engine import HylaaEngine, HylaaSettings
+from hylaa.hybrid_automaton import HyperRectangle, LinearHybridAutomaton, LinearConstraint
+from hylaa.engine import HylaaEngine, HylaaSettings, WaitingList
+from hylaa.star import init_hr_to_star
+from hylaa import serialize
 from hylaa.plotutil import PlotSettings
 from hylaa.timerutil import Timers
+from hylaa.containers import HylaaResult, LpSettings
+from hylaa.glpk_interface import LpInstance
+
+def make_cycle_ha():
+    'make a cyclic automaton, where x moves back and forth between 0 and 1, with an error mode'
+
+    ha = LinearHybridAutomaton('Cycle')
+    ha.variables = ["x", "y"]
+
+    up = ha.new_mode('up')
+    up.set_dynamics(np.array([[0, 0], [0, 0]], dtype=float), np.array([1, 0], dtype=float))
+    up.inv_list.append(LinearConstraint([1, 0], 1.2))
+
+    down = ha.new_mode('down')
+    down.set_dynamics(np.array([[0, 0], [0, 0]], dtype=float), np.array([-1, 0], dtype=float))
+    down.inv_list.append(LinearConstraint([-1, 0], 0.2))
+
+    error = ha.new_mode('error')
+    error.set_dynamics(np.array([[0, 0], [0, 0]], dtype=float))
+    error.is_error = True
+
+    t = ha.new_transition(up, down)
+    t.condition_list.append(LinearConstraint([-1, 0], -1)) # x >= 1
+
+    t = ha.new_transition(down, up)
+    t.condition_list.append(LinearConstraint([1, 0], 0)) # x <= 0
+
+    # x <= -0.1 and y >= 0.9
+    t = ha.new_transition(down, error)
+    t.condition_list.append(LinearConstraint([1, 0], -0.1))
+    t.condition_list.append(LinearConstraint([0, -1], -0.9))
+
+    return ha
+
+def make_input_ha():
+    'make a two-mode automaton with inputs, where the guards of the first mode depend on the inputs'
+
+    ha = LinearHybridAutomaton('Inputs')
+    ha.variables = ["x", "y"]
+
+    # x' = u, y' = 1, u in [-1, 1]
+    loc1 = ha.new_mode('loc1')
+    loc1.set_dynamics(np.array([[0, 0], [0, 0]], dtype=float), np.array([0, 1], dtype=float))
+    loc1.set_inputs(np.array([[1], [-1]], dtype=float), np.array([1, 1], dtype=float),
+                    np.array([[1], [0]], dtype=float))
+
+    loc2 = ha.new_mode('loc2')
+    loc2.set_dynamics(np.array([[0, 0], [0, 0]], dtype=float))
+
+    # x >= 0.55
+    t1 = ha.new_transition(loc1, loc2)
+    t1.condition_list.append(LinearConstraint([-1, 0], -0.55))
+
+    # x >= 0.35 and y <= 0.5
+    t2 = ha.new_transition(loc1, loc2)
+    t2.condition_list.append(LinearConstraint([-1, 0], -0.35))
+    t2.condition_list.append(LinearConstraint([0, 1], 0.5))
+
+    return ha
 
 class TestEngine(unittest.TestCase):
     'Unit tests for hylaa engine'
@@ -128,5 +193,707 @@ class TestEngine(unittest.TestCase):
 
             self.assertTrue(star.contains_point([2 * math.exp(t) - 1]))
 
+    def test_guard_check_threads(self):
+        '''test that guard checks using worker threads match the sequential guard checks'''
+
+        ha = LinearHybridAutomaton('Two Guards')
+        ha.variables = ["x", "y"]
+
+        # x' = 1, y' = 0
+        loc1 = ha.new_mode('loc1')
+        loc1.a_matrix = np.array([[0, 0], [0, 0]])
+        loc1.c_vector = np.array([1, 0])
+
+        loc2 = ha.new_mode('loc2')
+        loc2.a_matrix = np.array([[0, 0], [0, 0]])
+        loc2.c_vector = np.array([0, 0])
+
+        # x >= 0.5
+        t1 = ha.new_transition(loc1, loc2)
+        t1.condition_list.append(LinearConstraint([-1, 0], -0.5))
+
+        # x >= 0.8 and y <= 0.1
+        t2 = ha.new_transition(loc1, loc2)
+        t2.condition_list.append(LinearConstraint([-1, 0], -0.8))
+        t2.condition_list.append(LinearConstraint([0, 1], 0.1))
+
+        # y >= 5 (never enabled)
+        t3 = ha.new_transition(loc1, loc2)
+        t3.condition_list.append(LinearConstraint([0, -1], -5))
+
+        init_list = [(ha.modes['loc1'], HyperRectangle([(-0.01, 0.01), (-0.01, 0.01)]))]
+
+        feasible_lists = []
+
+        for threads in [None, 2]:
+            plot_settings = PlotSettings()
+            plot_settings.plot_mode = PlotSettings.PLOT_NONE
+            settings = HylaaSettings(step=0.1, max_time=1.1, plot_settings=plot_settings)
+            settings.print_output = False
+            settings.guard_check_threads = threads
+
+            engine = HylaaEngine(ha, settings)
+            engine.load_waiting_list(init_list)
+
+            # pop from waiting_list (doesn't advance state)
+            engine.do_step()
+            feasible_list = []
+
+            for _ in xrange(10):
+                engine.do_step()
+                star = engine.cur_state
+
+                if star.mode is not loc1:
+                    break
+
+                solutions = star.get_guard_intersections()
+                self.assertEqual(len(solutions), 3)
+
+                for i in xrange(3):
+                    self.assertEqual(solutions[i] is None, star.get_guard_intersection(i) is None)
+
+                feasible_list.append([sol is not None for sol in solutions])
+
+            feasible_lists.append(feasible_list)
+
+        self.assertEqual(feasible_lists[0], feasible_lists[1])
+        self.assertTrue(any([feasible[0] and not feasible[1] for feasible in feasible_lists[0]]))
+        self.assertTrue(any([feasible[1] for feasible in feasible_lists[0]]))
+        self.assertFalse(any([feasible[2] for feasible in feasible_lists[0]]))
+
+    def test_slow_lp_guard_threads(self):
+        '''test that slow lps solved in the guard check worker threads are exported with their call site'''
+
+        ha = make_cycle_ha()
+        up = ha.modes['up']
+        dirname = tempfile.mkdtemp()
+
+        try:
+            plot_settings = PlotSettings()
+            plot_settings.plot_mode = PlotSettings.PLOT_NONE
+            settings = HylaaSettings(step=0.1, max_time=1.0, plot_settings=plot_settings)
+            settings.print_output = False
+            settings.guard_check_threads = 2
+            settings.lp.slow_lp_iterations = -1 # export every lp
+            settings.lp.slow_lp_dir = dirname
+
+            engine = HylaaEngine(ha, settings)
+            engine.run([(up, HyperRectangle([(0, 0.2), (0, 0.5)]))])
+
+            call_sites = set()
+
+            for filename in os.listdir(dirname):
+                if filename.endswith('.txt'):
+                    with open(os.path.join(dirname, filename)) as f:
+                        lines = [line for line in f.readlines() if line.startswith('Call site: ')]
+
+                    self.assertEqual(len(lines), 1)
+                    call_sites.add(lines[0][len('Call site: '):].strip())
+
+            self.assertFalse('unknown' in call_sites)
+            self.assertTrue(call_sites & set([LpInstance.ROLE_COMBINED, LpInstance.ROLE_GUARD_NO_INPUT]))
+        finally:
+            LpInstance.settings = LpSettings()
+            shutil.rmtree(dirname)
+
+    def test_input_window(self):
+        '''test that folding old input effects in the guard lps over-approximates the exact guard checks'''
+
+        ha = make_input_ha()
+        init_list = [(ha.modes['loc1'], HyperRectangle([(-0.01, 0.01), (-0.01, 0.01)]))]
+
+        feasible_lists = []
+
+        for window_steps in [None, 2]:
+            plot_settings = PlotSettings()
+            plot_settings.plot_mode = PlotSettings.PLOT_NONE
+            settings = HylaaSettings(step=0.1, max_time=1.0, plot_settings=plot_settings)
+            settings.print_output = False
+            settings.input_window_steps = window_steps
+
+            engine = HylaaEngine(ha, settings)
+            engine.load_waiting_list(init_list)
+
+            # pop from waiting_list (doesn't advance state)
+            engine.do_step()
+            feasible_list = []
+            star = engine.cur_state
+
+            # advance the star directly, since discrete successors with inputs are not supported
+            for step in xrange(1, 10):
+                basis_matrix, center = engine.cur_sim_bundle.get_vecs_origin_at_step(step, engine.max_steps_remaining)
+                star.update_from_sim(basis_matrix, center)
+
+                # check with the combined lps (no decomposition prefilter)
+                guard_data = star._get_guard_opt_data()
+                feasible_list.append([guard_data.get_guard_intersection_exact(i, False) is not None
+                                      for i in xrange(2)])
+
+            if window_steps is not None:
+                self.assertEqual(guard_data.num_folded_steps + len(guard_data.input_window), 9)
+                self.assertGreater(guard_data.num_folded_steps, 0)
+                self.assertLess(len(guard_data.input_window), 2 * window_steps)
+
+            feasible_lists.append(feasible_list)
+
+        exact, folded = feasible_lists
+
+        self.assertTrue(any([f[0] for f in exact]))
+        self.assertTrue(any([f[1] for f in exact]))
+
+        # single-condition guards are exact, multi-condition guards are over-approximated
+        for exact_feasible, folded_feasible in zip(exact, folded):
+            self.assertEqual(exact_feasible[0], folded_feasible[0])
+            self.assertTrue(folded_feasible[1] or not exact_feasible[1])
+
+    def test_box_inputs(self):
+        '''test that the closed-form input terms for box inputs match the input lps'''
+
+        ha = make_input_ha()
+        loc1 = ha.modes['loc1']
+        assert_allclose(loc1.u_box[0], [-1])
+        assert_allclose(loc1.u_box[1], [1])
+
+        init_list = [(loc1, HyperRectangle([(-0.01, 0.01), (-0.01, 0.01)]))]
+        results = []
+
+        for box_support in [True, False]:
+            plot_settings = PlotSettings()
+            plot_settings.plot_mode = PlotSettings.PLOT_NONE
+            settings = HylaaSettings(step=0.1, max_time=1.0, plot_settings=plot_settings)
+            settings.print_output = False
+            settings.opt_box_support = box_support
+
+            engine = HylaaEngine(ha, settings)
+            engine.load_waiting_list(init_list)
+            engine.do_step()
+            star = engine.cur_state
+            result = []
+
+            for step in xrange(1, 10):
+                basis_matrix, center = engine.cur_sim_bundle.get_vecs_origin_at_step(step, engine.max_steps_remaining)
+                star.update_from_sim(basis_matrix, center)
+
+                guard_data = star._get_guard_opt_data()
+                result.append([list(mins) for mins in guard_data.guard_constraint_min_list] +
+                              [star.get_guard_intersection(i) is not None for i in xrange(2)])
+
+            results.append(result)
+
+        for box_result, lp_result in zip(*results):
+            assert_allclose(box_result[0], lp_result[0])
+            assert_allclose(box_result[1], lp_result[1])
+            self.assertEqual(box_result[2:], lp_result[2:])
+
+        # an extra constraint on the input, or a missing bound, is not a box
+        loc = ha.new_mode('loc3')
+        loc.set_dynamics(np.array([[0, 0], [0, 0]], dtype=float))
+        loc.set_inputs(np.array([[1, 0], [-1, 0], [0, 1], [0, -1], [1, 1]], dtype=float), np.ones(5))
+        self.assertEqual(loc.u_box, None)
+
+        loc.set_inputs(np.array([[1, 0], [-1, 0], [0, 1], [1, 0]], dtype=float), np.ones(4))
+        self.assertEqual(loc.u_box, None)
+
+        loc.set_inputs(np.array([[2, 0], [-1, 0], [0, 1], [0, -1]], dtype=float), np.array([1, 1, 2, 0.5]))
+        assert_allclose(loc.u_box[0], [-1, -0.5])
+        assert_allclose(loc.u_box[1], [0.5, 2])
+
+    def test_box_guard_lps(self):
+        '''test that the no-input guard lps are not created when the no-input term is computed for a box star'''
+
+        ha = make_cycle_ha()
+        down = ha.modes['down']
+        error_index = [t.to_mode.is_error for t in down.transitions].index(True)
+
+        for box_support in [True, False]:
+            plot_settings = PlotSettings()
+            plot_settings.plot_mode = PlotSettings.PLOT_NONE
+            settings = HylaaSettings(step=0.1, max_time=1.0, plot_settings=plot_settings)
+            settings.print_output = False
+            settings.opt_box_support = box_support
+
+            # the error guard has two conditions, so the exact check uses the combined lp
+            for min_x, max_x, intersects in [(-0.3, -0.2, True), (0.0, 0.5, False)]:
+                star = init_hr_to_star(settings, HyperRectangle([(min_x, max_x), (0.95, 1.0)]), down)
+                self.assertEqual(star.get_guard_intersection(error_index) is not None, intersects)
+
+                guard_data = star._get_guard_opt_data()
+
+                if box_support:
+                    self.assertEqual(guard_data.no_input_lpis, [None] * len(down.transitions))
+                else:
+                    self.assertIsNotNone(guard_data.no_input_lpis[error_index])
+
+    def test_input_invariant(self):
+        '''test invariant trimming with inputs, which uses the decomposed invariant checks'''
+
+        ha = LinearHybridAutomaton('Input Invariant')
+        ha.variables = ["x", "y"]
+
+        # x' = 1 + u, y' = 0, u in [-0.4, 0.4], invariant x <= 0.3
+        loc1 = ha.new_mode('loc1')
+        loc1.set_dynamics(np.array([[0, 0], [0, 0]], dtype=float), np.array([1, 0], dtype=float))
+        loc1.set_inputs(np.array([[1], [-1]], dtype=float), np.array([0.4, 0.4], dtype=float),
+                        np.array([[1], [0]], dtype=float))
+        loc1.inv_list.append(LinearConstraint([1, 0], 0.3))
+
+        loc2 = ha.new_mode('loc2')
+        loc2.set_dynamics(np.array([[0, 0], [0, 0]], dtype=float))
+
+        # x >= 0.9
+        t = ha.new_transition(loc1, loc2)
+        t.condition_list.append(LinearConstraint([-1, 0], -0.9))
+
+        init_list = [(loc1, HyperRectangle([(-0.45, 0.45), (-0.01, 0.01)]))]
+
+        for box_support in [True, False]:
+            plot_settings = PlotSettings()
+            plot_settings.plot_mode = PlotSettings.PLOT_NONE
+            settings = HylaaSettings(step=0.1, max_time=2.0, plot_settings=plot_settings)
+            settings.print_output = False
+            settings.opt_box_support = box_support
+
+            engine = HylaaEngine(ha, settings)
+            engine.load_waiting_list(init_list)
+            engine.do_step()
+            star = engine.cur_state
+            result = np.zeros(4 + star.num_dims)
+
+            # advance the star directly, since discrete successors with inputs are not supported
+            for step in xrange(1, 13):
+                basis_matrix, center = engine.cur_sim_bundle.get_vecs_origin_at_step(step, engine.max_steps_remaining)
+                star.update_from_sim(basis_matrix, center)
+
+                still_feasible, _ = star.trim_to_invariant()
+                self.assertTrue(still_feasible)
+
+                # the trimmed predicate assumes the most favorable inputs: x_0 <= 0.3 - 0.1 * step + 0.04 * step
+                star.minimize(np.array([-1, 0], dtype=float), result)
+                self.assertAlmostEqual(result[0] + star.center[0], 0.3 + 0.08 * step)
+
+                star.minimize(np.array([1, 0], dtype=float), result)
+                self.assertAlmostEqual(result[0] + star.center[0], -0.45 + 0.06 * step)
+
+                self.assertEqual(star.get_guard_intersection(0) is not None, step >= 8)
+
+            # at step 13, even the smallest x_0 violates the invariant with the most favorable inputs
+            basis_matrix, center = engine.cur_sim_bundle.get_vecs_origin_at_step(13, engine.max_steps_remaining)
+            star.update_from_sim(basis_matrix, center)
+
+            still_feasible, _ = star.trim_to_invariant()
+            self.assertFalse(still_feasible)
+
+    def test_input_hold(self):
+        '''test inputs which are held constant over several steps (mode.input_hold_steps)'''
+
+        ha = LinearHybridAutomaton('Input Hold')
+        ha.variables = ["x", "y"]
+
+        # harmonic oscillator x' = y, y' = -x + u, u in [-1, 1], with an invariant that never gets trimmed
+        loc1 = ha.new_mode('loc1')
+        loc1.set_dynamics(np.array([[0, 1], [-1, 0]], dtype=float))
+        loc1.set_inputs(np.array([[1], [-1]], dtype=float), np.array([1, 1], dtype=float),
+                        np.array([[0], [1]], dtype=float))
+        loc1.inv_list.append(LinearConstraint([1, 0], 100))
+
+        loc2 = ha.new_mode('loc2')
+        loc2.set_dynamics(np.array([[0, 0], [0, 0]], dtype=float))
+
+        # x >= 100
+        t = ha.new_transition(loc1, loc2)
+        t.condition_list.append(LinearConstraint([-1, 0], -100))
+
+        init_list = [(loc1, HyperRectangle([(-0.1, 0.1), (-0.1, 0.1)]))]
+        num_steps = 10
+        hold_steps = 4
+        direction = np.array([-1, 0], dtype=float) # maximize x
+
+        for box_support in [True, False]:
+            stars = []
+
+            for hold in [1, hold_steps]:
+                loc1.input_hold_steps = hold
+
+                plot_settings = PlotSettings()
+                plot_settings.plot_mode = PlotSettings.PLOT_NONE
+                settings = HylaaSettings(step=0.5, max_time=6.0, plot_settings=plot_settings)
+                settings.print_output = False
+                settings.opt_box_support = box_support
+
+                engine = HylaaEngine(ha, settings)
+                engine.load_waiting_list(init_list)
+                engine.do_step()
+                star = engine.cur_state
+
+                # advance the star directly, since discrete successors with inputs are not supported
+                for step in xrange(1, num_steps + 1):
+                    basis_matrix, center = engine.cur_sim_bundle.get_vecs_origin_at_step(step,
+                                                                                         engine.max_steps_remaining)
+                    star.update_from_sim(basis_matrix, center)
+
+                    still_feasible, _ = star.trim_to_invariant()
+                    self.assertTrue(still_feasible)
+                    self.assertEqual(star.get_guard_intersection(0), None)
+
+                stars.append(star)
+
+            step_star, hold_star = stars
+            self.assertEqual(len(step_star.input_stars), num_steps)
+            self.assertEqual(len(hold_star.input_stars), 3) # steps 4 + 4 + 2
+
+            # the input star of each hold interval is the sum of the input effects of its steps
+            effects = [input_star.input_basis_matrix[0, 0] for input_star in step_star.input_stars]
+            block_effects = [sum(effects[i:i + hold_steps]) for i in xrange(0, num_steps, hold_steps)]
+
+            for input_star, block_effect in zip(hold_star.input_stars, block_effects):
+                self.assertAlmostEqual(input_star.input_basis_matrix[0, 0], block_effect)
+
+            # holding the inputs shrinks the reachable set: |sum of effects| instead of the sum of |effects|
+            result = np.zeros(4 + num_steps)
+            step_star.minimize(direction, result)
+            step_max = result[0] + step_star.center[0]
+
+            hold_star.minimize(direction, result)
+            hold_max = result[0] + hold_star.center[0]
+
+            expected = step_max - sum([abs(e) for e in effects]) + sum([abs(e) for e in block_effects])
+            self.assertLess(hold_max, step_max - 1e-3)
+            self.assertAlmostEqual(hold_max, expected)
+
+            # the decomposed guard check uses the same input terms
+            guard_opt_data = hold_star._get_guard_opt_data() # pylint: disable=protected-access
+            self.assertEqual(guard_opt_data.num_input_stars, 3)
+            self.assertAlmostEqual(guard_opt_data.guard_constraint_min_list[0][0],
+                                   -sum([abs(e) for e in block_effects]))
+
+        # the engine only checks the guards at the steps which end a hold interval
+        loc1.input_hold_steps = hold_steps
+
+        plot_settings = PlotSettings()
+        plot_settings.plot_mode = PlotSettings.PLOT_NONE
+        settings = HylaaSettings(step=0.5, max_time=6.0, plot_settings=plot_settings)
+        settings.print_output = False
+
+        engine = HylaaEngine(ha, settings)
+        check_guards = engine.check_guards
+        checked_steps = []
+
+        def record_check_guards(state):
+            'record the step of each guard check'
+
+            checked_steps.append(engine.cur_step_in_mode)
+            check_guards(state)
+
+        engine.check_guards = record_check_guards
+        engine.load_waiting_list(init_list)
+
+        for _ in xrange(num_steps + 1):
+            engine.do_step()
+
+        self.assertEqual(checked_steps, [4, 8])
+
+        loc1.input_hold_steps = 1
+
+    def test_waiting_list_order(self):
+        '''test the waiting list orders (settings.waiting_list_order)'''
+
+        ha = LinearHybridAutomaton('Waiting List')
+        ha.variables = ["x"]
+
+        # a -> b -> err
+        modes = {}
+
+        for name in ['a', 'b', 'err']:
+            modes[name] = ha.new_mode(name)
+            modes[name].set_dynamics(np.array([[0]], dtype=float))
+
+        modes['err'].is_error = True
+        ha.new_transition(modes['a'], modes['b'])
+        ha.new_transition(modes['b'], modes['err'])
+
+        self.assertEqual(ha.get_error_distances(), {'err': 0, 'b': 1, 'a': 2})
+
+        plot_settings = PlotSettings()
+        plot_settings.plot_mode = PlotSettings.PLOT_NONE
+        settings = HylaaSettings(step=0.1, max_time=1.0, plot_settings=plot_settings)
+
+        def make_stars():
+            'make the (mode name, total steps) stars, in the order they are added'
+
+            rv = []
+
+            for name, steps in [('a', 5), ('b', 2), ('a', 1)]:
+                star = init_hr_to_star(settings, HyperRectangle([(0, 1)]), modes[name])
+                star.total_steps = steps
+                rv.append(star)
+
+            return rv
+
+        expected = [(HylaaSettings.ORDER_FIFO, [0, 1, 2]),
+                    (HylaaSettings.ORDER_EARLIEST, [2, 1, 0]),
+                    (HylaaSettings.ORDER_MODE, [0, 2, 1]),
+                    (HylaaSettings.ORDER_ERROR_FIRST, [1, 0, 2]),
+                    (lambda star: -star.total_steps, [0, 1, 2])]
+
+        for order, indices in expected:
+            stars = make_stars()
+            waiting_list = WaitingList(order, ha)
+
+            for star in stars:
+                waiting_list.add_deaggregated(star)
+
+            self.assertEqual(waiting_list.deaggregated_list, [stars[i] for i in indices])
+            self.assertEqual([waiting_list.pop() for _ in stars], [stars[i] for i in indices])
+            self.assertTrue(waiting_list.is_empty())
+
+        # aggregated states are popped after deaggregated ones, also in order
+        stars = make_stars()
+        waiting_list = WaitingList(HylaaSettings.ORDER_ERROR_FIRST, ha)
+        waiting_list.add_aggregated(stars[0], settings)
+        waiting_list.add_aggregated(stars[1], settings)
+        waiting_list.add_deaggregated(stars[2])
+
+        self.assertEqual([waiting_list.pop() for _ in stars], [stars[2], stars[1], stars[0]])
+        self.assertTrue(waiting_list.is_empty())
+
+    def test_subsumption(self):
+        '''test dropping successors which are contained in explored stars (settings.subsumption)'''
+
+        ha = make_cycle_ha()
+        up = ha.modes['up']
+
+        for max_y, error_reachable in [(0.5, False), (1.0, True)]:
+            init_list = [(up, HyperRectangle([(0, 0.2), (0, max_y)]))]
+            results = []
+
+            for subsumption in [False, True]:
+                plot_settings = PlotSettings()
+                plot_settings.plot_mode = PlotSettings.PLOT_NONE
+                settings = HylaaSettings(step=0.1, max_time=4.0, plot_settings=plot_settings)
+                settings.print_output = False
+                settings.aggregation = False
+                settings.stop_when_error_reachable = False
+                settings.subsumption = subsumption
+
+                engine = HylaaEngine(ha, settings)
+                engine.load_waiting_list(init_list)
+                num_pops = 0
+
+                while not engine.is_finished():
+                    if engine.cur_state is None:
+                        num_pops += 1
+
+                    engine.do_step()
+
+                results.append((engine.reached_error, num_pops))
+
+            (reached_error, num_pops), (subsumed_reached_error, subsumed_num_pops) = results
+            self.assertEqual(reached_error, error_reachable)
+            self.assertEqual(subsumed_reached_error, error_reachable)
+            self.assertGreater(engine.waiting_list.subsumption_index.num_subsumed, 0)
+            self.assertLess(subsumed_num_pops, num_pops)
+
+    def test_parallel(self):
+        '''test computing the continuous posts in worker processes (settings.parallel_processes)'''
+
+        ha = make_cycle_ha()
+        up = ha.modes['up']
+
+        for aggregation in [False, True]:
+            for max_y, error_reachable in [(0.5, False), (1.0, True)]:
+                init_list = [(up, HyperRectangle([(0, 0.2), (0, max_y)]))]
+
+                for parallel_processes in [None, 2]:
+                    plot_settings = PlotSettings()
+                    plot_settings.plot_mode = PlotSettings.PLOT_NONE
+                    settings = HylaaSettings(step=0.1, max_time=3.0, plot_settings=plot_settings)
+                    settings.print_output = False
+                    settings.aggregation = aggregation
+                    settings.parallel_processes = parallel_processes
+
+                    engine = HylaaEngine(ha, settings)
+                    engine.run(init_list)
+
+                    self.assertEqual(engine.reached_error, error_reachable)
+                    self.assertTrue(engine.waiting_list.is_empty() or engine.reached_error)
+
+    def test_serialize(self):
+        '''test pickling stars and their parents, where the automaton and settings are referenced'''
+
+        ha = make_cycle_ha()
+        up = ha.modes['up']
+
+        plot_settings = PlotSettings()
+        plot_settings.plot_mode = PlotSettings.PLOT_NONE
+        settings = HylaaSettings(step=0.1, max_time=3.0, plot_settings=plot_settings)
+        settings.print_output = False
+
+        engine = HylaaEngine(ha, settings)
+        engine.load_waiting_list([(up, HyperRectangle([(0, 0.2), (0, 0.5)]))])
+
+        # pop the initial state, and advance until the first discrete successor is in the waiting list
+        engine.do_step()
+
+        while engine.waiting_list.is_empty():
+            engine.do_step()
+
+        star = engine.waiting_list.pop()
+        copy = serialize.loads(serialize.dumps(star, ha, settings), ha, settings)
+
+        self.assertIs(copy.mode, star.mode)
+        self.assertIs(copy.settings, settings)
+        self.assertIs(copy.parent.transition, star.parent.transition)
+        self.assertIs(copy.parent.prestar.parent.star.mode, up)
+        self.assertEqual(copy.total_steps, star.total_steps)
+        assert_allclose(copy.a_matrix, star.a_matrix)
+        assert_allclose(copy.b_vector, star.b_vector)
+
+        result = np.zeros(2)
+
+        for direction in [np.array([1, 0], dtype=float), np.array([0, -1], dtype=float)]:
+            star.minimize(direction, result)
+            expected = np.dot(result, direction)
+
+            copy.minimize(direction, result)
+            self.assertAlmostEqual(np.dot(result, direction), expected)
+
+    def test_checkpoint(self):
+        '''test saving checkpoints and resuming from them, with the same or a longer time horizon'''
+
+        dirname = tempfile.mkdtemp()
+        filename = os.path.join(dirname, 'checkpoint.dat')
+
+        def make_settings(max_time):
+            'make the settings, with a checkpoint after every step'
+
+            plot_settings = PlotSettings()
+            plot_settings.plot_mode = PlotSettings.PLOT_NONE
+            settings = HylaaSettings(step=0.1, max_time=max_time, plot_settings=plot_settings)
+            settings.print_output = False
+            settings.checkpoint_filename = filename
+            settings.checkpoint_interval_secs = 0
+
+            return settings
+
+        try:
+            for max_y, error_reachable in [(0.5, False), (1.0, True)]:
+                # the error mode is reached after about two time units
+                ha = make_cycle_ha()
+                engine = HylaaEngine(ha, make_settings(1.5))
+                engine.run([(ha.modes['up'], HyperRectangle([(0, 0.2), (0, max_y)]))])
+
+                self.assertFalse(engine.reached_error)
+                self.assertTrue(len(engine.horizon_posts) > 0)
+
+                # resume with the same horizon: nothing is left to compute
+                ha = make_cycle_ha()
+                engine = HylaaEngine(ha, make_settings(1.5))
+                engine.resume(filename)
+
+                self.assertFalse(engine.reached_error)
+                self.assertTrue(engine.is_finished())
+
+                # resume with a longer horizon
+                ha = make_cycle_ha()
+                engine = HylaaEngine(ha, make_settings(4.0))
+                engine.resume(filename)
+
+                self.assertEqual(engine.reached_error, error_reachable)
+
+                # interrupt a run in the middle of a continuous post, and resume it in a new engine
+                ha = make_cycle_ha()
+                engine = HylaaEngine(ha, make_settings(4.0))
+                engine.load_waiting_list([(ha.modes['up'], HyperRectangle([(0, 0.2), (0, max_y)]))])
+                engine.result = HylaaResult()
+
+                while engine.cur_state is None or engine.cur_state.mode.name != 'down':
+                    engine.do_step()
+
+                for _ in xrange(3):
+                    engine.do_step()
+
+                ha = make_cycle_ha()
+                engine = HylaaEngine(ha, make_settings(4.0))
+                engine.load_checkpoint(filename)
+
+                self.assertEqual(len(engine.resumed_posts), 1)
+                post_star, state, step_in_mode = engine.resumed_posts[0]
+                self.assertIs(state.mode, ha.modes['down'])
+                self.assertIs(state.parent.star, post_star)
+                self.assertEqual(step_in_mode, 3)
+
+                engine.result = HylaaResult()
+                engine.run_waiting_list()
+
+                self.assertEqual(engine.reached_error, error_reachable)
+
+            # with inputs, the posts which stopped at the horizon are restarted
+            ha = make_input_ha()
+            engine = HylaaEngine(ha, make_settings(0.3))
+            engine.run([(ha.modes['loc1'], HyperRectangle([(0, 0), (0, 0)]))])
+
+            self.assertEqual(len(engine.horizon_posts), 1)
+            self.assertIsNone(engine.horizon_posts[0][1])
+
+            ha = make_input_ha()
+            engine = HylaaEngine(ha, make_settings(1.0))
+            engine.load_checkpoint(filename)
+
+            self.assertEqual(len(engine.resumed_posts), 1)
+
+            engine.result = HylaaResult()
+            engine.run_waiting_list()
+
+            # the restarted post stops at the new horizon
+            self.assertEqual(len(engine.horizon_posts), 1)
+            self.assertIs(engine.horizon_posts[0][0].mode, ha.modes['loc1'])
+            self.assertEqual(engine.horizon_posts[0][2], 10)
+        finally:
+            shutil.rmtree(dirname)
+
+    def test_parallel_checkpoint(self):
+        '''test that checkpoints of a parallel run save the posts still running in the workers'''
+
+        dirname = tempfile.mkdtemp()
+        filename = os.path.join(dirname, 'checkpoint.dat')
+
+        def make_settings(parallel_processes):
+            'make the settings, with a checkpoint after every processed post'
+
+            plot_settings = PlotSettings()
+            plot_settings.plot_mode = PlotSettings.PLOT_NONE
+            settings = HylaaSettings(step=0.1, max_time=4.0, plot_settings=plot_settings)
+            settings.print_output = False
+            settings.aggregation = False
+            settings.parallel_processes = parallel_processes
+            settings.checkpoint_filename = filename
+            settings.checkpoint_interval_secs = 0
+
+            return settings
+
+        try:
+            ha = make_cycle_ha()
+            init_list = [(ha.modes['up'], HyperRectangle([(0.1 * i, 0.1 * i + 0.1), (0, 1.0)])) for i in xrange(4)]
+
+            engine = HylaaEngine(ha, make_settings(2))
+            engine.run(init_list)
+
+            self.assertTrue(engine.reached_error)
+
+            # the run stopped at the error while another post was running, which is restarted on resume
+            ha = make_cycle_ha()
+            engine = HylaaEngine(ha, make_settings(None))
+            engine.load_checkpoint(filename)
+
+            self.assertTrue(engine.reached_error)
+            self.assertEqual(len(engine.resumed_posts), 1)
+
+            post_star, state, step_in_mode = engine.resumed_posts[0]
+            self.assertIs(post_star.mode, ha.modes['down'])
+            self.assertIsNone(state)
+            self.assertEqual(step_in_mode, 0)
+        finally:
+            shutil.rmtree(dirname)
+
 if __name__ == '__main__':
     unittest.main()
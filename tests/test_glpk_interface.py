@@ -5,11 +5,37 @@ November 2016
 '''
 
 import unittest
+import gc
+import os
+import shutil
+import tempfile
+import threading
 
 import cvxopt
 from hylaa.glpk_interface import LpInstance
+from hylaa.util import PinnedThreadPool
+from hylaa.containers import LpSettings
+from hylaa import lptrace
 import numpy as np
 
+def make_square_lp(basis_matrix=None, reduced=False, role=None):
+    'make an lp whose basis constraints are the square -1 <= x, y <= 1 (with the identity basis matrix by default)'
+
+    if basis_matrix is None:
+        basis_matrix = np.identity(2)
+
+    lp = LpInstance(2, 2, reduced=reduced)
+
+    if role is not None:
+        lp.set_role(role)
+
+    lp.update_basis_matrix(basis_matrix)
+
+    for vec in [[1.0, 0.0], [-1.0, 0.0], [0.0, 1.0], [0.0, -1.0]]:
+        lp.add_basis_constraint(np.array(vec, dtype=float), 1.0)
+
+    return lp
+
 class TestGlpkInterface(unittest.TestCase):
     'Unit tests for optimization utilities'
 
@@ -185,5 +211,251 @@ class TestGlpkInterface(unittest.TestCase):
 
         self.assertLess(res[0], 1.0)
 
+    def test_memo(self):
+        'test that repeated minimize calls on an unmodified lp are memoized'
+
+        lp = make_square_lp()
+
+        direction = np.array([1.0, 1.0], dtype=float)
+        res = np.zeros(2)
+
+        start_op = LpInstance.total_optimizations()
+        lp.minimize(direction, res)
+        lp.minimize(direction, res)
+        self.assertEqual(LpInstance.total_optimizations() - start_op, 1)
+        self.assertAlmostEqual(res[0], -1.0)
+
+        # modifying the lp should invalidate the memoized result
+        lp.add_basis_constraint(np.array([-1.0, 0.0], dtype=float), 0.5)
+        lp.minimize(direction, res)
+        self.assertEqual(LpInstance.total_optimizations() - start_op, 2)
+        self.assertAlmostEqual(res[0], -0.5)
+
+    def test_unchanged_basis_matrix(self):
+        'test that re-uploading an unchanged basis matrix does not modify the lp'
+
+        lp = make_square_lp()
+
+        revision = lp.revision
+        lp.update_basis_matrix(np.identity(2))
+        self.assertEqual(lp.revision, revision)
+
+        lp.update_basis_matrix(np.array([[2.0, 0.0], [0.0, 1.0]], dtype=float))
+        self.assertNotEqual(lp.revision, revision)
+
+        res = np.zeros(4)
+        lp.minimize(np.array([1.0, 0.0], dtype=float), res)
+        self.assertAlmostEqual(res[0], -2.0)
+
+    def test_reduced(self):
+        'test that a reduced lp gives the same results as the full lp'
+
+        basis = np.array([[1.0, 1.0], [0.0, 2.0]], dtype=float)
+        lps = [make_square_lp(basis), make_square_lp(basis, reduced=True)]
+
+        for direction in [[1.0, 0.0], [0.0, -1.0], [1.0, 1.0]]:
+            results = []
+
+            for lp in lps:
+                res = np.zeros(4)
+                lp.minimize(np.array(direction, dtype=float), res, error_if_infeasible=True)
+                results.append(res)
+
+            self.assertAlmostEqual(np.dot(results[0][:2], direction), np.dot(results[1][:2], direction))
+            self.assertTrue(np.allclose(results[1][:2], np.dot(results[1][2:], basis)))
+
+        # statuses from the reduced lp should be usable in the full lp
+        rows = np.zeros((6,), dtype=np.int8)
+        cols = np.zeros((4,), dtype=np.int8)
+        lps[1].get_row_statuses(rows)
+        lps[1].get_col_statuses(cols)
+        lps[0].set_standard_basis_statuses(rows, cols)
+
+        direction = np.array([2.0, 1.0], dtype=float)
+        res_full = np.zeros(4)
+        res_reduced = np.zeros(4)
+        self.assertTrue(lps[0].minimize(direction, res_full))
+        self.assertTrue(lps[1].minimize(direction, res_reduced))
+        self.assertAlmostEqual(np.dot(res_full[:2], direction), np.dot(res_reduced[:2], direction))
+
+    def test_minimize_batch(self):
+        'test that a batched minimize gives the same results and statuses as separate minimize calls'
+
+        basis = np.array([[1.0, 1.0], [0.0, 2.0]], dtype=float)
+        directions = np.array([[2.0, 1.0], [0.0, -1.0], [1.0, 1.0], [-1.0, 2.0]], dtype=float) # unique optima
+
+        for reduced in [True, False]:
+            lp = make_square_lp(basis, reduced=reduced)
+
+            results = np.zeros((4, 4))
+            row_statuses = np.zeros((4, 6), dtype=np.int8)
+            col_statuses = np.zeros((4, 4), dtype=np.int8)
+            self.assertTrue(lp.minimize_batch(directions, results, (row_statuses, col_statuses)))
+
+            for i in xrange(directions.shape[0]):
+                res = np.zeros(4)
+                rows = np.zeros((6,), dtype=np.int8)
+                cols = np.zeros((4,), dtype=np.int8)
+
+                lp.minimize(directions[i], res, error_if_infeasible=True)
+                lp.get_row_statuses(rows)
+                lp.get_col_statuses(cols)
+
+                self.assertTrue(np.allclose(res, results[i]))
+                self.assertTrue(np.array_equal(rows, row_statuses[i]))
+                self.assertTrue(np.array_equal(cols, col_statuses[i]))
+
+        # infeasible lp
+        lp = LpInstance(2, 2, reduced=True)
+        lp.update_basis_matrix(basis)
+        lp.add_basis_constraint(np.array([1.0, 0.0], dtype=float), -1.0)
+        lp.add_basis_constraint(np.array([-1.0, 0.0], dtype=float), -1.0)
+
+        self.assertFalse(lp.minimize_batch(directions, np.zeros((4, 2))))
+        self.assertRaises(RuntimeError, lp.minimize_batch, directions, np.zeros((4, 2)), None, True)
+
+    def test_trace_replay(self):
+        'test recording an lp trace and replaying it'
+
+        handle, filename = tempfile.mkstemp(suffix='.lpt')
+        os.close(handle)
+
+        try:
+            LpInstance.settings = LpSettings()
+            LpInstance.settings.trace_filename = filename
+
+            basis_matrix = np.array([[1.0, 1.0], [0.0, 2.0]], dtype=float)
+            lp = make_square_lp(basis_matrix)
+
+            res = np.zeros(4)
+            lp.minimize(np.array([1.0, 0.0], dtype=float), res)
+            lp.update_basis_matrix(basis_matrix) # unchanged, so it's skipped and not recorded
+            lp.set_basis_constraint_values(np.array([2.0, 1.0, 1.0, 1.0], dtype=float))
+            lp.minimize(np.array([1.0, 0.0], dtype=float), res)
+
+            del lp
+            LpInstance.close_trace()
+
+            ops = [op for op, _, _ in lptrace.read_trace(filename)]
+            self.assertEqual(ops.count(lptrace.OP_MINIMIZE), 2)
+            self.assertEqual(ops.count(lptrace.OP_UPDATE_BASIS_MATRIX), 1)
+            self.assertEqual(ops[-1], lptrace.OP_DELETE)
+
+            stats = lptrace.replay(filename, LpInstance)
+            self.assertEqual(stats.num_mismatches, 0)
+            self.assertEqual(stats.op_stats['minimize'][0], 2)
+        finally:
+            LpInstance.close_trace()
+            LpInstance.settings = LpSettings()
+            os.remove(filename)
+
+    def test_slow_lp_export(self):
+        'test that lps exceeding the slow lp thresholds are exported'
+
+        dirname = tempfile.mkdtemp()
+
+        try:
+            LpInstance.settings = LpSettings()
+            LpInstance.settings.slow_lp_iterations = 0
+            LpInstance.settings.slow_lp_dir = dirname
+
+            lp = make_square_lp(role=LpInstance.ROLE_INVARIANT)
+
+            lp.minimize(np.array([1.0, 1.0], dtype=float), np.zeros(4))
+
+            filenames = sorted(os.listdir(dirname))
+            self.assertEqual([os.path.splitext(f)[1] for f in filenames], ['.lp', '.txt'])
+
+            # the call site is the lp role
+            with open(os.path.join(dirname, filenames[1])) as f:
+                self.assertTrue("Call site: {}\n".format(LpInstance.ROLE_INVARIANT) in f.read())
+        finally:
+            LpInstance.settings = LpSettings()
+            shutil.rmtree(dirname)
+
+    def test_role_stats(self):
+        'test that per-lp statistics are accumulated by role'
+
+        lp = make_square_lp(role='test role')
+
+        lp.minimize(np.array([1.0, 1.0], dtype=float), np.zeros(4))
+        lp.add_basis_constraint(np.array([1.0, 0.0], dtype=float), -2.0) # makes it infeasible
+        lp.minimize(np.array([1.0, 1.0], dtype=float), np.zeros(4))
+
+        lp.set_role(LpInstance.ROLE_OTHER)
+        solves, _, infeasible, _ = LpInstance._role_stats['test role']
+        del LpInstance._role_stats['test role']
+
+        self.assertEqual(solves, 2)
+        self.assertEqual(infeasible, 1)
+
+    def test_gc_holding_stats_lock(self):
+        'test that an lp garbage-collected while the statistics lock is held does not deadlock'
+
+        class Cycle(object):
+            'an object in a reference cycle, which owns an lp'
+
+            def __init__(self):
+                self.lp = LpInstance(2, 2)
+                self.lp.set_role('gc role')
+                self.self_ref = self
+
+        def run():
+            'drop a cycle owning an lp, and collect it while holding the lock'
+
+            Cycle()
+
+            with LpInstance._stats_lock:
+                gc.collect()
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        thread.join(10)
+
+        self.assertFalse(thread.is_alive(), "garbage collection deadlocked")
+
+        # the statistics of the collected lp are added when harvesting
+        LpInstance._harvest_all()
+        self.assertTrue('gc role' in LpInstance._role_stats)
+        del LpInstance._role_stats['gc role']
+
+    def test_harvest_worker_lps(self):
+        'test that the statistics of lps created in a worker thread are harvested in that thread'
+
+        pool = PinnedThreadPool(1, thread_init=LpInstance.set_thread_executor)
+
+        def make_lp():
+            'create and solve an lp in the worker thread'
+
+            lp = make_square_lp(role='worker role')
+
+            lp.minimize(np.array([1.0, 1.0], dtype=float), np.zeros(4))
+
+            return lp, threading.current_thread()
+
+        lp, worker_thread = pool.map([(0, make_lp, ())])[0]
+        harvest_threads = []
+        harvest_stats = LpInstance._harvest_stats
+
+        def record_harvest(lpi, pending=False):
+            'record the thread, and harvest'
+
+            if lpi is lp:
+                harvest_threads.append(threading.current_thread())
+
+            harvest_stats(lpi, pending)
+
+        LpInstance._harvest_stats = record_harvest
+
+        try:
+            LpInstance._harvest_all()
+        finally:
+            LpInstance._harvest_stats = harvest_stats
+
+        self.assertEqual(harvest_threads, [worker_thread])
+        self.assertEqual(LpInstance._role_stats['worker role'][0], 1)
+        del LpInstance._role_stats['worker role']
+
 if __name__ == '__main__':
     unittest.main()
@@ -333,6 +333,38 @@ class TestSimUtil(unittest.TestCase):
 
         assert_array_almost_equal(sim_result, series_result)
 
+    def test_input_effects_sim(self):
+        '''test that input-effect rows simulated with the basis vectors match gb_t * basis matrix'''
+
+        a_matrix = np.array([[0.0, 1.0], [-1.0, 0.0]], dtype=float)
+        c_vector = [1.0, 0.0]
+        b_matrix = np.array([[1.0, 0.0, 2.0], [0.0, 0.5, 1.0]], dtype=float)
+        max_steps = 20
+
+        for sim_mode in [SimulationSettings.SIMULATION, SimulationSettings.MATRIX_EXP]:
+            settings = make_settings(0.1)
+            settings.sim_mode = sim_mode
+            bundle = SimulationBundle(a_matrix, c_vector, settings)
+
+            gb_t = bundle.compute_gbt(b_matrix)
+            bundle.set_input_rows(gb_t)
+
+            if sim_mode == SimulationSettings.SIMULATION:
+                bundle.presimulate(5) # later steps are simulated in chunks
+
+            prev_vals = None
+
+            for s in xrange(max_steps + 1):
+                vals, _ = bundle.get_vecs_origin_at_step(s, max_steps)
+
+                assert_array_almost_equal(bundle.get_input_effects_at_step(s), np.dot(gb_t, vals))
+
+                # the previous step is available too, even if the simulation advanced
+                if prev_vals is not None:
+                    assert_array_almost_equal(bundle.get_input_effects_at_step(s - 1), np.dot(gb_t, prev_vals))
+
+                prev_vals = vals.copy()
+
     def test_sim_types_shapes(self):
         '''check that the types and shapes returned by get_vecs_origin_at_step are correct'''
 
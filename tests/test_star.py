@@ -125,6 +125,7 @@ class TestStar(unittest.TestCase):
         b_list = [-4, 5, 1, 0]
 
         star = make_star(center, basis, a_list, b_list)
+        star.settings.plot.exact_projection = False # optimize in the plot_vecs directions
 
         Star.plot_vecs = [np.array([0, -1], dtype=float), # max(y)
                           np.array([-1, 0], dtype=float), # max(x)
@@ -831,5 +832,228 @@ class TestStar(unittest.TestCase):
         new_point = new_star.get_feasible_point(standard_dir=[5, -1])
         self.assertTrue(cur_star.contains_point(new_point))
 
+    def test_remove_redundant_constraints(self):
+        'test removing redundant constraints from a star'
+
+        a_list = [[1, 0], [-1, 0], [0, 1], [0, -1], [2, 0], [1, 1], [0, 0], [1, 0.5]]
+        b_list = [1, 1, 1, 1, 3, 5, 1, 1.25]
+
+        star = make_star([0, 0], [[1, 0], [0, 1]], a_list, b_list)
+        verts = star.verts()
+
+        num_removed = star.remove_redundant_constraints()
+
+        # [2, 0], [1, 1] and [0, 0] are redundant, [1, 0.5] cuts the corner
+        self.assertEqual(num_removed, 3)
+        self.assertEqual(len(star.constraint_list), 5)
+
+        star._verts = None
+        assert_allclose(star.verts(), verts)
+
+    def test_box_support(self):
+        'test that the closed-form minimize for box stars matches the lp result'
+
+        star = make_star([1, 2], [[1, 1], [-0.5, 2]], [[1, 0], [-1, 0], [0, 2], [0, -1], [3, 0]], [1, 0.5, 4, 1, 6])
+        low, high = star.box_bounds()
+        assert_allclose(low, [-0.5, -1])
+        assert_allclose(high, [1, 2])
+
+        for theta in np.linspace(0, 2 * math.pi, 37):
+            direction = np.array([math.cos(theta), math.sin(theta)])
+            box_result = np.zeros(4)
+            lp_result = np.zeros(4)
+
+            self.assertTrue(star.minimize(direction, box_result))
+            self.assertTrue(star.get_lpi().minimize(direction, lp_result))
+
+            self.assertAlmostEqual(np.dot(box_result[:2], direction), np.dot(lp_result[:2], direction))
+            self.assertTrue(star.contains_basis(box_result[2:], atol=1e-9))
+            assert_allclose(box_result[:2], np.dot(box_result[2:], star.basis_matrix))
+
+        # a general constraint means the lp must be used
+        star.add_basis_constraint(LinearConstraint([1, 1], 0.5))
+        self.assertEqual(star.box_bounds(), None)
+
+        # an empty box
+        star = make_star([0, 0], [[1, 0], [0, 1]], [[1, 0], [-1, 0], [0, 1], [0, -1]], [1, -2, 1, 1])
+        self.assertFalse(star.minimize(np.array([1.0, 0.0]), np.zeros(4)))
+        self.assertFalse(star.is_feasible())
+
+    def test_vectors_to_star_basis(self):
+        'test converting vectors to the star basis, using the cached basis factorization'
+
+        star = make_star([1, 2], [[2, 1], [-1, 3]], [[1, 0], [-1, 0], [0, 1], [0, -1]], [1, 1, 1, 1])
+        vecs = np.array([[1.0, 0.0], [0.5, -2.0], [3.0, 1.0]])
+
+        basis_vecs = star.vectors_to_star_basis(vecs)
+        assert_allclose(np.dot(basis_vecs, star.basis_matrix), vecs, atol=1e-12)
+
+        for i in xrange(len(vecs)):
+            assert_allclose(star.vector_to_star_basis(vecs[i]), basis_vecs[i])
+
+        # the factorization must be updated with the basis matrix
+        star.update_from_sim(np.array([[0.0, 1.0], [1.0, 1.0]]), np.array([0.0, 0.0]))
+        assert_allclose(np.dot(star.vectors_to_star_basis(vecs), star.basis_matrix), vecs, atol=1e-12)
+
+        # singular basis matrix
+        star.update_from_sim(np.array([[1.0, 1.0], [1.0, 1.0]]), np.array([0.0, 0.0]))
+        self.assertRaises(RuntimeError, star.vector_to_star_basis, vecs[1])
+
+    def test_constraint_matrix(self):
+        'test the matrix-backed constraint storage and the constraint_list views'
+
+        star = make_star([0, 0], [[1, 0], [0, 1]], [[1, 0], [-1, 0], [0, 1], [0, -1]], [1, 1, 1, 1])
+
+        for i in xrange(10):
+            star.add_basis_constraint(LinearConstraint([1, 1], 2 + i))
+
+        self.assertEqual(star.num_constraints, 14)
+        self.assertEqual(star.a_matrix.shape, (14, 2))
+        assert_allclose(star.a_matrix[-1], [1, 1])
+        self.assertEqual(star.constraint_list[-1].value, 11)
+        self.assertEqual([lc.value for lc in star.constraint_list[:2]], [1, 1])
+
+        # views modify the star's constraints
+        star.constraint_list[0].value = 0.5
+        self.assertEqual(star.b_vector[0], 0.5)
+        self.assertFalse(star.contains_basis(np.array([0.75, 0])))
+        self.assertTrue(star.contains_basis(np.array([0.5, 0])))
+
+        # clones have their own copy of the constraints
+        clone = star.clone()
+        clone.center_into_constraints(np.array([1.0, 0.0]))
+        self.assertEqual(star.b_vector[0], 0.5)
+        self.assertEqual(clone.b_vector[0], 1.5)
+        self.assertEqual(clone.b_vector[1], 0)
+
+    def test_exact_projection(self):
+        'test computing the exact polygon projection of a star'
+
+        # square with one corner cut off, in a rotated basis
+        a_list = [[1, 0], [-1, 0], [0, 1], [0, -1], [1, 1]]
+        b_list = [1, 1, 1, 1, 1.5]
+        star = make_star([1, 2], [[1, 1], [-1, 1]], a_list, b_list)
+
+        start_op = LpInstance.total_optimizations()
+        verts = star.verts()
+        num_op = LpInstance.total_optimizations() - start_op
+
+        # 5 verticies, plus the wrap-around point
+        self.assertEqual(len(verts), 6)
+        assert_allclose(verts[0], verts[-1])
+        self.assertLessEqual(num_op, 2 * 5 + 3)
+
+        # every vertex is in the star, and the polygon is counter-clockwise and contains the direction-based one
+        self.assertTrue(np.all(star.contains_points(np.array(verts), atol=1e-9)))
+
+        xy = np.array(verts)
+        area = 0.5 * np.sum(xy[:-1, 0] * xy[1:, 1] - xy[1:, 0] * xy[:-1, 1])
+        self.assertAlmostEqual(area, 2 * (4 - 0.125))
+
+        star._verts = None
+        star.settings.plot.exact_projection = False
+
+        for pt in star.verts():
+            edge_dists = [(b[0] - a[0]) * (pt[1] - a[1]) - (b[1] - a[1]) * (pt[0] - a[0])
+                          for a, b in zip(verts[:-1], verts[1:])]
+            self.assertGreater(min(edge_dists), -1e-9)
+
+        # degenerate projections: a segment and a point
+        star = make_star([0, 0], [[1, 1], [0, 0]], [[1, 0], [-1, 0], [0, 1], [0, -1]], [1, 1, 1, 1])
+        verts = star.verts()
+        self.assertEqual(len(verts), 3)
+        assert_allclose(sorted([tuple(v) for v in verts[:2]]), [(-1, -1), (1, 1)])
+
+        star = make_star([3, 4], [[0, 0], [0, 0]], [[1, 0], [-1, 0], [0, 1], [0, -1]], [1, 1, 1, 1])
+        assert_allclose(star.verts(), [[3, 4], [3, 4]])
+
+    def test_clone_copy_on_write(self):
+        'test that clones share constraint storage until one of them is modified'
+
+        star = make_star([0, 0], [[1, 0], [0, 1]], [[1, 0], [-1, 0], [0, 1], [0, -1]], [1, 1, 1, 1])
+        star.box_bounds()
+
+        clone = star.clone()
+        self.assertTrue(clone._storage is star._storage)
+        self.assertTrue(clone._guard_opt_data is None)
+        self.assertFalse(clone.a_matrix.flags.writeable)
+
+        # modifying the clone copies the storage, the original is unchanged
+        clone.add_basis_constraint(LinearConstraint([1, 1], 0.5))
+        self.assertFalse(clone._storage is star._storage)
+        self.assertEqual(star.num_constraints, 4)
+        self.assertEqual(clone.num_constraints, 5)
+        self.assertTrue(star.box_bounds() is not None)
+        self.assertTrue(clone.box_bounds() is None)
+
+        # modifying a constraint view of the original also copies the storage
+        clone2 = star.clone()
+        star.constraint_list[0].value = 2
+        self.assertEqual(star.b_vector[0], 2)
+        self.assertEqual(clone2.b_vector[0], 1)
+
+        # guard lps are created on first use
+        clone2.get_guard_intersections()
+        self.assertTrue(clone2._guard_opt_data is not None)
+
+        # once a clone is dropped, the storage is no longer shared and modifying the star doesn't copy it
+        clone3 = star.clone()
+        self.assertEqual(star._storage.num_sharing, 2)
+        del clone3
+
+        storage = star._storage
+        self.assertEqual(storage.num_sharing, 1)
+        star.add_basis_constraint(LinearConstraint([1, 1], 0.5))
+        self.assertTrue(star._storage is storage)
+
+    def test_lazy_guard_lps(self):
+        'test that the guard lps are created per transition, when they are first needed'
+
+        # a non-box star, so the guard checks use lps
+        star = make_star([0, 0], [[1, 0], [0, 1]], [[1, 0], [-1, 0], [0, 1], [0, -1], [1, 1]], [1, 1, 1, 1, 1.5])
+        mode = star.mode
+        ha = mode.parent
+
+        # x >= 0.5 and y >= 0.5 (feasible), x >= 2 and y >= 0 (infeasible)
+        for x_val in [0.5, 2]:
+            t = ha.new_transition(mode, mode)
+            t.condition_list.append(LinearConstraint([-1, 0], -x_val))
+            t.condition_list.append(LinearConstraint([0, -1], -0.5 if x_val < 1 else 0))
+
+        star.update_from_sim(np.array([[1, 0], [0, 1]], dtype=float), np.array([0, 0], dtype=float))
+        self.assertTrue(star._guard_opt_data is None)
+
+        self.assertTrue(star.get_guard_intersection(0) is not None)
+        self.assertEqual(star._guard_opt_data.num_created_lps(), 1)
+        self.assertEqual(star._guard_opt_data.total_steps, 1)
+
+        # constraints added before the lps are created are included in them
+        star.add_basis_constraint(LinearConstraint([-1, 0], -2))
+        self.assertTrue(star.get_guard_intersection(1) is None)
+        self.assertEqual(star._guard_opt_data.num_created_lps(), 2)
+
+        star.release_lps()
+        self.assertTrue(star._guard_opt_data is None)
+        self.assertTrue(star.get_guard_intersection(0) is None)
+        self.assertEqual(star._guard_opt_data.total_steps, 1)
+
+    def test_contains_points(self):
+        'test batch membership queries'
+
+        star = make_star([1, 2], [[1, 1], [-1, 1]], [[1, 0], [-1, 0], [0, 1], [0, -1], [1, 1]], [1, 1, 1, 1, 1.5])
+
+        pts = np.random.RandomState(0).uniform(-2, 4, size=(500, 2))
+        mask = star.contains_points(pts)
+
+        self.assertEqual(mask.shape, (500,))
+        self.assertTrue(np.any(mask))
+        self.assertFalse(np.all(mask))
+
+        for pt, contained in zip(pts, mask):
+            self.assertEqual(star.contains_point(pt), contained)
+
+        basis_vals = np.array([star.point_to_star_basis(pt) for pt in pts[:20]])
+        self.assertEqual(list(star.contains_basis_batch(basis_vals)), list(mask[:20]))
+
 if __name__ == '__main__':
     unittest.main()